@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import UserProfile
+from .models import UserProfile, AccountDeletion
 
 @admin.register(UserProfile)
 class UserProfileAdmin(UserAdmin):
@@ -15,3 +15,17 @@ class UserProfileAdmin(UserAdmin):
             'fields': ('profile_picture', 'skill_level', 'bio')
         }),
     )
+
+
+
+@admin.register(AccountDeletion)
+class AccountDeletionAdmin(admin.ModelAdmin):
+    """Progress of accounts being deleted by delete_accounts"""
+
+    list_display = ('username', 'user_id', 'requested_at', 'started_at', 'finished_at', 'current_table')
+    list_filter = ('finished_at',)
+    search_fields = ('username',)
+    readonly_fields = [field.name for field in AccountDeletion._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,90 @@
+"""
+Short-lived caching of authenticated users.
+
+Session requests (CachedAuthenticationMiddleware) and API token requests
+(CachedTokenAuthentication) look the user up in the cache before going
+to the database. Entries are dropped on logout, password change, profile
+save and token rotation (see accounts.signals); AUTH_CACHE_TIMEOUT bounds
+how long any other process can keep a stale copy.
+
+Those deletes have to reach every worker process, so this needs a shared
+Django cache (REDIS_URL in production). With a per-process cache such as
+the default LocMemCache a logout or password change would only be seen
+by the process that handled it, so nothing is cached and every request
+goes to the database as with Django's own AuthenticationMiddleware.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+
+from skilltracker.cache import is_shared
+
+
+def auth_cache_timeout():
+    return getattr(settings, 'AUTH_CACHE_TIMEOUT', 60)
+
+
+def caching_enabled():
+    return is_shared()
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def token_cache_key(key):
+    # never put raw tokens into cache keys
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def invalidate_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+def invalidate_token(key):
+    cache.delete(token_cache_key(key))
+
+
+def get_user_by_id(user_id):
+    """Return the user from the cache, loading and caching it on a miss"""
+    if not caching_enabled():
+        return get_user_model()._default_manager.filter(pk=user_id).first()
+    user = cache.get(user_cache_key(user_id))
+    if user is None:
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(user_cache_key(user_id), user, auth_cache_timeout())
+    return user
+
+
+def get_cached_user(request):
+    """
+    Cached version of django.contrib.auth.get_user. Anything unusual
+    (unknown backend, stale session hash, inactive user) falls back to
+    Django's own lookup so its session handling still applies.
+    """
+    if not caching_enabled():
+        return auth.get_user(request)
+    try:
+        user_id = get_user_model()._meta.pk.to_python(request.session[SESSION_KEY])
+        backend_path = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return auth.get_user(request)
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+
+    user = get_user_by_id(user_id)
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if (
+        user is None
+        or not user.is_active
+        or not session_hash
+        or not constant_time_compare(session_hash, user.get_session_auth_hash())
+    ):
+        return auth.get_user(request)
+    user.backend = backend_path
+    return user
@@ -0,0 +1,30 @@
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .auth_cache import caching_enabled, get_user_by_id, token_cache_key, auth_cache_timeout
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that caches token -> user id and the user itself"""
+
+    def authenticate_credentials(self, key):
+        if not caching_enabled():
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        user_id = cache.get(cache_key)
+        if user_id is None:
+            model = self.get_model()
+            user_id = model.objects.filter(key=key).values_list('user_id', flat=True).first()
+            if user_id is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            cache.set(cache_key, user_id, auth_cache_timeout())
+
+        user = get_user_by_id(user_id)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        # an unsaved Token stands in for the row we didn't load
+        return (user, self.get_model()(key=key, user_id=user_id))
@@ -0,0 +1,105 @@
+"""
+Account deletion in the background.
+
+Deleting a user in one go cascades over every progress entry, event and
+notification they ever had: one transaction holding locks on all of it
+for as long as that takes. Instead request_deletion() only deactivates
+the account, which logs the user out everywhere at once, and records an
+AccountDeletion. `manage.py delete_accounts` then empties each table
+referencing the user in batches of a bounded size, one short
+transaction per batch, and deletes the user row last.
+
+The rows still left are the state: a run that crashed or was stopped
+simply starts over and finds less to delete. Each batch commits
+together with the progress counts on the AccountDeletion row.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AccountDeletion
+
+BATCH_SIZE = 500
+PAUSE = 0.0  # seconds between batches, gives replicas and other writers room
+
+
+def request_deletion(user):
+    """Deactivate `user` now and queue the rest, returns the AccountDeletion"""
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        deletion, _ = AccountDeletion.objects.get_or_create(
+            user_id=user.pk, defaults={'username': user.username}
+        )
+    return deletion
+
+
+def related_tables():
+    """(model, field name) of every table that cascades from the user"""
+    tables = []
+    for relation in get_user_model()._meta.related_objects:
+        if relation.many_to_many or relation.on_delete.__name__ != 'CASCADE':
+            continue
+        tables.append((relation.related_model, relation.field.name))
+    return tables
+
+
+def _delete_batch(deletion_id, model, field, user_id, batch_size):
+    from tracker.models import SkillLearner
+    from tracker.popularity import refresh_counters
+    from tracker.signals import deleting_account
+
+    with transaction.atomic():
+        deletion = AccountDeletion.objects.select_for_update().get(pk=deletion_id)
+        rows = model._base_manager.filter(**{field: user_id}).order_by()
+        ids = list(rows.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        skill_ids = None
+        if model is SkillLearner:
+            skill_ids = set(model._base_manager.filter(pk__in=ids).values_list('skill_id', flat=True))
+        # no tombstones, and no per-row unindexing or forecast refreshes
+        with deleting_account():
+            _, counts = model._base_manager.filter(pk__in=ids).delete()
+        if skill_ids:
+            # the popularity counters still include this learner
+            refresh_counters(skill_ids)
+
+        for label, count in counts.items():
+            deletion.deleted_rows[label] = deletion.deleted_rows.get(label, 0) + count
+        deletion.current_table = model._meta.label
+        deletion.save(update_fields=['deleted_rows', 'current_table'])
+    return len(ids)
+
+
+def process(deletion, batch_size=BATCH_SIZE, pause=PAUSE):
+    """
+    Delete everything belonging to `deletion`'s user, then the user.
+    Safe to call again after an interruption. Returns the AccountDeletion.
+    """
+    if deletion.started_at is None:
+        deletion.started_at = timezone.now()
+        deletion.save(update_fields=['started_at'])
+
+    for model, field in related_tables():
+        while _delete_batch(deletion.pk, model, field, deletion.user_id, batch_size):
+            if pause:
+                time.sleep(pause)
+
+    with transaction.atomic():
+        deletion = AccountDeletion.objects.select_for_update().get(pk=deletion.pk)
+        # rows written since their table was emptied go with the user
+        _, counts = get_user_model()._base_manager.filter(pk=deletion.user_id).delete()
+        for label, count in counts.items():
+            deletion.deleted_rows[label] = deletion.deleted_rows.get(label, 0) + count
+        deletion.current_table = ''
+        deletion.last_error = ''
+        deletion.finished_at = timezone.now()
+        deletion.save(update_fields=['deleted_rows', 'current_table', 'last_error', 'finished_at'])
+    return deletion
+
+
+def pending():
+    return AccountDeletion.objects.filter(finished_at__isnull=True)
@@ -21,3 +21,18 @@ class CustomUserCreationForm(UserCreationForm):
         if commit == True:
             user.save()
         return user
+
+
+class DeleteAccountForm(forms.Form):
+    # ask for the password again before deleting everything
+    password = forms.CharField(widget=forms.PasswordInput)
+
+    def __init__(self, user, *args, **kwargs):
+        self.user = user
+        super().__init__(*args, **kwargs)
+
+    def clean_password(self):
+        password = self.cleaned_data['password']
+        if not self.user.check_password(password):
+            raise forms.ValidationError('Incorrect password.')
+        return password
@@ -0,0 +1,134 @@
+"""
+Profile picture pipeline.
+
+Uploaded pictures are re-encoded without metadata, bounded to
+MAX_DIMENSION and stored under a content-hash filename. Square WebP and
+JPEG thumbnails are pre-generated for every size in THUMBNAIL_SIZES so
+templates never have to serve the original upload.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .auth_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+MAX_DIMENSION = 1024
+THUMBNAIL_SIZES = (32, 64, 128, 256)
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+# one worker is enough, uploads are rare and this keeps CPU use bounded
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-pictures')
+
+
+def picture_name(picture_hash):
+    return f'profile_pics/{picture_hash}.jpg'
+
+
+def thumbnail_name(picture_hash, size, ext):
+    return f'profile_pics/thumbs/{picture_hash}_{size}.{ext}'
+
+
+def thumbnail_url(user, size=64, ext='jpg'):
+    """Return the url of the smallest thumbnail at least `size` pixels wide"""
+    if not user.profile_picture:
+        return ''
+    if not user.profile_picture_hash:
+        # not processed yet, fall back to the original upload
+        return user.profile_picture.url
+    size = int(size)
+    chosen = next((s for s in THUMBNAIL_SIZES if s >= size), THUMBNAIL_SIZES[-1])
+    return default_storage.url(thumbnail_name(user.profile_picture_hash, chosen, ext))
+
+
+def _encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def _clean_image(file):
+    """Open an upload, apply EXIF rotation and drop all metadata"""
+    image = Image.open(file)
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # flatten transparency onto white, JPEG has no alpha channel
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    else:
+        image = image.convert('RGB')
+    # a fresh image carries pixels only, no EXIF/ICC/XMP
+    clean = Image.new('RGB', image.size)
+    clean.paste(image)
+    clean.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+    return clean
+
+
+def _save_if_missing(name, content):
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+
+
+def process_profile_picture(user_id):
+    """Clean the user's picture and pre-generate all thumbnails"""
+    from .models import UserProfile
+
+    user = UserProfile.objects.filter(pk=user_id).first()
+    if user is None or not user.profile_picture:
+        return None
+
+    original_name = user.profile_picture.name
+    with user.profile_picture.open('rb') as file:
+        image = _clean_image(file)
+
+    content = _encode(image, 'JPEG', quality=85, optimize=True)
+    picture_hash = hashlib.sha256(content).hexdigest()[:16]
+    _save_if_missing(picture_name(picture_hash), content)
+
+    for size in THUMBNAIL_SIZES:
+        thumb = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for ext, image_format in THUMBNAIL_FORMATS.items():
+            _save_if_missing(
+                thumbnail_name(picture_hash, size, ext),
+                _encode(thumb, image_format, quality=80),
+            )
+
+    # only swap the picture if the user didn't upload another one meanwhile
+    updated = UserProfile.objects.filter(pk=user.pk, profile_picture=original_name).update(
+        profile_picture=picture_name(picture_hash),
+        profile_picture_hash=picture_hash,
+    )
+    if updated:
+        # update() sends no post_save, drop the cached user by hand
+        invalidate_user(user.pk)
+        if original_name != picture_name(picture_hash):
+            default_storage.delete(original_name)
+    return picture_hash
+
+
+def _process_in_background(user_id):
+    close_old_connections()
+    try:
+        process_profile_picture(user_id)
+    except Exception:
+        logger.exception('Processing profile picture for user %s failed', user_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_profile_picture(user):
+    """Process the user's picture once the current transaction commits"""
+    if getattr(settings, 'PROFILE_PICTURE_ASYNC', True):
+        transaction.on_commit(lambda: _executor.submit(_process_in_background, user.pk))
+    else:
+        transaction.on_commit(lambda: process_profile_picture(user.pk))
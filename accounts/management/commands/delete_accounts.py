@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from accounts.deletion import BATCH_SIZE, PAUSE, pending, process
+from accounts.models import AccountDeletion
+
+
+class Command(BaseCommand):
+    help = 'Delete the data of deactivated accounts in small batches, resuming unfinished ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=PAUSE, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        finished = 0
+        for deletion in pending():
+            try:
+                deletion = process(deletion, options['batch_size'], options['pause'])
+            except Exception as exc:
+                # keep going, the next run picks this one up where it stopped
+                AccountDeletion.objects.filter(pk=deletion.pk).update(last_error=str(exc))
+                self.stderr.write(f'{deletion.username}: {exc}')
+                continue
+            finished += 1
+            rows = sum(deletion.deleted_rows.values())
+            self.stdout.write(f'{deletion.username}: {rows} rows deleted')
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {finished} accounts'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from accounts.images import process_profile_picture
+from accounts.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Clean profile pictures and generate thumbnails for users missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Reprocess every picture, not just new ones')
+
+    def handle(self, *args, **options):
+        users = UserProfile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if not options['all']:
+            users = users.filter(profile_picture_hash='')
+
+        processed = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            try:
+                process_profile_picture(user_id)
+                processed += 1
+            except Exception as exc:
+                self.stderr.write(f'user {user_id}: {exc}')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} profile pictures'))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userprofile_profile_picture_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(unique=True)),
+                ('username', models.CharField(max_length=150)),
+                ('requested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('current_table', models.CharField(blank=True, max_length=100)),
+                ('deleted_rows', models.JSONField(default=dict)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['requested_at'],
+            },
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import timedelta
 
+from skilltracker.cache import cached, per_user
+
 class UserProfile(AbstractUser):
     # different skill levels available for users
     SKILL_LEVELS = [
@@ -14,6 +16,8 @@ class UserProfile(AbstractUser):
     ]
     
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    # content hash of the processed picture, names its pre-generated thumbnails
+    profile_picture_hash = models.CharField(max_length=16, blank=True, editable=False)
     skill_level = models.CharField(max_length=20, choices=SKILL_LEVELS, default='beginner')
     bio = models.TextField(max_length=500, blank=True)
     date_joined = models.DateTimeField(auto_now_add=True)
@@ -25,17 +29,20 @@ class UserProfile(AbstractUser):
     def __str__(self):
         return self.username
     
+    @cached(timeout=300, namespace=per_user)
     def get_total_hours(self):
         """Get total hours practiced by user"""
-        from tracker.models import ProgressEntry
-        total = ProgressEntry.objects.filter(user=self).aggregate(Sum('hours_spent'))['hours_spent__sum']
-        return total or 0
+        from tracker.archive import lifetime_totals
+        total_hours, total_sessions = lifetime_totals(self)
+        return total_hours
     
+    @cached(timeout=300, namespace=per_user)
     def get_total_goals_completed(self):
         """Get total completed goals"""
         from tracker.models import Goal
         return Goal.objects.filter(user=self, completed=True).count()
     
+    @cached(timeout=300, namespace=per_user)
     def get_current_streak(self):
         """Calculate current learning streak in days"""
         from tracker.models import ProgressEntry
@@ -54,6 +61,7 @@ class UserProfile(AbstractUser):
                 
         return streak
     
+    @cached(timeout=300, namespace=per_user)
     def get_weekly_hours(self):
         """Get hours practiced this week"""
         from tracker.models import ProgressEntry
@@ -68,9 +76,10 @@ class UserProfile(AbstractUser):
         
         return weekly_hours or 0
     
+    @cached(timeout=300, namespace=per_user)
     def get_skill_distribution(self):
         """Get hours distribution by skill category"""
-        from tracker.models import ProgressEntry
+        from tracker.models import ProgressEntry, ProgressSummary, Skill
         
         progress_entries = ProgressEntry.objects.filter(user=self)
         distribution = {}
@@ -82,6 +91,13 @@ class UserProfile(AbstractUser):
             else:
                 distribution[category] = float(entry.hours_spent)
         
+        # archived entries only survive as monthly summaries
+        archived = ProgressSummary.objects.filter(user=self).values('skill__category').annotate(hours=Sum('hours_spent'))
+        categories = dict(Skill.CATEGORIES)
+        for row in archived:
+            category = categories.get(row['skill__category'], row['skill__category'])
+            distribution[category] = distribution.get(category, 0) + float(row['hours'])
+        
         return distribution
     
     def get_progress_level(self):
@@ -95,4 +111,26 @@ class UserProfile(AbstractUser):
         elif total_hours >= 20:
             return 'Intermediate'
         else:
-            return 'Beginner'
\ No newline at end of file
+            return 'Beginner'
+
+class AccountDeletion(models.Model):
+    """
+    A deleted account whose data is still being removed. The user row
+    goes last, so user_id is kept as a plain column rather than a foreign
+    key and this record outlives it. See accounts.deletion.
+    """
+    user_id = models.BigIntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    requested_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # table being emptied and rows deleted so far per table
+    current_table = models.CharField(max_length=100, blank=True)
+    deleted_rows = models.JSONField(default=dict)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['requested_at']
+
+    def __str__(self):
+        return f"{self.username} ({'done' if self.finished_at else 'pending'})"
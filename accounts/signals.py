@@ -0,0 +1,33 @@
+from django.apps import apps
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .auth_cache import invalidate_user, invalidate_token
+from .models import UserProfile
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def drop_cached_user(sender, instance, **kwargs):
+    # covers profile edits, password changes and last_login updates
+    invalidate_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def drop_cached_user_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
+
+
+def drop_cached_token(sender, instance, **kwargs):
+    # rotating a token deletes the old row and creates a new one
+    invalidate_token(instance.key)
+
+
+# html-only workers run without DRF (settings.WORKER_ROLE)
+if apps.is_installed('rest_framework.authtoken'):
+    from rest_framework.authtoken.models import Token
+    
+    post_save.connect(drop_cached_token, sender=Token)
+    post_delete.connect(drop_cached_token, sender=Token)
@@ -0,0 +1,11 @@
+from django import template
+
+from accounts.images import thumbnail_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def profile_picture_url(user, size=64, ext='jpg'):
+    """Usage: {% profile_picture_url user 64 'webp' %}"""
+    return thumbnail_url(user, size, ext)
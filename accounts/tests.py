@@ -1 +1,188 @@
-from django.test import TestCase
+import hashlib
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from tracker.models import Skill, ProgressEntry, Goal, GoalForecast, SearchDocument, DeletedRecord
+from . import deletion, images
+from .auth_cache import user_cache_key
+from .models import AccountDeletion
+
+
+class AuthCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('learner', password='pw')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def authenticate(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/goals/').status_code, 200)
+        self.client.logout()
+        response = self.client.get('/api/goals/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_cached_per_process(self):
+        # the test settings use LocMemCache, a logout elsewhere would never reach it
+        self.authenticate()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_cached_when_shared(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        }):
+            self.authenticate()
+            self.assertEqual(cache.get(user_cache_key(self.user.pk)), self.user)
+            self.user.save()
+            self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+
+class AccountDeletionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('leaving', password='pw')
+        cls.skill = Skill.objects.create(name='Python', category='backend', difficulty='easy')
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for day in range(6):
+                ProgressEntry.objects.create(
+                    user=self.user, skill=self.skill, date=date(2024, 1, day + 1), hours_spent=Decimal('1'),
+                )
+            for i in range(2):
+                Goal.objects.create(user=self.user, skill=self.skill, title=f'Goal {i}', deadline=date.today() + timedelta(days=9))
+        self.assertEqual(GoalForecast.objects.count(), 2)
+
+    def test_request_deletion(self):
+        requested = deletion.request_deletion(self.user)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual((requested.user_id, requested.username), (self.user.pk, 'leaving'))
+        self.assertEqual(deletion.request_deletion(self.user), requested)
+        self.assertEqual(list(deletion.pending()), [requested])
+
+    def test_process(self):
+        requested = deletion.request_deletion(self.user)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks() as callbacks:
+            finished = deletion.process(requested, batch_size=4)
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists())
+        self.assertIsNotNone(finished.finished_at)
+        # search documents and forecasts go in their own batches, not one query per row
+        unindexed = [query for query in queries if query['sql'].startswith('DELETE FROM "tracker_searchdocument"')]
+        # two batches of four, then the fast delete of the user's cascade
+        self.assertEqual(len(unindexed), 3)
+        self.assertEqual(callbacks, [])
+        self.assertFalse(DeletedRecord.objects.exists())
+
+        rows = finished.deleted_rows
+        self.assertEqual(rows['tracker.ProgressEntry'], 6)
+        self.assertEqual(rows['tracker.Goal'], 2)
+        self.assertEqual(rows['tracker.GoalForecast'], 2)
+        self.assertEqual(rows['tracker.SearchDocument'], 8)
+        self.assertEqual(rows['accounts.UserProfile'], 1)
+        self.assertFalse(SearchDocument.objects.exists())
+
+    def test_process_resumes_after_an_interruption(self):
+        requested = deletion.request_deletion(self.user)
+        delete_batch = deletion._delete_batch
+        batches = []
+
+        def interrupted(*args):
+            # two batches in, the connection drops
+            if len(batches) == 2:
+                raise ConnectionError('connection lost')
+            deleted = delete_batch(*args)
+            if deleted:
+                batches.append(deleted)
+            return deleted
+
+        with mock.patch.object(deletion, '_delete_batch', interrupted), self.assertRaises(ConnectionError):
+            deletion.process(requested, batch_size=2)
+        interrupted_at = AccountDeletion.objects.get(pk=requested.pk)
+        self.assertIsNone(interrupted_at.finished_at)
+        self.assertTrue(interrupted_at.deleted_rows)
+
+        finished = deletion.process(interrupted_at, batch_size=2)
+        self.assertIsNotNone(finished.finished_at)
+        self.assertEqual(finished.deleted_rows['tracker.ProgressEntry'], 6)
+        self.assertEqual(finished.deleted_rows['tracker.SearchDocument'], 8)
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists())
+
+
+class ProfilePictureTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = Path(media_root.name)
+        settings = override_settings(MEDIA_ROOT=media_root.name, PROFILE_PICTURE_ASYNC=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = get_user_model().objects.create_user('learner', password='pw')
+        self.client.force_login(self.user)
+
+    def upload(self):
+        # wider than MAX_DIMENSION and with an alpha channel to flatten
+        buffer = BytesIO()
+        Image.new('RGBA', (1600, 400), (200, 30, 30, 128)).save(buffer, format='PNG')
+        picture = SimpleUploadedFile('me.png', buffer.getvalue(), content_type='image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/accounts/profile/', {
+                'first_name': '', 'last_name': '', 'email': '', 'skill_level': 'beginner', 'bio': '',
+                'profile_picture': picture,
+            })
+        self.assertEqual(response.status_code, 302)
+        self.user.refresh_from_db()
+
+    def render_tag(self, *args):
+        template = Template('{% load profile_pictures %}{% profile_picture_url user ' + ' '.join(args) + ' %}')
+        return template.render(Context({'user': self.user}))
+
+    def test_upload_is_processed(self):
+        self.upload()
+        picture_hash = self.user.profile_picture_hash
+        self.assertEqual(self.user.profile_picture.name, f'profile_pics/{picture_hash}.jpg')
+        stored = (self.media_root / self.user.profile_picture.name).read_bytes()
+        self.assertEqual(hashlib.sha256(stored).hexdigest()[:16], picture_hash)
+        with Image.open(BytesIO(stored)) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (1024, 256)))
+            self.assertEqual(len(image.getexif()), 0)
+        # the upload itself is replaced by the cleaned copy
+        self.assertFalse((self.media_root / 'profile_pics' / 'me.png').exists())
+
+        thumbs = sorted(path.name for path in (self.media_root / 'profile_pics' / 'thumbs').iterdir())
+        self.assertEqual(thumbs, sorted(
+            f'{picture_hash}_{size}.{ext}' for size in images.THUMBNAIL_SIZES for ext in images.THUMBNAIL_FORMATS
+        ))
+        with Image.open(self.media_root / images.thumbnail_name(picture_hash, 64, 'webp')) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (64, 64)))
+
+        self.assertEqual(self.render_tag('50', "'webp'"), f'/media/profile_pics/thumbs/{picture_hash}_64.webp')
+        self.assertEqual(self.render_tag(), f'/media/profile_pics/thumbs/{picture_hash}_64.jpg')
+        self.assertEqual(self.render_tag('1000'), f'/media/profile_pics/thumbs/{picture_hash}_256.jpg')
+
+    def test_same_picture_keeps_its_name(self):
+        self.upload()
+        first = self.user.profile_picture_hash
+        self.upload()
+        self.assertEqual(self.user.profile_picture_hash, first)
+        self.assertEqual(len(list((self.media_root / 'profile_pics').glob('*.jpg'))), 1)
+
+    def test_tag_before_processing(self):
+        self.assertEqual(self.render_tag(), '')
+        with mock.patch('accounts.views.schedule_profile_picture'):
+            self.upload()
+        self.assertEqual(self.user.profile_picture_hash, '')
+        self.assertEqual(self.render_tag(), f'/media/{self.user.profile_picture.name}')
@@ -1,10 +1,12 @@
 from django.shortcuts import render, redirect
-from django.views.generic import CreateView, UpdateView
+from django.views.generic import CreateView, UpdateView, FormView
 from django.contrib.auth import login, logout
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from .models import UserProfile
-from .forms import CustomUserCreationForm
+from .forms import CustomUserCreationForm, DeleteAccountForm
+from .images import schedule_profile_picture
+from .deletion import request_deletion
 
 
 def logout_view(request):
@@ -34,3 +36,30 @@ class ProfileView(LoginRequiredMixin, UpdateView):
     def get_object(self):        
         user = self.request.user
         return user
+    
+    def form_valid(self, form):
+        if 'profile_picture' in form.changed_data:
+            # old thumbnails belong to the old picture
+            form.instance.profile_picture_hash = ''
+        response = super().form_valid(form)
+        if 'profile_picture' in form.changed_data and self.object.profile_picture:
+            # resize and generate thumbnails off the request thread
+            schedule_profile_picture(self.object)
+        return response
+
+
+class DeleteAccountView(LoginRequiredMixin, FormView):
+    form_class = DeleteAccountForm
+    template_name = 'accounts/delete_account.html'
+    success_url = reverse_lazy('tracker:dashboard')
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        # the account is closed now, its data goes in the background (delete_accounts)
+        request_deletion(self.request.user)
+        logout(self.request)
+        return super().form_valid(form)
@@ -0,0 +1,345 @@
+"""
+Two-tier cache for expensive aggregates.
+
+L1 is a small LRU dict in each process, L2 the shared Django cache
+(settings.CACHES). Values carry how long they took to compute and when
+they expire, which gives:
+
+- single-flight: only one caller recomputes a missing key. Threads of a
+  process wait on a lock, other processes on a short-lived lock key in
+  L2, and get the fresh value once it lands.
+- probabilistic early refresh (XFetch): as the expiry approaches a
+  reader is more and more likely to recompute ahead of time, weighted
+  by the compute time, so a popular key is refreshed by one caller
+  before it expires instead of by all of them after.
+- per-namespace versions: bump('user:5') makes every key cached under
+  that namespace unreachable, without knowing the keys. The version is
+  always read from L2 so the bump is seen by every process at once.
+  bump_on_commit() bumps once the transaction commits, once per
+  namespace however many rows it wrote.
+- hit/miss/latency counters, see stats().
+
+All of this needs an L2 every worker process shares. With a per-process
+cache (LocMemCache, no REDIS_URL) a bump would only reach the process
+that made it, so the cache stays off and every call computes, unless
+TIERED_CACHE_LOCAL says there is a single process anyway.
+
+Use the @cached decorator on functions and methods.
+"""
+import functools
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+from django.views import View
+
+L1_SIZE = 1024
+L1_TIMEOUT = 5  # seconds, bounds how stale a process may be after delete()
+LOCK_TIMEOUT = 30
+WAIT_INTERVAL = 0.05
+BETA = 1.0  # > 1 refreshes earlier, < 1 later
+LOCK_STRIPES = 256
+# backends whose entries live in the memory of one process
+LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def is_shared(alias='default'):
+    """Whether every worker process sees the same Django cache `alias`"""
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_BACKENDS
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with per-entry expiry"""
+
+    def __init__(self, maxsize=L1_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class _PendingBumps:
+    """on_commit callback bumping the namespaces written in one transaction"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.namespaces = set()
+
+    def __call__(self):
+        for namespace in self.namespaces:
+            self.cache.bump(namespace)
+
+
+class TieredCache:
+
+    def __init__(self, alias='default', prefix='tc', l1_size=L1_SIZE, l1_timeout=L1_TIMEOUT):
+        self.alias = alias
+        self.prefix = prefix
+        self.l1 = LRUCache(l1_size)
+        self.l1_timeout = l1_timeout
+        # striped, so the number of locks stays fixed however many keys there
+        # are; reentrant because cached functions may call each other
+        self._locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def l2(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return is_shared(self.alias) or getattr(settings, 'TIERED_CACHE_LOCAL', False)
+
+    # counters
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {
+                'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'early_refreshes': 0,
+                'coalesced': 0, 'computes': 0, 'compute_seconds': 0.0, 'get_seconds': 0.0, 'gets': 0,
+            }
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, amount in increments.items():
+                self._stats[name] += amount
+
+    def stats(self):
+        """Counters for this process, with hit ratio and mean latencies"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        gets = stats['gets'] or 1
+        stats['hit_ratio'] = (stats['l1_hits'] + stats['l2_hits']) / gets
+        stats['mean_get_ms'] = stats['get_seconds'] / gets * 1000
+        stats['mean_compute_ms'] = stats['compute_seconds'] / (stats['computes'] or 1) * 1000
+        return stats
+
+    # keys
+
+    def _version(self, namespace):
+        if namespace is None:
+            return 0
+        return self.l2.get(f'{self.prefix}:v:{namespace}', 0)
+
+    def full_key(self, key, namespace=None):
+        if namespace is None:
+            return f'{self.prefix}:{key}'
+        return f'{self.prefix}:{namespace}:{self._version(namespace)}:{key}'
+
+    def bump(self, namespace):
+        """Invalidate everything cached under `namespace`"""
+        version_key = f'{self.prefix}:v:{namespace}'
+        self.l2.add(version_key, 0, None)
+        try:
+            self.l2.incr(version_key)
+        except ValueError:  # evicted in between
+            self.l2.set(version_key, 1, None)
+
+    def bump_on_commit(self, namespace, using=None):
+        """
+        bump() after the current transaction commits, so no reader caches
+        the old rows under the new version. One bump per namespace and
+        transaction, whatever the number of rows written.
+        """
+        connection = transaction.get_connection(using)
+        # callbacks of a rolled back transaction are dropped along with it
+        for _, callback, _ in connection.run_on_commit:
+            if isinstance(callback, _PendingBumps) and callback.cache is self:
+                callback.namespaces.add(namespace)
+                return
+        pending = _PendingBumps(self)
+        pending.namespaces.add(namespace)
+        transaction.on_commit(pending, using=using)
+
+    def delete(self, key, namespace=None):
+        full_key = self.full_key(key, namespace)
+        self.l1.delete(full_key)
+        self.l2.delete(full_key)
+
+    # lookups
+
+    def _process_lock(self, key):
+        return self._locks[hash(key) % LOCK_STRIPES]
+
+    @staticmethod
+    def _should_refresh(entry, beta):
+        _, delta, expires = entry
+        # XFetch: -log(random()) is exponential, so most reads pass and a few
+        # recompute ahead, more often the closer to expiry and the slower the compute
+        return time.time() - delta * beta * math.log(random.random() or 1e-12) >= expires
+
+    def _store(self, full_key, entry, timeout):
+        self.l2.set(full_key, entry, timeout)
+        self.l1.set(full_key, entry, min(self.l1_timeout, timeout))
+
+    def _compute(self, full_key, compute, timeout):
+        start = time.perf_counter()
+        value = compute()
+        delta = time.perf_counter() - start
+        self._count(computes=1, compute_seconds=delta)
+        entry = (value, delta, time.time() + timeout)
+        self._store(full_key, entry, timeout)
+        return entry
+
+    def _compute_uncached(self, compute):
+        start = time.perf_counter()
+        try:
+            return compute()
+        finally:
+            delta = time.perf_counter() - start
+            self._count(computes=1, compute_seconds=delta, get_seconds=delta)
+
+    def _wait_for(self, full_key, deadline):
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            entry = self.l2.get(full_key)
+            if entry is not None:
+                return entry
+        return None
+
+    def get_or_set(self, key, compute, timeout, namespace=None, beta=BETA):
+        """Return the cached value of `key`, calling compute() at most once across callers"""
+        start = time.perf_counter()
+        if not self.enabled:
+            self._count(gets=1, misses=1)
+            return self._compute_uncached(compute)
+        try:
+            return self._get_or_set(self.full_key(key, namespace), compute, timeout, beta)
+        finally:
+            self._count(gets=1, get_seconds=time.perf_counter() - start)
+
+    def _get_or_set(self, full_key, compute, timeout, beta):
+        entry = self.l1.get(full_key)
+        if entry is not None and not self._should_refresh(entry, beta):
+            self._count(l1_hits=1)
+            return entry[0]
+        if entry is None:
+            entry = self.l2.get(full_key)
+            if entry is not None and not self._should_refresh(entry, beta):
+                self._count(l2_hits=1)
+                self.l1.set(full_key, entry, min(self.l1_timeout, max(entry[2] - time.time(), 0)))
+                return entry[0]
+
+        stale = entry
+        lock = self._process_lock(full_key)
+        if stale is not None:
+            acquired = lock.acquire(blocking=False)
+        else:
+            acquired = lock.acquire(timeout=LOCK_TIMEOUT)
+        if not acquired:
+            if stale is not None:
+                # someone in this process is refreshing, the stale value will do
+                self._count(coalesced=1)
+                return stale[0]
+            self._count(misses=1)
+            return self._compute(full_key, compute, timeout)[0]
+        try:
+            if stale is None:
+                # another thread may have filled it while we waited
+                entry = self.l1.get(full_key)
+                if entry is not None:
+                    self._count(coalesced=1)
+                    return entry[0]
+
+            lock_key = f'{full_key}:lock'
+            if self.l2.add(lock_key, 1, LOCK_TIMEOUT):
+                try:
+                    self._count(**({'early_refreshes': 1} if stale else {'misses': 1}))
+                    return self._compute(full_key, compute, timeout)[0]
+                finally:
+                    self.l2.delete(lock_key)
+
+            # another process is computing it
+            self._count(coalesced=1)
+            if stale is not None:
+                return stale[0]
+            entry = self._wait_for(full_key, time.monotonic() + LOCK_TIMEOUT)
+            if entry is not None:
+                self.l1.set(full_key, entry, min(self.l1_timeout, max(entry[2] - time.time(), 0)))
+                return entry[0]
+            self._count(misses=1)
+            return self._compute(full_key, compute, timeout)[0]
+        finally:
+            lock.release()
+
+
+tiered_cache = TieredCache()
+
+
+def _key_part(value):
+    if isinstance(value, models.Model):
+        return f'{value._meta.label_lower}.{value.pk}'
+    return str(value)
+
+
+def per_user(*args, **kwargs):
+    """Namespace for @cached: the first user argument (or self on UserProfile)"""
+    from django.contrib.auth import get_user_model
+    user_model = get_user_model()
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, user_model):
+            return f'user:{value.pk}'
+    return None
+
+
+def cached(timeout=60, namespace=None, cache=None):
+    """
+    Cache a function's return value in the tiered cache. The key is the
+    function's dotted name plus its arguments; model instances stand in
+    by their pk, a view instance (`self` of a view method) is left out.
+    `namespace(*args, **kwargs)` picks a namespace that can be bumped to
+    invalidate, e.g. per_user. Return values must be picklable.
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parts = [_key_part(arg) for arg in args if not isinstance(arg, View)]
+            parts += [f'{key}={_key_part(value)}' for key, value in sorted(kwargs.items())]
+            key = ':'.join([name] + parts)
+            return (cache or tiered_cache).get_or_set(
+                key,
+                lambda: func(*args, **kwargs),
+                timeout,
+                namespace=namespace(*args, **kwargs) if namespace else None,
+            )
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
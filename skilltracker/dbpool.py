@@ -0,0 +1,142 @@
+"""
+Database connection reuse and what it costs per request.
+
+Connections are kept open between requests (settings.DB_CONN_MAX_AGE)
+and pinged before reuse (CONN_HEALTH_CHECKS), or with DB_POOL taken
+from psycopg 3's pool; see the DATABASES section of settings.
+
+MetricsMiddleware times the checkout where it happens, on the first
+query or transaction of a request that needs a connection: the health
+check ping and the connect or pool take (CheckoutTimer). Requests that
+never query, or only query the replica, don't touch the primary.
+A reused connection costs a ping; a new one the TCP, TLS and auth
+handshake with the server. checkout() does the same on demand, for
+bench_connections. The numbers of this process, and the pool's
+own statistics where there is a pool, are served by stats_view; the
+whole server's are in /metrics.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import JsonResponse
+
+from .metrics import authorized
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _record(alias, elapsed, opened):
+    with _lock:
+        stats = _stats.setdefault(alias, {
+            'checkouts': 0, 'opened': 0, 'checkout_seconds': 0.0, 'open_seconds': 0.0, 'max_checkout_seconds': 0.0,
+        })
+        stats['checkouts'] += 1
+        stats['checkout_seconds'] += elapsed
+        stats['max_checkout_seconds'] = max(stats['max_checkout_seconds'], elapsed)
+        if opened:
+            stats['opened'] += 1
+            stats['open_seconds'] += elapsed
+
+
+def checkout(alias='default'):
+    """
+    Make sure `alias` has a usable connection. Returns (seconds taken,
+    whether a connection had to be opened or taken from the pool), or
+    None if the database can't be reached; the request's own queries
+    will report that.
+    """
+    connection = connections[alias]
+    start = time.perf_counter()
+    try:
+        connection.close_if_health_check_failed()
+        opened = connection.connection is None
+        connection.ensure_connection()
+    except DatabaseError:
+        return None
+    elapsed = time.perf_counter() - start
+    _record(alias, elapsed, opened)
+    return elapsed, opened
+
+
+class CheckoutTimer:
+    """
+    Context manager timing the first checkout of each alias inside it.
+    The health check and ensure_connection of this thread's connections
+    are wrapped until exit; `checkouts` maps alias -> (seconds, whether a
+    connection was opened or taken from the pool), recorded on exit.
+    """
+
+    wrapped = ('close_if_health_check_failed', 'ensure_connection')
+
+    def __init__(self):
+        self.checkouts = {}
+        self._seconds = {}
+        self._connections = []
+
+    def __enter__(self):
+        for connection in connections.all():
+            for name in self.wrapped:
+                setattr(connection, name, self._timed(connection, name))
+            self._connections.append(connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        for connection in self._connections:
+            for name in self.wrapped:
+                # the instance attribute shadowed the method
+                connection.__dict__.pop(name, None)
+        for alias, (elapsed, opened) in self.checkouts.items():
+            _record(alias, elapsed, opened)
+
+    def _timed(self, connection, name):
+        alias, method = connection.alias, getattr(connection, name)
+
+        def timed():
+            if alias in self.checkouts:
+                return method()
+            opened = connection.connection is None
+            start = time.perf_counter()
+            method()
+            self._seconds[alias] = self._seconds.get(alias, 0.0) + time.perf_counter() - start
+            # the health check comes first and may close the connection
+            if name == 'ensure_connection':
+                self.checkouts[alias] = (self._seconds.pop(alias), opened)
+
+        return timed
+
+
+def process_stats():
+    """Checkout counts and latencies of this process, per alias"""
+    with _lock:
+        stats = {alias: dict(values) for alias, values in _stats.items()}
+    for values in stats.values():
+        values['mean_checkout_ms'] = values['checkout_seconds'] / (values['checkouts'] or 1) * 1000
+        values['mean_open_ms'] = values['open_seconds'] / (values['opened'] or 1) * 1000
+        values['reuse_ratio'] = 1 - values['opened'] / (values['checkouts'] or 1)
+    return stats
+
+
+def pool_stats(alias='default'):
+    """psycopg_pool's counters (pool_size, pool_available, requests_wait_ms, ...) or None"""
+    pool = getattr(connections[alias], 'pool', None)
+    return pool.get_stats() if pool is not None else None
+
+
+def stats_view(request):
+    if not authorized(request):
+        return JsonResponse({'detail': 'Forbidden'}, status=403)
+    process = process_stats()
+    data = {}
+    for alias in settings.DATABASES:
+        options = settings.DATABASES[alias]
+        data[alias] = {
+            'mode': 'pool' if options.get('OPTIONS', {}).get('pool') else 'persistent',
+            'conn_max_age': options.get('CONN_MAX_AGE'),
+            'health_checks': options.get('CONN_HEALTH_CHECKS'),
+            'pool': pool_stats(alias),
+            'process': process.get(alias),
+        }
+    return JsonResponse(data)
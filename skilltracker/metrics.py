@@ -0,0 +1,266 @@
+"""
+Prometheus metrics without a metrics service.
+
+MetricsMiddleware records per request, labelled by URL name
+(`tracker:dashboard`, `api:progress-list`, ...): a latency histogram, a
+histogram of queries per request, DB time and rows returned, and how
+long getting a database connection took (skilltracker.dbpool). The
+tiered cache counters (skilltracker.cache) and connection pool gauges
+are added when the metrics are read. `/metrics` renders everything in the Prometheus text format.
+
+Every WSGI worker process counts in memory. With METRICS_DIR set each
+process also writes its totals to its own file there, at most every
+METRICS_FLUSH_INTERVAL seconds, and /metrics adds up the files of all
+processes, so whichever worker serves the scrape reports the whole
+server. Totals only grow, a restarted worker starts a new file; hit
+ratios and rates are left to PromQL except for one convenience gauge.
+
+Nothing is public: see authorized() for who may read the numbers.
+"""
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from .cache import tiered_cache
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+CHECKOUT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+POOL_STATES = ('pool_size', 'pool_available', 'requests_waiting')
+CACHE_EVENTS = ('l1_hits', 'l2_hits', 'misses', 'early_refreshes', 'coalesced', 'computes')
+
+# name: (type, help, buckets)
+METRICS = {
+    'skilltracker_http_requests_total': ('counter', 'Requests by view, method and status class', None),
+    'skilltracker_http_request_duration_seconds': ('histogram', 'Request latency by view', LATENCY_BUCKETS),
+    'skilltracker_db_queries_per_request': ('histogram', 'Database queries per request by view', QUERY_BUCKETS),
+    'skilltracker_db_query_seconds_total': ('counter', 'Time spent in database queries by view', None),
+    'skilltracker_db_rows_total': ('counter', 'Rows returned or changed by queries, by view', None),
+    'skilltracker_db_checkout_seconds': ('histogram', 'Time to get a usable connection per request', CHECKOUT_BUCKETS),
+    'skilltracker_db_connections_opened_total': ('counter', 'Requests that opened a connection or took one from the pool', None),
+    'skilltracker_db_pool_connections': ('gauge', 'Connection pool size, idle connections and waiting requests', None),
+    'skilltracker_cache_events_total': ('counter', 'Tiered cache lookups by outcome', None),
+    'skilltracker_cache_compute_seconds_total': ('counter', 'Time spent computing cache misses', None),
+    'skilltracker_cache_hit_ratio': ('gauge', 'Share of tiered cache lookups served from L1 or L2', None),
+}
+
+
+class Registry:
+    """Counters and histograms of one process, keyed by (name, labels)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        # per key: [count per bucket (last is +Inf), sum]
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def snapshot(self):
+        """This process's totals, as stored in its METRICS_DIR file"""
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [
+                [name, list(labels), list(counts), total]
+                for (name, labels), (counts, total) in self.histograms.items()
+            ]
+        stats = tiered_cache.stats()
+        for event in CACHE_EVENTS:
+            counters.append(['skilltracker_cache_events_total', [['event', event]], stats[event]])
+        counters.append(['skilltracker_cache_compute_seconds_total', [], stats['compute_seconds']])
+        gauges = []
+        for alias in settings.DATABASES:
+            pool = getattr(connections[alias], 'pool', None)
+            if pool is not None:
+                pool_stats = pool.get_stats()
+                for state in POOL_STATES:
+                    gauges.append(['skilltracker_db_pool_connections', [['alias', alias], ['state', state]], pool_stats.get(state, 0)])
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+registry = Registry()
+_process_file = None
+_last_flush = 0.0
+
+
+def metrics_dir():
+    path = getattr(settings, 'METRICS_DIR', None)
+    return Path(path) if path else None
+
+
+def flush(force=False):
+    """Write this process's totals to its file in METRICS_DIR, if due"""
+    global _process_file, _last_flush
+    directory = metrics_dir()
+    now = time.monotonic()
+    if directory is None or (not force and now - _last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)):
+        return
+    _last_flush = now
+    if _process_file is None:
+        directory.mkdir(parents=True, exist_ok=True)
+        # pid alone may be reused by a later worker, whose totals start over
+        _process_file = directory / f'{os.getpid()}-{time.time_ns()}.json'
+    # written aside and renamed, so readers never see half a file
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as temp:
+        json.dump(registry.snapshot(), temp)
+    os.replace(temp_path, _process_file)
+
+
+def collect():
+    """Totals of every process writing to METRICS_DIR, or of this one"""
+    directory = metrics_dir()
+    if directory is None:
+        snapshots = [registry.snapshot()]
+    else:
+        flush(force=True)
+        snapshots = []
+        for path in directory.glob('*.json'):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):  # replaced or removed while reading
+                continue
+
+    counters = defaultdict(float)
+    gauges = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        # pool gauges add up to the server's connections
+        for name, labels, value in snapshot.get('gauges', ()):
+            gauges[name, tuple(map(tuple, labels))] += value
+        for name, labels, counts, total in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+    return counters, gauges, histograms
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render(counters, gauges, histograms):
+    """Prometheus text exposition format, version 0.0.4"""
+    events = {
+        dict(labels)['event']: value for (name, labels), value in counters.items()
+        if name == 'skilltracker_cache_events_total'
+    }
+    # every lookup ends in exactly one of these, computes are counted apart
+    hits = events.get('l1_hits', 0) + events.get('l2_hits', 0)
+    gets = sum(value for event, value in events.items() if event != 'computes')
+    gauges = dict(gauges)
+    gauges['skilltracker_cache_hit_ratio', ()] = hits / gets if gets else 0.0
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f'{name}_bucket{_labels(labels, [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        else:
+            values = gauges if kind == 'gauge' else counters
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _allowed_address(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    for allowed in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        try:
+            if address in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def authorized(request):
+    """
+    Whether `request` may read internal numbers: staff, a scraper sending
+    METRICS_TOKEN as a bearer token, or a client in METRICS_ALLOWED_IPS
+    (loopback by default). Everyone else is refused, token or not.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return True
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    return _allowed_address(request.META.get('REMOTE_ADDR', ''))
+
+
+def metrics_view(request):
+    if not authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(*collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class QueryCounter:
+    """execute_wrapper adding up queries, their time and rows for one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            # -1 where the driver doesn't know, e.g. SELECTs on SQLite
+            self.rows += max(getattr(context['cursor'], 'rowcount', -1), 0)
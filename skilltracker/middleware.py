@@ -0,0 +1,261 @@
+import random
+import re
+import time
+from contextlib import ExitStack
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+from .routers import use_replica, start_request, end_request, has_written
+from .profiling import Profile
+from . import dbpool, metrics
+
+PIN_COOKIE = 'db_pin'
+
+
+class ReplicaMiddleware:
+    """
+    Decide per request whether tracker reads may use the read replica.
+
+    Only safe requests to views marked with ``read_replica = True`` are
+    routed to the replica. After a write the client gets a short-lived
+    cookie so its next requests keep reading from the primary and see
+    their own changes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tokens = start_request()
+        try:
+            response = self.get_response(request)
+            wrote = has_written()
+        finally:
+            end_request(tokens)
+
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') or wrote:
+            pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time()) + pin_seconds),
+                max_age=pin_seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        # plain django views expose view_class, DRF viewsets expose cls
+        view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+        if not getattr(view_class, 'read_replica', False):
+            return None
+        if self.is_pinned(request):
+            return None
+        use_replica(True)
+        return None
+
+    def is_pinned(self, request):
+        try:
+            pinned_until = int(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            return False
+        return pinned_until > time.time()
+
+
+class CompressionMiddleware:
+    """
+    Compress large API responses with brotli or gzip, whichever the client
+    accepts (brotli preferred). Only JSON and MessagePack bodies are
+    compressed; HTML pages carry CSRF tokens and are left alone (BREACH).
+    """
+    
+    min_length = 1024
+    content_types = ('application/json', 'application/msgpack')
+    re_accepts_br = re.compile(r'\bbr\b')
+    re_accepts_gzip = re.compile(r'\bgzip\b')
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith(self.content_types):
+            return response
+        if len(response.content) < self.min_length:
+            return response
+        
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and self.re_accepts_br.search(accept_encoding):
+            compressed, encoding = brotli.compress(response.content, quality=4), 'br'
+        elif self.re_accepts_gzip.search(accept_encoding):
+            compressed, encoding = compress_string(response.content), 'gzip'
+        else:
+            return response
+        
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # weaken strong ETags, the body is now a different byte string
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Profile a request on demand or by sampling, see skilltracker.profiling.
+
+    Staff get a profile of any request by sending an X-Profile header or
+    adding ?_profile=1; the response then carries X-Profile-Id. With
+    PROFILER_SAMPLE_RATE = N, one in N requests of anyone is profiled as
+    well. Profiles are stored as tracker.RequestProfile and downloaded
+    from the admin. Requests that aren't profiled only pay for the
+    header and query string checks.
+    """
+
+    header = 'HTTP_X_PROFILE'
+    query_flag = '_profile'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0)
+        self.on_demand = getattr(settings, 'PROFILER_ON_DEMAND', True)
+        self.interval = getattr(settings, 'PROFILER_INTERVAL', 0.002)
+        self.keep = getattr(settings, 'PROFILER_KEEP', 500)
+        if not self.on_demand and not self.sample_rate:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        trigger = self.get_trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        with Profile(self.interval) as profile:
+            response = self.get_response(request)
+        response['X-Profile-Id'] = str(self.store(request, response, profile, trigger).pk)
+        return response
+
+    def get_trigger(self, request):
+        if self.on_demand:
+            if self.header in request.META:
+                trigger = 'header'
+            elif self.query_flag in request.META.get('QUERY_STRING', '') and self.query_flag in request.GET:
+                trigger = 'query'
+            else:
+                trigger = None
+            if trigger is not None and self.is_staff(request):
+                return trigger
+        if self.sample_rate and random.randrange(self.sample_rate) == 0:
+            return 'sample'
+        return None
+
+    def is_staff(self, request):
+        """
+        Whether the session or token user is staff. Token requests are
+        only authenticated inside the view, so the token is checked here
+        before anything is profiled; the lookup is cached for the view.
+        """
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return True
+        # html-only workers run without DRF and its tokens (settings.WORKER_ROLE)
+        if 'HTTP_AUTHORIZATION' not in request.META or not apps.is_installed('rest_framework.authtoken'):
+            return False
+        from rest_framework.exceptions import AuthenticationFailed
+        from accounts.authentication import CachedTokenAuthentication
+
+        try:
+            authenticated = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return authenticated is not None and authenticated[0].is_staff
+
+    def store(self, request, response, profile, trigger):
+        from tracker.models import RequestProfile
+
+        user = getattr(request, 'user', None)
+        match = getattr(request, 'resolver_match', None)
+        # explicit alias: going through the router would pin the client to the primary
+        saved = RequestProfile.objects.using('default').create(
+            trigger=trigger,
+            method=request.method,
+            path=request.get_full_path()[:500],
+            view_name=(match.view_name if match else '')[:200],
+            user=user if user is not None and user.is_authenticated else None,
+            status_code=response.status_code,
+            duration_ms=round(profile.duration * 1000, 2),
+            sql_count=profile.queries.count,
+            sql_ms=round(profile.queries.seconds * 1000, 2),
+            top_queries=profile.queries.top(),
+            samples=sum(profile.sampler.stacks.values()),
+            stacks=profile.folded(),
+        )
+        if saved.pk % 100 == 0:
+            # now and then, drop all but the newest PROFILER_KEEP
+            profiles = RequestProfile.objects.using('default')
+            stale = list(profiles.order_by('-pk').values_list('pk', flat=True)[self.keep:self.keep + 1])
+            if stale:
+                profiles.filter(pk__lte=stale[0]).delete()
+        return saved
+
+
+class MetricsMiddleware:
+    """
+    Record latency, queries, DB time and rows per view for /metrics, see
+    skilltracker.metrics, and the connection checkout (skilltracker.dbpool).
+    Sits first so the latency includes every other middleware.
+    """
+
+    methods = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        queries = metrics.QueryCounter()
+        with ExitStack() as stack:
+            # timed when the first query needs a connection, per alias
+            checkouts = stack.enter_context(dbpool.CheckoutTimer()).checkouts
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        # unresolved paths share one label, so clients can't invent new series
+        view = match.view_name if match else 'unmatched'
+        if view == 'metrics':
+            return response
+        labels = {'view': view}
+        method = request.method if request.method in self.methods else 'other'
+        metrics.registry.inc(
+            'skilltracker_http_requests_total',
+            {'view': view, 'method': method, 'status': f'{response.status_code // 100}xx'},
+        )
+        metrics.registry.observe('skilltracker_http_request_duration_seconds', labels, elapsed)
+        metrics.registry.observe('skilltracker_db_queries_per_request', labels, queries.count)
+        metrics.registry.inc('skilltracker_db_query_seconds_total', labels, queries.seconds)
+        metrics.registry.inc('skilltracker_db_rows_total', labels, queries.rows)
+        for alias, (seconds, opened) in checkouts.items():
+            metrics.registry.observe('skilltracker_db_checkout_seconds', {'alias': alias}, seconds)
+            metrics.registry.inc('skilltracker_db_connections_opened_total', {'alias': alias}, int(opened))
+        metrics.flush()
+        return response
@@ -0,0 +1,120 @@
+"""
+Profiling of single requests, see ProfilerMiddleware.
+
+A sampler thread looks at the request thread's stack every few
+milliseconds (sys._current_frames) and counts each distinct stack. The
+counts are the profile, written out in the folded format that
+flamegraph.pl, speedscope and most flamegraph viewers read:
+
+    module.func;module.callee;module.leaf 12
+
+Unlike cProfile nothing is hooked into the profiled code, so fast calls
+aren't slowed down and the timings stay close to an unprofiled request.
+Every query on every connection is timed alongside.
+"""
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.db import connections
+
+INTERVAL = 0.002  # seconds between samples
+MAX_DEPTH = 200
+TOP_QUERIES = 10
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}"
+
+
+def _stack(frame):
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """Counts the stacks of one thread from a second thread"""
+
+    def __init__(self, thread_id, interval=INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_stack(frame)] += 1
+            del frame
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueryRecorder:
+    """execute_wrapper counting queries and their time, per statement"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            statement = self.statements[sql]
+            statement[0] += 1
+            statement[1] += elapsed
+
+    def top(self, limit=TOP_QUERIES):
+        """The statements that took longest in total, with how often they ran"""
+        ranked = sorted(self.statements.items(), key=lambda item: -item[1][1])[:limit]
+        return [
+            {'sql': sql, 'count': count, 'ms': round(seconds * 1000, 2)}
+            for sql, (count, seconds) in ranked
+        ]
+
+
+class Profile:
+    """Context manager sampling the current thread and recording its queries"""
+
+    def __init__(self, interval=INTERVAL):
+        self.sampler = Sampler(threading.get_ident(), interval)
+        self.queries = QueryRecorder()
+        self.duration = 0.0
+        self._exit_stack = None
+
+    def __enter__(self):
+        self._exit_stack = ExitStack()
+        for connection in connections.all():
+            self._exit_stack.enter_context(connection.execute_wrapper(self.queries))
+        self._start = time.perf_counter()
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self._start
+        self._exit_stack.close()
+        return False
+
+    def folded(self):
+        """The samples as folded stacks, one `stack count` line each"""
+        return '\n'.join(f'{stack} {count}' for stack, count in self.sampler.stacks.most_common())
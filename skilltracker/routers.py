@@ -0,0 +1,81 @@
+"""
+Database routing for the optional read replica.
+
+When a ``replica`` alias is configured in ``settings.DATABASES`` the
+ReplicaMiddleware marks read-only requests (GET/HEAD on views that set
+``read_replica = True``) so tracker reads go to the replica. Everything
+else, and every read that follows a write to tracker or accounts data,
+stays on ``default``. Bookkeeping writes of other apps (sessions,
+admin log) don't pin: nothing read from the replica depends on them.
+
+Locally the setup runs on two SQLite files, see DATABASE_REPLICA_URL in
+settings.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA_ALIAS = 'replica'
+
+# per request/thread routing state, set by ReplicaMiddleware
+_use_replica = ContextVar('use_replica', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def use_replica(enabled=True):
+    """Route reads for the current request to the replica (or not)"""
+    return _use_replica.set(enabled and replica_configured())
+
+
+def start_request():
+    """Reset the routing state at the start of a request"""
+    return _use_replica.set(False), _wrote.set(False)
+
+
+def end_request(tokens):
+    use_token, wrote_token = tokens
+    _use_replica.reset(use_token)
+    _wrote.reset(wrote_token)
+
+
+def pin_to_primary():
+    """Send every further read of the current request to the primary"""
+    _use_replica.set(False)
+    _wrote.set(True)
+
+
+def has_written():
+    return _wrote.get()
+
+
+class ReplicaRouter:
+    """Send tracker reads to the replica only when the request allows it"""
+
+    route_app_labels = {'tracker'}
+    # writes that tracker reads may depend on
+    pin_app_labels = {'tracker', 'accounts'}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.route_app_labels and _use_replica.get():
+            return REPLICA_ALIAS
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        # reads right after a write must see it, so stop using the replica
+        if model._meta.app_label in self.pin_app_labels:
+            pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica is a copy of default, so objects from both can be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema through replication, never migrate it
+        if db == REPLICA_ALIAS:
+            return False
+        return None
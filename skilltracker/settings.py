@@ -10,11 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import dj_database_url
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 #for railway deployment#
-import os
 
 #SECRET_KEY = 'django-insecure-y@^v^0ssf%7o%hv=_=oo&9%rsr$2ww&o(7@a*jp3@@^n(t($3)'#
 
@@ -40,16 +42,21 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework.authtoken',
     'accounts',
     'tracker',
 ]
 
 MIDDLEWARE = [
+    'skilltracker.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'skilltracker.middleware.CompressionMiddleware',
+    'skilltracker.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.CachedAuthenticationMiddleware',
+    'skilltracker.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,19 +82,6 @@ WSGI_APPLICATION = 'skilltracker.wsgi.application'
 
 #  configuration
 
-
-import dj_database_url
-import os
-from pathlib import Path
-
-BASE_DIR = Path(__file__).resolve().parent.parent
-
-import os
-import dj_database_url
-from pathlib import Path
-
-BASE_DIR = Path(__file__).resolve().parent.parent
-
 # Local SQLite
 
 
@@ -103,6 +97,42 @@ DATABASES = {
     }
 }
 
+# DATABASE_URL overrides the primary, e.g. DATABASE_URL=sqlite:///primary.sqlite3
+if os.getenv("DATABASE_URL"):
+    DATABASES["default"] = dj_database_url.parse(os.getenv("DATABASE_URL"))
+
+# Optional read replica used for dashboards, stats and API list reads.
+# Locally two SQLite files can stand in for it:
+#   DATABASE_URL=sqlite:///primary.sqlite3 DATABASE_REPLICA_URL=sqlite:///replica.sqlite3
+# (copy primary.sqlite3 to replica.sqlite3 after migrating to "replicate")
+if os.getenv("DATABASE_REPLICA_URL"):
+    DATABASES["replica"] = dj_database_url.parse(os.getenv("DATABASE_REPLICA_URL"))
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+
+# Connection reuse: each worker thread keeps its connection for DB_CONN_MAX_AGE
+# seconds instead of paying the TCP, TLS and auth handshake on every request, and
+# pings it before reuse. DB_POOL=True uses psycopg 3's pool instead (install
+# "psycopg[pool]" in place of psycopg2), shared by the threads of a process.
+# Numbers: /internal/db-stats and /metrics, benchmark: manage.py bench_connections
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "60"))
+DB_POOL = os.getenv("DB_POOL", "False") == "True"
+for database in DATABASES.values():
+    database["CONN_HEALTH_CHECKS"] = True
+    if DB_POOL and database["ENGINE"] == "django.db.backends.postgresql":
+        database["CONN_MAX_AGE"] = 0  # required with a pool, connections go back to it
+        database.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),  # seconds to wait for a connection
+        }
+    else:
+        database["CONN_MAX_AGE"] = DB_CONN_MAX_AGE
+
+DATABASE_ROUTERS = ['skilltracker.routers.ReplicaRouter']
+
+# seconds a client keeps reading from the primary after it wrote something
+REPLICA_PIN_SECONDS = int(os.getenv("REPLICA_PIN_SECONDS", "5"))
+
 
 # For local development, you can uncomment the following DATABASES setting
 # and comment out the dj_database_url part above.
@@ -149,6 +179,56 @@ AUTH_USER_MODEL = 'accounts.UserProfile'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# generate profile picture thumbnails in a background thread after upload
+PROFILE_PICTURE_ASYNC = os.getenv("PROFILE_PICTURE_ASYNC", "True") == "True"
+
+# shared cache (L2 of skilltracker.cache), every worker must see the same one in
+# production; without REDIS_URL each process gets its own in-memory cache and the
+# tiered cache stays off, TIERED_CACHE_LOCAL=True turns it on for a single process
+TIERED_CACHE_LOCAL = os.getenv("TIERED_CACHE_LOCAL", "False") == "True"
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'skilltracker',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# request profiling (skilltracker.profiling): staff can always ask for a profile
+# with X-Profile or ?_profile=1, PROFILER_SAMPLE_RATE=N also profiles 1 in N requests
+PROFILER_ON_DEMAND = os.getenv("PROFILER_ON_DEMAND", "True") == "True"
+PROFILER_SAMPLE_RATE = int(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.002"))  # seconds between stack samples
+PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", "500"))
+
+# /metrics (skilltracker.metrics): with METRICS_DIR every worker process writes its
+# totals there and a scrape of any worker reports all of them; a local directory
+# shared by the workers of one server, not shared between servers
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True") == "True"
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))  # seconds
+# /metrics and /internal/db-stats answer staff, "Authorization: Bearer <METRICS_TOKEN>"
+# and clients from METRICS_ALLOWED_IPS (addresses or networks), nobody else
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip.strip()]
+
+# seconds an authenticated user (session or API token) stays cached, only with a
+# shared cache (REDIS_URL): accounts.auth_cache doesn't cache in LocMemCache
+AUTH_CACHE_TIMEOUT = int(os.getenv("AUTH_CACHE_TIMEOUT", "60"))
+
+# weekly digest emails, use django.core.mail.backends.locmem.EmailBackend in tests
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "SkillTracker <noreply@skilltracker.app>")
+
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -156,13 +236,41 @@ LOGOUT_REDIRECT_URL = '/'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'tracker.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'tracker.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
 }
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+# WORKER_ROLE lets a process skip loading what it never serves:
+#   html - pages and admin only, DRF and /api/ are not loaded
+#   api  - /api/ only, no admin, messages or template engines
+#   all  - everything (default)
+WORKER_ROLE = os.getenv("WORKER_ROLE", "all")
+if WORKER_ROLE == "html":
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if not app.startswith('rest_framework')]
+elif WORKER_ROLE == "api":
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ('django.contrib.admin', 'django.contrib.messages')]
+    MIDDLEWARE = [m for m in MIDDLEWARE if m != 'django.contrib.messages.middleware.MessageMiddleware']
+    TEMPLATES = []
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
+        renderer for renderer in REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] if 'Browsable' not in renderer
+    ]
+
+# resolve urls and load templates while the worker boots, not on the first request
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "False") == "True"
+
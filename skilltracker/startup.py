@@ -0,0 +1,28 @@
+"""Worker boot helpers, see WARMUP_ON_START and the profile_startup command."""
+import time
+
+from django.conf import settings
+
+
+def warm_up():
+    """
+    Do the work a cold worker otherwise does on its first request: import
+    the URLconf (and every view module behind it) and compile the base
+    templates. Returns the seconds spent on each step.
+    """
+    from django.urls import get_resolver
+
+    timings = {}
+    start = time.perf_counter()
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict  # populates the lookup tables
+    timings['urlconf'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if settings.TEMPLATES:
+        from django.template.loader import get_template
+        for name in ('base.html', 'tracker/dashboard.html'):
+            get_template(name)
+    timings['templates'] = time.perf_counter() - start
+    return timings
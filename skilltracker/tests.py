@@ -0,0 +1,387 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import date
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.management import call_command
+from django.contrib.sessions.models import Session
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from tracker.duplicates import merge_skills
+from tracker.management.commands.profile_startup import Command as ProfileStartup
+from accounts.models import UserProfile
+from tracker.models import Skill, ProgressEntry, Goal
+from . import dbpool, metrics, middleware, routers
+from .cache import TieredCache, is_shared, tiered_cache
+from .middleware import CompressionMiddleware, MetricsMiddleware, brotli
+
+
+@override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1', '10.1.0.0/16'])
+class MetricsAccessTests(TestCase):
+    def test_denied_by_default(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/internal/db-stats', REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 403)
+
+    def test_allowed_addresses(self):
+        for address in ('127.0.0.1', '10.1.2.3'):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR=address).status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.2.0.1').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token(self):
+        request = {'REMOTE_ADDR': '203.0.113.9'}
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret', **request).status_code, 200)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer guess', **request).status_code, 403)
+
+    def test_staff(self):
+        user = get_user_model().objects.create_user('member', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get('/internal/db-stats', REMOTE_ADDR='203.0.113.9').status_code, 200)
+
+
+class MetricsRenderTests(SimpleTestCase):
+    def process_file(self, directory, name, requests, latencies):
+        registry = metrics.Registry()
+        labels = {'view': 'tests:aggregated', 'method': 'GET', 'status': '2xx'}
+        registry.inc('skilltracker_http_requests_total', labels, requests)
+        for latency in latencies:
+            registry.observe('skilltracker_http_request_duration_seconds', {'view': 'tests:aggregated'}, latency)
+        snapshot = registry.snapshot()
+        snapshot['gauges'] = [['skilltracker_db_pool_connections', [['alias', 'default'], ['state', 'pool_size']], 4]]
+        (directory / f'{name}.json').write_text(json.dumps(snapshot))
+
+    def test_processes_add_up(self):
+        # collect() adds this process's own file to the directory, under other labels
+        self.addCleanup(setattr, metrics, '_process_file', None)
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.process_file(Path(directory), 'worker-1', 3, [0.003, 0.2])
+            self.process_file(Path(directory), 'worker-2', 2, [0.04])
+            (Path(directory) / 'torn.json').write_text('{"coun')
+            text = metrics.render(*metrics.collect())
+
+        lines = set(text.splitlines())
+        self.assertIn('skilltracker_http_requests_total{method="GET",status="2xx",view="tests:aggregated"} 5', lines)
+        self.assertIn('skilltracker_http_request_duration_seconds_bucket{view="tests:aggregated",le="0.005"} 1', lines)
+        self.assertIn('skilltracker_http_request_duration_seconds_bucket{view="tests:aggregated",le="0.05"} 2', lines)
+        self.assertIn('skilltracker_http_request_duration_seconds_bucket{view="tests:aggregated",le="+Inf"} 3', lines)
+        self.assertIn('skilltracker_http_request_duration_seconds_count{view="tests:aggregated"} 3', lines)
+        total = next(line for line in lines if line.startswith('skilltracker_http_request_duration_seconds_sum{view="tests:aggregated"}'))
+        self.assertAlmostEqual(float(total.split()[-1]), 0.243)
+        self.assertIn('skilltracker_db_pool_connections{alias="default",state="pool_size"} 8', lines)
+        self.assertIn('# TYPE skilltracker_http_request_duration_seconds histogram', lines)
+
+    def test_label_values_are_escaped(self):
+        text = metrics.render({('skilltracker_http_requests_total', (('view', 'a"b\\c'),)): 1}, {}, {})
+        self.assertIn('skilltracker_http_requests_total{view="a\\"b\\\\c"} 1', text.splitlines())
+
+    def test_hit_ratio(self):
+        counters = {
+            ('skilltracker_cache_events_total', (('event', event),)): value
+            for event, value in {'l1_hits': 6, 'l2_hits': 2, 'misses': 2, 'computes': 2}.items()
+        }
+        self.assertIn('skilltracker_cache_hit_ratio 0.8', metrics.render(counters, {}, {}).splitlines())
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        self.cache = TieredCache(prefix='tests')
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_off_without_a_shared_cache(self):
+        # the test settings use LocMemCache, one per process
+        self.assertFalse(is_shared())
+        self.assertEqual([self.cache.get_or_set('key', self.compute, 60) for _ in range(2)], [1, 2])
+
+    @override_settings(TIERED_CACHE_LOCAL=True)
+    def test_bump_invalidates_namespace(self):
+        self.assertEqual(self.cache.get_or_set('key', self.compute, 60, namespace='user:1'), 1)
+        self.assertEqual(self.cache.get_or_set('key', self.compute, 60, namespace='user:1'), 1)
+        self.cache.bump('user:1')
+        self.assertEqual(self.cache.get_or_set('key', self.compute, 60, namespace='user:1'), 2)
+
+    def test_one_bump_per_namespace_and_transaction(self):
+        user = get_user_model().objects.create_user('learner', password='pw')
+        skill = Skill.objects.create(name='Python', category='backend', difficulty='easy')
+        with mock.patch.object(tiered_cache, 'bump') as bump, self.captureOnCommitCallbacks(execute=True):
+            for day in range(5):
+                ProgressEntry.objects.create(user=user, skill=skill, date=date(2024, 1, day + 1), hours_spent=1)
+            Goal.objects.create(user=user, skill=skill, title='Ship it', deadline=date(2024, 2, 1))
+        bump.assert_called_once_with(f'user:{user.pk}')
+
+    def test_merged_skills_expire_their_owners(self):
+        user = get_user_model().objects.create_user('learner', password='pw')
+        target = Skill.objects.create(name='JavaScript', category='frontend', difficulty='easy')
+        duplicate = Skill.objects.create(name='Javascript', category='frontend', difficulty='easy')
+        # no signals, so nothing is pending before the merge
+        Goal.objects.bulk_create([Goal(user=user, skill=duplicate, title='Closures', deadline=date(2024, 2, 1))])
+        with mock.patch.object(tiered_cache, 'bump') as bump, self.captureOnCommitCallbacks(execute=True):
+            merge_skills(target, [duplicate])
+        bump.assert_called_once_with(f'user:{user.pk}')
+
+
+def run_worker(role, code):
+    """
+    Run `code` in a fresh interpreter after loading skilltracker.wsgi
+    as a WORKER_ROLE=`role` worker, returns the JSON it prints.
+    """
+    probe = 'import json, sys\nimport skilltracker.wsgi\n' + code
+    env = dict(os.environ, WORKER_ROLE=role, WARMUP_ON_START='False', ALLOWED_HOSTS='testserver')
+    result = subprocess.run([sys.executable, '-c', probe], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr[-2000:])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+class WorkerImportsTests(SimpleTestCase):
+    # modules a role is meant to leave out; DRF itself imports
+    # django.contrib.admin (through its schema generator), so the admin
+    # is checked by the project's own admin modules
+    probed = (
+        'rest_framework', 'tracker.api_views', 'tracker.admin', 'accounts.admin',
+        'tracker.views', 'accounts.templatetags.profile_pictures', 'PIL', 'numpy', 'scipy',
+    )
+
+    def test_roles_load_only_what_they_serve(self):
+        expected = {
+            'all': set(self.probed) - {'numpy', 'scipy'},
+            'html': {'tracker.admin', 'accounts.admin', 'tracker.views', 'accounts.templatetags.profile_pictures', 'PIL'},
+            'api': {'rest_framework', 'tracker.api_views'},
+        }
+        serves = {
+            'all': [True, True, True],
+            'html': [False, True, True],
+            'api': [True, False, False],
+        }
+        for role in ('all', 'html', 'api'):
+            report = run_worker(role, f"""
+from django.urls import Resolver404, resolve
+from skilltracker.startup import warm_up
+timings = warm_up()
+
+def serves(path):
+    try:
+        resolve(path)
+    except Resolver404:
+        return False
+    return True
+
+print(json.dumps({{
+    'timings': sorted(timings),
+    'loaded': [name for name in {self.probed!r} if name in sys.modules],
+    'serves': [serves(path) for path in ('/api/goals/', '/admin/', '/')],
+}}))
+""")
+            self.assertEqual(report['timings'], ['templates', 'urlconf'], role)
+            self.assertEqual(set(report['loaded']), expected[role], role)
+            self.assertEqual(report['serves'], serves[role], role)
+
+    def test_profile_startup(self):
+        out = StringIO()
+        call_command('profile_startup', role=['api'], runs=1, top=5, stdout=out)
+        output = out.getvalue()
+        self.assertIn('WORKER_ROLE=api: slowest modules', output)
+        self.assertIn('WORKER_ROLE=api: import time by top-level package', output)
+        self.assertRegex(output, r'\n  api +[\d.]+ +[\d.]+ +[\d.]+ +[\d.]+\n')
+
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   msgpack.exceptions\n'
+            'import time:      2050 |       2170 | msgpack\n'
+            'unrelated warning\n'
+        )
+        self.assertEqual(ProfileStartup().parse_importtime(output), [
+            ('msgpack.exceptions', 120, 120), ('msgpack', 2050, 2170),
+        ])
+
+    def test_numpy_waits_for_the_first_forecast(self):
+        for role in ('all', 'html', 'api'):
+            loaded = run_worker(role, """
+from skilltracker.startup import warm_up
+warm_up()
+print(json.dumps('numpy' in sys.modules))
+""")
+            self.assertFalse(loaded, role)
+
+
+class ProfilerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = get_user_model().objects.create_user('member', password='pw')
+        cls.staff = get_user_model().objects.create_user('staff', password='pw', is_staff=True)
+
+    def profiled(self, **headers):
+        with mock.patch.object(middleware, 'Profile', wraps=middleware.Profile) as profile:
+            response = self.client.get('/api/goals/', HTTP_X_PROFILE='1', **headers)
+        return profile.called, response.has_header('X-Profile-Id')
+
+    def token(self, user):
+        return {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=user).key}'}
+
+    def test_staff_token(self):
+        self.assertEqual(self.profiled(**self.token(self.staff)), (True, True))
+
+    def test_no_sampler_for_other_tokens(self):
+        self.assertEqual(self.profiled(**self.token(self.member)), (False, False))
+        self.assertEqual(self.profiled(HTTP_AUTHORIZATION='Token forged'), (False, False))
+        self.assertEqual(self.profiled(), (False, False))
+
+    def test_staff_session(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.profiled(), (True, True))
+
+    def test_token_on_html_worker(self):
+        # no DRF and no Token model on html-only workers
+        response = run_worker('html', """
+from django.test import Client
+response = Client().get('/accounts/login/', HTTP_X_PROFILE='1', HTTP_AUTHORIZATION='Token forged')
+print(json.dumps([response.status_code, response.has_header('X-Profile-Id'), 'rest_framework' in sys.modules]))
+""")
+        self.assertEqual(response, [200, False, False])
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        # as with DATABASE_URL=sqlite:///primary.sqlite3 DATABASE_REPLICA_URL=sqlite:///replica.sqlite3
+        patcher = mock.patch.object(routers, 'replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = routers.ReplicaRouter()
+        self.addCleanup(routers.end_request, routers.start_request())
+        routers.use_replica()
+
+    def test_bookkeeping_writes_keep_the_replica(self):
+        for model in (Session, LogEntry):
+            self.assertEqual(self.router.db_for_write(model), 'default')
+        self.assertFalse(routers.has_written())
+        self.assertEqual(self.router.db_for_read(ProgressEntry), routers.REPLICA_ALIAS)
+
+    def test_tracker_and_accounts_writes_pin(self):
+        for model in (ProgressEntry, UserProfile):
+            routers.use_replica()
+            self.assertEqual(self.router.db_for_write(model), 'default')
+            self.assertTrue(routers.has_written())
+            self.assertEqual(self.router.db_for_read(ProgressEntry), 'default')
+
+
+class CompressionTests(SimpleTestCase):
+    def respond(self, response, accept_encoding='br, gzip'):
+        request = RequestFactory().get('/api/goals/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def large(self):
+        response = JsonResponse({'values': list(range(1000))})
+        response['ETag'] = '"abc"'
+        return response
+
+    def test_brotli_preferred(self):
+        if brotli is None:
+            self.skipTest('brotli is not installed')
+        original = self.large().content
+        response = self.respond(self.large())
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), original)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_gzip(self):
+        original = self.large().content
+        response = self.respond(self.large(), 'gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), original)
+
+    def test_small_bodies_are_left_alone(self):
+        response = self.respond(JsonResponse({'values': list(range(10))}))
+        self.assertLess(len(response.content), CompressionMiddleware.min_length)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_identity(self):
+        response = self.respond(self.large(), '')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        # a cache must still not give a compressed copy to this client
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_html_is_left_alone(self):
+        response = self.respond(HttpResponse('<p>' + 'x' * 2000 + '</p>'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(dbpool._stats, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_query_is_timed_once(self):
+        with dbpool.CheckoutTimer() as timer:
+            for _ in range(3):
+                get_user_model().objects.exists()
+        self.assertEqual(list(timer.checkouts), ['default'])
+        seconds, opened = timer.checkouts['default']
+        self.assertFalse(opened)  # the test database stays connected
+        self.assertEqual(dbpool.process_stats()['default']['checkouts'], 1)
+        # the methods are the connection's own again
+        self.assertNotIn('ensure_connection', connection.__dict__)
+
+    def test_no_query_no_checkout(self):
+        with dbpool.CheckoutTimer() as timer:
+            pass
+        self.assertEqual(timer.checkouts, {})
+        self.assertEqual(dbpool.process_stats(), {})
+
+    def test_process_stats(self):
+        dbpool._record('default', 0.004, True)
+        dbpool._record('default', 0.001, False)
+        stats = dbpool.process_stats()['default']
+        self.assertEqual((stats['checkouts'], stats['opened']), (2, 1))
+        self.assertAlmostEqual(stats['mean_open_ms'], 4)
+        self.assertAlmostEqual(stats['mean_checkout_ms'], 2.5)
+        self.assertAlmostEqual(stats['reuse_ratio'], 0.5)
+
+    def test_middleware_leaves_idle_views_unconnected(self):
+        request = RequestFactory().get('/')
+        with mock.patch.object(metrics.registry, 'observe') as observe, mock.patch.object(metrics, 'flush'):
+            MetricsMiddleware(lambda request: HttpResponse('idle'))(request)
+        observed = {call.args[0] for call in observe.call_args_list}
+        self.assertNotIn('skilltracker_db_checkout_seconds', observed)
+
+        def querying(request):
+            get_user_model().objects.exists()
+            return HttpResponse('busy')
+
+        with mock.patch.object(metrics.registry, 'observe') as observe, mock.patch.object(metrics, 'flush'):
+            MetricsMiddleware(querying)(request)
+        observe.assert_any_call('skilltracker_db_checkout_seconds', {'alias': 'default'}, mock.ANY)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_stats_view(self):
+        dbpool._record('default', 0.002, True)
+        response = self.client.get('/internal/db-stats', HTTP_AUTHORIZATION='Bearer s3cret', REMOTE_ADDR='203.0.113.9')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['default']
+        self.assertEqual(data['mode'], 'persistent')
+        self.assertIsNone(data['pool'])
+        self.assertEqual(data['process']['opened'], 1)
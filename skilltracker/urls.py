@@ -14,17 +14,29 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metrics import metrics_view
+from .dbpool import stats_view as db_stats_view
+
+# html/api-only workers (settings.WORKER_ROLE) skip the urls they don't serve
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('accounts/', include('accounts.urls')),  # user authentication urls
-    path('api/', include('tracker.api_urls')),
-    path('', include('tracker.urls')),  # main app urls
+    path('metrics', metrics_view, name='metrics'),
+    path('internal/db-stats', db_stats_view, name='db_stats'),
 ]
+if settings.WORKER_ROLE != 'api':
+    from django.contrib import admin
+    
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+        path('accounts/', include('accounts.urls')),  # user authentication urls
+    ]
+if settings.WORKER_ROLE != 'html':
+    urlpatterns += [path('api/', include('tracker.api_urls'))]
+if settings.WORKER_ROLE != 'api':
+    urlpatterns += [path('', include('tracker.urls'))]  # main app urls
 
 
 if settings.DEBUG:
@@ -1,5 +1,51 @@
-from django.contrib import admin
-from .models import Skill, ProgressEntry, Goal, LearningResource
+from collections import Counter
+
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import Skill, ProgressEntry, Goal, LearningResource, RequestProfile
+from .duplicates import merge_skills, pick_target
+from .paginators import EstimatedCountPaginator
+
+
+class CachedSkillFilter(admin.SimpleListFilter):
+    """Skill filter whose choices come from the cache instead of a query per page"""
+    title = 'skill'
+    parameter_name = 'skill__id__exact'
+    cache_key = 'admin:skill_filter_choices'
+    cache_timeout = 600
+    
+    def lookups(self, request, model_admin):
+        choices = cache.get(self.cache_key)
+        if choices is None:
+            choices = list(Skill.objects.order_by('name').values_list('id', 'name'))
+            cache.set(self.cache_key, choices, self.cache_timeout)
+        return choices
+    
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(skill_id=self.value())
+        return queryset
+
+
+class ScaleModeAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows: user and skill
+    are joined in the list query, pagination uses the planner's estimate
+    instead of COUNT(*), the extra full-table count is skipped and the
+    change form uses autocomplete widgets instead of full dropdowns.
+    """
+    list_select_related = ('user', 'skill')
+    autocomplete_fields = ('user', 'skill')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+
 
 # register models for admin interface
 @admin.register(Skill)
@@ -10,45 +56,140 @@ class SkillAdmin(admin.ModelAdmin):
     list_filter = ('category', 'difficulty', 'created_at')
     search_fields = ('name', 'description')
     ordering = ('name',)
+    actions = ['merge_selected']
+    
+    @admin.action(description='Merge selected skills into the most used one', permissions=['delete'])
+    def merge_selected(self, request, queryset):
+        skills = list(queryset)
+        if len(skills) < 2:
+            self.message_user(request, 'Select at least two skills to merge.', messages.WARNING)
+            return
+        target_id = pick_target([skill.pk for skill in skills])
+        target = next(skill for skill in skills if skill.pk == target_id)
+        counts = merge_skills(target, skills)
+        cache.delete(CachedSkillFilter.cache_key)
+        self.message_user(
+            request,
+            f'Merged {counts["skills"]} skills into "{target.name}": '
+            f'{counts["progress"]} progress entries ({counts["progress_folded"]} folded into same-day entries), '
+            f'{counts["goals"]} goals, {counts["resources"]} resources, {counts["notifications"]} notifications.',
+            messages.SUCCESS,
+        )
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        cache.delete(CachedSkillFilter.cache_key)
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        cache.delete(CachedSkillFilter.cache_key)
 
 @admin.register(ProgressEntry)
-class ProgressEntryAdmin(admin.ModelAdmin):
+class ProgressEntryAdmin(ScaleModeAdmin):
     """Admin configuration for ProgressEntry model"""
     
     list_display = ('user', 'skill', 'date', 'hours_spent', 'created_at')
-    list_filter = ('skill__category', 'date', 'created_at')
+    list_filter = ('skill__category', CachedSkillFilter, 'date', 'created_at')
     search_fields = ('user__username', 'skill__name', 'description')
-    date_hierarchy = 'date'
     ordering = ('-date',)
 
 @admin.register(Goal)
-class GoalAdmin(admin.ModelAdmin):
+class GoalAdmin(ScaleModeAdmin):
     """Admin configuration for Goal model"""
     
     list_display = ('title', 'user', 'skill', 'deadline', 'completed', 'completed_date')
-    list_filter = ('completed', 'skill__category', 'deadline', 'created_at')
+    list_filter = ('completed', 'skill__category', CachedSkillFilter, 'deadline', 'created_at')
     search_fields = ('title', 'user__username', 'skill__name')
-    date_hierarchy = 'deadline'
     ordering = ('deadline', '-created_at')
     
     actions = ['mark_completed', 'mark_incomplete']
     
     def mark_completed(self, request, queryset):
-        from django.utils import timezone
-        updated = queryset.update(completed=True, completed_date=timezone.now().date())
+        updated = self._set_completed(queryset.filter(completed=False), True)
         self.message_user(request, f'{updated} goals marked as completed.')
     mark_completed.short_description = "Mark selected goals as completed"
     
     def mark_incomplete(self, request, queryset):
-        updated = queryset.update(completed=False, completed_date=None)
+        updated = self._set_completed(queryset.filter(completed=True), False)
         self.message_user(request, f'{updated} goals marked as incomplete.')
     mark_incomplete.short_description = "Mark selected goals as incomplete"
+    
+    def _set_completed(self, queryset, completed):
+        # saved one by one, so the toggles reach the activity log and the
+        # search index, forecasts and caches like any other save
+        today = timezone.now().date()
+        updated = 0
+        with transaction.atomic():
+            for goal in queryset.select_for_update(of=('self',)):
+                goal.completed = completed
+                goal.completed_date = today if completed else None
+                goal.save(update_fields=['completed', 'completed_date', 'updated_at'])
+                updated += 1
+        return updated
 
 @admin.register(LearningResource)
-class LearningResourceAdmin(admin.ModelAdmin):
+class LearningResourceAdmin(ScaleModeAdmin):
     """Admin configuration for LearningResource model"""
     
     list_display = ('title', 'user', 'skill', 'resource_type', 'is_completed', 'created_at')
-    list_filter = ('resource_type', 'is_completed', 'skill__category', 'created_at')
+    list_filter = ('resource_type', 'is_completed', 'skill__category', CachedSkillFilter, 'created_at')
     search_fields = ('title', 'user__username', 'skill__name', 'url')
     ordering = ('-created_at',)
+
+
+def folded_response(stacks, filename):
+    response = HttpResponse(stacks, content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Profiled requests; stacks download in folded format for flamegraph.pl or speedscope"""
+    
+    list_display = ('created_at', 'method', 'path', 'user', 'status_code', 'duration_ms', 'sql_count', 'sql_ms', 'trigger', 'download')
+    list_filter = ('trigger', 'method', 'created_at')
+    search_fields = ('path', 'view_name', 'user__username')
+    list_select_related = ('user',)
+    exclude = ('stacks',)
+    readonly_fields = ('download',) + tuple(field.name for field in RequestProfile._meta.fields if field.name != 'stacks')
+    actions = ['download_merged']
+    
+    def get_queryset(self, request):
+        # the stacks can be large and only the download needs them
+        return super().get_queryset(request).defer('stacks')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/folded/', self.admin_site.admin_view(self.folded_view),
+                name='tracker_requestprofile_folded',
+            ),
+        ] + super().get_urls()
+    
+    @admin.display(description='Stacks')
+    def download(self, obj):
+        url = reverse('admin:tracker_requestprofile_folded', args=[obj.pk])
+        return format_html('<a href="{}">{} samples</a>', url, obj.samples)
+    
+    def folded_view(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile):
+            return HttpResponse(status=403)
+        return folded_response(profile.stacks, f'profile-{pk}.folded')
+    
+    @admin.action(description='Download merged stacks of the selected profiles', permissions=['view'])
+    def download_merged(self, request, queryset):
+        totals = Counter()
+        for stacks in queryset.values_list('stacks', flat=True):
+            for line in stacks.splitlines():
+                stack, _, count = line.rpartition(' ')
+                totals[stack] += int(count)
+        merged = '\n'.join(f'{stack} {count}' for stack, count in totals.most_common())
+        return folded_response(merged, 'profiles.folded')
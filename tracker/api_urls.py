@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
-from .api_views import SkillViewSet, ProgressEntryViewSet, GoalViewSet, LearningResourceViewSet, DashboardAPIView
+from .api_views import SkillViewSet, ProgressEntryViewSet, GoalViewSet, LearningResourceViewSet, DashboardAPIView, SyncView, SearchView
 
 router = DefaultRouter()
 router.register(r'skills', SkillViewSet, basename='skill')
@@ -14,5 +14,7 @@ app_name = 'api'
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('search/', SearchView.as_view(), name='search'),
     path('auth/token/', obtain_auth_token, name='api_token_auth'),
 ]
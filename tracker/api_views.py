@@ -1,21 +1,84 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Sum
+from django.db.models import F, Sum
 from django.utils import timezone
 from datetime import timedelta
 from .models import Skill, ProgressEntry, Goal, LearningResource
-from .serializers import SkillSerializer, ProgressEntrySerializer, GoalSerializer, LearningResourceSerializer
+from .archive import lifetime_totals
+from .popularity import POPULAR_ORDERING
+from .goals import with_progress
+from .sync import changes_since, InvalidSyncToken
+from .search import search, InvalidSearchCursor, PAGE_SIZE
+from rest_framework.utils.urls import replace_query_param
+from .serializers import SkillSerializer, ScoredSkillSerializer, ProgressEntrySerializer, GoalSerializer, LearningResourceSerializer
 
-class SkillViewSet(viewsets.ModelViewSet):
+class SparseFieldsViewMixin:
+    """
+    Support ?fields=id,date and ?expand=skill on GET requests. Only the
+    columns behind the requested fields are selected, and related rows are
+    joined only when a requested field (or expansion) needs them.
+    """
+    
+    def requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        return [name.strip() for name in fields.split(',') if name.strip()]
+    
+    def requested_expansions(self):
+        expand = self.request.query_params.get('expand', '')
+        return [name.strip() for name in expand.split(',') if name.strip()]
+    
+    def is_sparse_request(self):
+        return self.request is not None and self.request.method in ('GET', 'HEAD')
+    
+    def get_serializer(self, *args, **kwargs):
+        if self.is_sparse_request():
+            kwargs.setdefault('fields', self.requested_fields())
+            kwargs.setdefault('expand', self.requested_expansions())
+        return super().get_serializer(*args, **kwargs)
+    
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.is_sparse_request():
+            queryset = self.narrow_queryset(queryset)
+        return queryset
+    
+    def narrow_queryset(self, queryset):
+        return self.get_serializer().narrow_queryset(queryset)
+
+class SkillViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    read_replica = True  # GET requests may read from the replica
     serializer_class = SkillSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Skill.objects.all()
+        queryset = Skill.objects.select_related('counters')
+        if self.request.query_params.get('sort') == 'popular':
+            return queryset.order_by(*POPULAR_ORDERING)
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def recommended(self, request):
+        # precomputed by the refresh_recommendations command
+        skills = Skill.objects.select_related('counters').filter(skillrecommendation__user=request.user).annotate(
+            score=F('skillrecommendation__score')
+        ).order_by('-score')
+        return Response(ScoredSkillSerializer(skills, many=True).data)
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        skill = self.get_object()
+        skills = Skill.objects.select_related('counters').filter(similar_to__skill=skill).annotate(
+            score=F('similar_to__score')
+        ).order_by('-score')
+        return Response(ScoredSkillSerializer(skills, many=True).data)
 
-class ProgressEntryViewSet(viewsets.ModelViewSet):
+class ProgressEntryViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    read_replica = True
     serializer_class = ProgressEntrySerializer
     permission_classes = [IsAuthenticated]
     
@@ -25,12 +88,13 @@ class ProgressEntryViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class GoalViewSet(viewsets.ModelViewSet):
+class GoalViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    read_replica = True
     serializer_class = GoalSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Goal.objects.filter(user=self.request.user)
+        return with_progress(Goal.objects.filter(user=self.request.user))
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -46,7 +110,8 @@ class GoalViewSet(viewsets.ModelViewSet):
         goal.save()
         return Response({'status': 'completed toggled'})
 
-class LearningResourceViewSet(viewsets.ModelViewSet):
+class LearningResourceViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    read_replica = True
     serializer_class = LearningResourceSerializer
     permission_classes = [IsAuthenticated]
     
@@ -64,6 +129,7 @@ class LearningResourceViewSet(viewsets.ModelViewSet):
         return Response({'status': 'completion toggled'})
 
 class DashboardAPIView(viewsets.ViewSet):
+    read_replica = True
     permission_classes = [IsAuthenticated]
     
     @action(detail=False, methods=['get'])
@@ -73,19 +139,19 @@ class DashboardAPIView(viewsets.ViewSet):
         
         total_skills = Skill.objects.count()
         user_progress_entries = ProgressEntry.objects.filter(user=user)
-        total_hours = user_progress_entries.aggregate(Sum('hours_spent'))['hours_spent__sum'] or 0
+        total_hours, total_sessions = lifetime_totals(user)
         
         goals = Goal.objects.filter(user=user)
         completed_goals = goals.filter(completed=True).count()
         pending_goals = goals.filter(completed=False).count()
         
         week_ago = today - timedelta(days=7)
-        recent_progress = user_progress_entries.filter(date__gte=week_ago).order_by('-date')[:5]
+        recent_progress = user_progress_entries.filter(date__gte=week_ago).select_related('skill').order_by('-date')[:5]
         
         upcoming_deadlines = goals.filter(
             completed=False, 
             deadline__gte=today
-        ).order_by('deadline')[:5]
+        ).select_related('skill').order_by('deadline')[:5]
         
         data = {
             'total_skills': total_skills,
@@ -96,3 +162,33 @@ class DashboardAPIView(viewsets.ViewSet):
             'upcoming_deadlines': GoalSerializer(upcoming_deadlines, many=True).data,
         }
         return Response(data)
+
+class SyncView(APIView):
+    """Everything that changed for the user since ?since=<token>, in one response"""
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        try:
+            data = changes_since(request.user, request.query_params.get('since'))
+        except InvalidSyncToken as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+
+class SearchView(APIView):
+    """The user's notes, goals and resources matching ?q=, best first, paged by ?cursor="""
+    permission_classes = [IsAuthenticated]
+    read_replica = True
+    
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', PAGE_SIZE))
+        except ValueError:
+            return Response({'detail': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data = search(request.user, request.query_params.get('q', ''), request.query_params.get('cursor'), limit)
+        except InvalidSearchCursor as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if data['next']:
+            data['next'] = replace_query_param(request.build_absolute_uri(), 'cursor', data['next'])
+        return Response(data)
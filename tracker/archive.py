@@ -0,0 +1,137 @@
+"""
+Archival of old progress entries.
+
+Entries older than a cutoff are folded into ProgressSummary (one row per
+user, skill and month) and moved to ProgressEntryArchive, so the live
+ProgressEntry table only holds recent history. Lifetime totals are the
+live entries plus the summaries, see lifetime_totals().
+"""
+from datetime import date
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+
+from .models import ProgressEntry, ProgressEntryArchive, ProgressSummary
+from .signals import without_tombstones
+
+
+def lifetime_totals(user, skill=None):
+    """Return (total hours, total sessions) including archived entries"""
+    live = ProgressEntry.objects.filter(user=user)
+    archived = ProgressSummary.objects.filter(user=user)
+    if skill is not None:
+        live = live.filter(skill=skill)
+        archived = archived.filter(skill=skill)
+    live_totals = live.aggregate(hours=Sum('hours_spent'), sessions=Count('id'))
+    archived_totals = archived.aggregate(hours=Sum('hours_spent'), sessions=Sum('sessions'))
+    hours = (live_totals['hours'] or 0) + (archived_totals['hours'] or 0)
+    sessions = live_totals['sessions'] + (archived_totals['sessions'] or 0)
+    return hours, sessions
+
+
+def archived_hours_by_skill(user):
+    """Return {skill_id: hours} of the user's archived progress"""
+    rows = ProgressSummary.objects.filter(user=user).values('skill_id').annotate(hours=Sum('hours_spent'))
+    return {row['skill_id']: row['hours'] for row in rows}
+
+
+def archive_user_progress(user_id, cutoff, batch_size=1000):
+    """Archive one user's entries dated before `cutoff`, returns rows moved"""
+    moved = 0
+    while True:
+        # short transactions, one bounded batch each
+        with transaction.atomic():
+            ids = list(
+                ProgressEntry.objects.filter(user_id=user_id, date__lt=cutoff)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return moved
+            batch = ProgressEntry.objects.filter(id__in=ids)
+
+            monthly = (
+                batch.annotate(month=TruncMonth('date'))
+                .values('skill_id', 'month')
+                .annotate(hours=Sum('hours_spent'), sessions=Count('id'))
+            )
+            for row in monthly:
+                summary, created = ProgressSummary.objects.get_or_create(
+                    user_id=user_id, skill_id=row['skill_id'], month=row['month'],
+                    defaults={'hours_spent': row['hours'], 'sessions': row['sessions']},
+                )
+                if not created:
+                    ProgressSummary.objects.filter(pk=summary.pk).update(
+                        hours_spent=F('hours_spent') + row['hours'],
+                        sessions=F('sessions') + row['sessions'],
+                    )
+
+            ProgressEntryArchive.objects.bulk_create(
+                [
+                    ProgressEntryArchive(
+                        id=entry.id, user_id=entry.user_id, skill_id=entry.skill_id,
+                        date=entry.date, description=entry.description,
+                        hours_spent=entry.hours_spent, created_at=entry.created_at,
+                    )
+                    for entry in batch
+                ],
+                ignore_conflicts=True,
+            )
+            # archiving isn't a delete made by the user, don't tombstone it
+            with without_tombstones():
+                batch.delete()
+            moved += len(ids)
+
+
+def archive_progress(cutoff, batch_size=1000):
+    """Archive every user's entries dated before `cutoff`"""
+    user_ids = (
+        ProgressEntry.objects.filter(date__lt=cutoff)
+        .order_by('user_id')
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+    return {user_id: archive_user_progress(user_id, cutoff, batch_size) for user_id in list(user_ids)}
+
+
+def partition_archive_by_year(first_year, last_year):
+    """
+    Postgres only: turn the archive table into one range partitioned by
+    year of `date`, with one partition per year plus a default one.
+    Safe to run again to add partitions for new years.
+    """
+    if connection.vendor != 'postgresql':
+        raise ValueError('Range partitioning needs PostgreSQL')
+
+    table = ProgressEntryArchive._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relkind FROM pg_class c WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+            [table],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise RuntimeError(f'Table {table} does not exist, run migrate first')
+
+        if row[0] != 'p':
+            # swap the plain table for a partitioned copy; the primary key
+            # has to include the partition column
+            cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{table}_old"')
+            cursor.execute(
+                f'CREATE TABLE "{table}" (LIKE "{table}_old" INCLUDING DEFAULTS) '
+                f'PARTITION BY RANGE ("date")'
+            )
+            cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY ("id", "date")')
+            cursor.execute(f'CREATE INDEX "{table}_user_date" ON "{table}" ("user_id", "date")')
+            cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+
+        for year in range(first_year, last_year + 1):
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}_{year}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{date(year, 1, 1)}') TO ('{date(year + 1, 1, 1)}')"
+            )
+
+        if row[0] != 'p':
+            cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{table}_old"')
+            cursor.execute(f'DROP TABLE "{table}_old"')
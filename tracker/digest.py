@@ -0,0 +1,179 @@
+"""
+Weekly progress digest emails.
+
+Users are processed in chunks. Each chunk needs four grouped queries
+(weekly hours, top skills, goals due, active days for the streak), its
+emails are rendered in a process pool and sent over one reused email
+connection. A DigestDelivery row per user and week, written as soon as
+that user's email is sent, makes reruns skip whoever already got it: a
+crash resends at most the one email in flight.
+"""
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Sum
+from django.template.loader import render_to_string
+
+from .models import ProgressEntry, Goal, DigestDelivery
+
+TOP_SKILLS = 3
+STREAK_LOOKBACK_DAYS = 365
+
+
+def week_bounds(day):
+    """Monday and Sunday of the week containing `day`"""
+    week_start = day - timedelta(days=day.weekday())
+    return week_start, week_start + timedelta(days=6)
+
+
+def pending_user_chunks(week_start, chunk_size):
+    """Yield lists of opted-in users that haven't had this week's digest yet"""
+    users = (
+        get_user_model().objects
+        .filter(email_notifications=True, is_active=True)
+        .exclude(email='')
+        .exclude(digestdelivery__week_start=week_start)
+        .order_by('pk')
+        .only('pk', 'username', 'first_name', 'email')
+    )
+    last_pk = 0
+    while True:
+        # keyset pagination, users sent in earlier chunks drop out anyway
+        chunk = list(users.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def streak_ending(dates, last_day):
+    """Consecutive active days ending at `last_day`, `dates` sorted newest first"""
+    streak = 0
+    expected = last_day
+    for day in dates:
+        if day > expected:
+            continue
+        if day != expected:
+            break
+        streak += 1
+        expected -= timedelta(days=1)
+    return streak
+
+
+def build_digests(users, week_start, week_end):
+    """Return {user_id: context} for a chunk of users using grouped queries"""
+    user_ids = [user.pk for user in users]
+    week_entries = ProgressEntry.objects.filter(user_id__in=user_ids, date__range=(week_start, week_end))
+
+    weekly_hours = dict(
+        week_entries.values('user_id').annotate(hours=Sum('hours_spent')).values_list('user_id', 'hours')
+    )
+
+    top_skills = defaultdict(list)
+    per_skill = (
+        week_entries.values('user_id', 'skill__name')
+        .annotate(hours=Sum('hours_spent'))
+        .order_by('user_id', '-hours')
+    )
+    for row in per_skill:
+        if len(top_skills[row['user_id']]) < TOP_SKILLS:
+            top_skills[row['user_id']].append({'name': row['skill__name'], 'hours': float(row['hours'])})
+
+    goals_due = defaultdict(list)
+    upcoming = (
+        Goal.objects.filter(
+            user_id__in=user_ids, completed=False,
+            deadline__range=(week_end + timedelta(days=1), week_end + timedelta(days=7)),
+        )
+        .order_by('user_id', 'deadline')
+        .values('user_id', 'title', 'deadline', 'skill__name')
+    )
+    for row in upcoming:
+        goals_due[row['user_id']].append(row)
+
+    active_days = defaultdict(list)
+    days = (
+        ProgressEntry.objects.filter(
+            user_id__in=user_ids,
+            date__range=(week_end - timedelta(days=STREAK_LOOKBACK_DAYS), week_end),
+        )
+        .order_by('user_id', '-date')
+        .values_list('user_id', 'date')
+        .distinct()
+    )
+    for user_id, day in days:
+        active_days[user_id].append(day)
+
+    return {
+        user.pk: {
+            'username': user.first_name or user.username,
+            'email': user.email,
+            'week_start': week_start,
+            'week_end': week_end,
+            'weekly_hours': float(weekly_hours.get(user.pk) or 0),
+            'streak': streak_ending(active_days[user.pk], week_end),
+            'goals_due': goals_due[user.pk],
+            'top_skills': top_skills[user.pk],
+        }
+        for user in users
+    }
+
+
+def render_digest(context):
+    """Render one digest, runs inside the process pool"""
+    subject = f"Your SkillTracker week: {context['weekly_hours']:g} hours"
+    text = render_to_string('tracker/emails/weekly_digest.txt', context)
+    html = render_to_string('tracker/emails/weekly_digest.html', context)
+    return context['email'], subject, text, html
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def send_weekly_digests(week_start, chunk_size=500, workers=None, dry_run=False, stdout=None):
+    """Send this week's digest to every opted-in user who hasn't got it yet"""
+    week_start, week_end = week_bounds(week_start)
+    pool = None
+    if workers != 0:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'skilltracker.settings'),),
+        )
+    sent = 0
+    try:
+        for users in pending_user_chunks(week_start, chunk_size):
+            digests = build_digests(users, week_start, week_end)
+            contexts = list(digests.values())
+            if pool is not None:
+                rendered = list(pool.map(render_digest, contexts, chunksize=50))
+            else:
+                rendered = [render_digest(context) for context in contexts]
+            if dry_run:
+                sent += len(rendered)
+                continue
+
+            # one connection for the whole chunk instead of one per email
+            with get_connection() as connection:
+                for user_id, (email, subject, text, html) in zip(digests, rendered):
+                    message = EmailMultiAlternatives(subject, text, settings.DEFAULT_FROM_EMAIL, [email])
+                    message.attach_alternative(html, 'text/html')
+                    connection.send_messages([message])
+                    DigestDelivery.objects.bulk_create(
+                        [DigestDelivery(user_id=user_id, week_start=week_start)], ignore_conflicts=True,
+                    )
+                    sent += 1
+            if stdout is not None:
+                stdout.write(f'  sent {sent} digests so far')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return sent
@@ -0,0 +1,82 @@
+"""
+Shape-preserving downsampling of daily chart series.
+
+Both methods split the series into contiguous buckets and keep real
+points from each, so peaks survive instead of being averaged away:
+
+- lttb: Largest-Triangle-Three-Buckets keeps one point per bucket, the
+  one forming the largest triangle with its neighbours' points.
+- minmax: keeps the lowest and highest point of each bucket.
+
+Every bucket is described (first date, days, total, min, max) so the
+chart can show what a point stands for.
+"""
+METHODS = ('lttb', 'minmax')
+
+
+def _ranges(start, stop, count):
+    """Split range(start, stop) into `count` contiguous (start, stop) pairs"""
+    size = (stop - start) / count
+    bounds = [start + int(i * size) for i in range(count)] + [stop]
+    return [(bounds[i], bounds[i + 1]) for i in range(count) if bounds[i] < bounds[i + 1]]
+
+
+def lttb(values, max_points):
+    """Return (indices kept, bucket ranges) for a list of y values"""
+    length = len(values)
+    if max_points >= length or max_points < 3:
+        return list(range(length)), [(i, i + 1) for i in range(length)]
+
+    # first and last points are always kept, in buckets of their own
+    ranges = [(0, 1)] + _ranges(1, length - 1, max_points - 2) + [(length - 1, length)]
+    kept = [0]
+    for i in range(1, len(ranges) - 1):
+        start, stop = ranges[i]
+        next_start, next_stop = ranges[i + 1]
+        # average of the next bucket stands in for the point not chosen yet
+        avg_x = (next_start + next_stop - 1) / 2
+        avg_y = sum(values[next_start:next_stop]) / (next_stop - next_start)
+        prev_x, prev_y = kept[-1], values[kept[-1]]
+
+        best, best_area = start, -1.0
+        for x in range(start, stop):
+            area = abs((prev_x - avg_x) * (values[x] - prev_y) - (prev_x - x) * (avg_y - prev_y))
+            if area > best_area:
+                best, best_area = x, area
+        kept.append(best)
+    kept.append(length - 1)
+    return kept, ranges
+
+
+def minmax(values, max_points):
+    """Return (indices kept, bucket ranges), the min and max of each bucket"""
+    length = len(values)
+    if max_points >= length or max_points < 2:
+        return list(range(length)), [(i, i + 1) for i in range(length)]
+
+    ranges = _ranges(0, length, max_points // 2)
+    kept = []
+    for start, stop in ranges:
+        low = min(range(start, stop), key=values.__getitem__)
+        high = max(range(start, stop), key=values.__getitem__)
+        kept.extend(sorted({low, high}))
+    return kept, ranges
+
+
+def downsample(dates, values, max_points, method='lttb'):
+    """
+    Downsample a daily series given as parallel lists. Returns the kept
+    (dates, values) and the buckets as columns: start date, days, active
+    days, total, min and max per bucket.
+    """
+    indices, ranges = (lttb if method == 'lttb' else minmax)(values, max_points)
+    buckets = {'start': [], 'days': [], 'active_days': [], 'total_hours': [], 'min_hours': [], 'max_hours': []}
+    for start, stop in ranges:
+        chunk = values[start:stop]
+        buckets['start'].append(dates[start])
+        buckets['days'].append(stop - start)
+        buckets['active_days'].append(sum(1 for value in chunk if value))
+        buckets['total_hours'].append(round(sum(chunk), 2))
+        buckets['min_hours'].append(min(chunk))
+        buckets['max_hours'].append(max(chunk))
+    return [dates[i] for i in indices], [values[i] for i in indices], buckets
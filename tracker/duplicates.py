@@ -0,0 +1,325 @@
+"""
+Near-duplicate skill detection and merging.
+
+Skill names are normalised ("React.js" -> "reactjs") and split into
+character trigrams. An inverted index from trigram to skill ids is used
+for blocking: only skills sharing enough trigrams are scored against
+each other, so a lookup touches a handful of candidates and the batch
+report stays far from comparing every pair. Candidates are scored with
+difflib's ratio on the normalised names.
+
+merge_skills() folds duplicates into one skill with set-based updates.
+Those send no signals, so it logs the moves and updates the counters,
+search index, forecasts and caches that depend on them itself.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from skilltracker.cache import tiered_cache
+from . import events, forecasts, popularity, search
+from .models import (
+    Skill, ProgressEntry, Goal, LearningResource, Notification, ActivityEvent,
+    ProgressSummary, ProgressEntryArchive, SkillSimilarity, SkillRecommendation, SkillLearner,
+)
+
+THRESHOLD = 0.8
+NGRAM = 3
+MAX_POSTINGS = 500  # trigrams shared by more skills than this are too common to block on
+CACHE_KEY = 'skills:names'
+CACHE_TIMEOUT = 3600
+
+_SYMBOLS = {'+': 'plus', '#': 'sharp'}  # keep C, C++ and C# apart
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_name(name):
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    for symbol, word in _SYMBOLS.items():
+        name = name.replace(symbol, word)
+    return _NON_ALNUM.sub('', name)
+
+
+def ngrams(key, n=NGRAM):
+    padded = f'^{key}$'
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def similarity(a, b):
+    """Score two normalised names between 0 and 1"""
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class SkillNameIndex:
+    """Inverted trigram index over (skill id, name) pairs"""
+
+    def __init__(self, skills=()):
+        self.keys = {}
+        self.names = {}
+        self.postings = defaultdict(set)
+        for skill_id, name in skills:
+            self.add(skill_id, name)
+
+    def add(self, skill_id, name):
+        key = normalize_name(name)
+        self.keys[skill_id] = key
+        self.names[skill_id] = name
+        for gram in ngrams(key):
+            self.postings[gram].add(skill_id)
+
+    def candidates(self, key):
+        """Skill ids sharing enough useful trigrams with `key`"""
+        grams = ngrams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            posting = self.postings.get(gram, ())
+            if len(posting) > MAX_POSTINGS:
+                continue
+            for skill_id in posting:
+                shared[skill_id] += 1
+        needed = min(2, len(grams))
+        return [skill_id for skill_id, count in shared.items() if count >= needed]
+
+    def similar(self, name, threshold=THRESHOLD, exclude=None):
+        """[(skill id, score)] for names close to `name`, best first"""
+        key = normalize_name(name)
+        matches = []
+        for skill_id in self.candidates(key):
+            if skill_id == exclude:
+                continue
+            score = similarity(key, self.keys[skill_id])
+            if score >= threshold:
+                matches.append((skill_id, score))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches
+
+    def pairs(self, threshold=THRESHOLD):
+        """Yield (id, id, score) for every near-duplicate pair, each pair once"""
+        for skill_id, key in self.keys.items():
+            for other_id in self.candidates(key):
+                if other_id <= skill_id:
+                    continue
+                score = similarity(key, self.keys[other_id])
+                if score >= threshold:
+                    yield skill_id, other_id, score
+
+
+def load_index():
+    skills = cache.get(CACHE_KEY)
+    if skills is None:
+        skills = list(Skill.objects.order_by().values_list('id', 'name'))
+        cache.set(CACHE_KEY, skills, CACHE_TIMEOUT)
+    return SkillNameIndex(skills)
+
+
+def invalidate_index():
+    cache.delete(CACHE_KEY)
+
+
+def find_similar_skills(name, threshold=THRESHOLD, limit=5, exclude=None):
+    """Existing skills whose names look like `name`, as [(skill, score)]"""
+    matches = load_index().similar(name, threshold, exclude=exclude)[:limit]
+    skills = Skill.objects.in_bulk([skill_id for skill_id, _ in matches])
+    return [(skills[skill_id], score) for skill_id, score in matches if skill_id in skills]
+
+
+def duplicate_groups(threshold=THRESHOLD):
+    """
+    Group near-duplicate skills. Pairs are joined transitively, so each
+    group is a list of skill ids sorted by id.
+    """
+    index = load_index()
+    parent = {}
+
+    def find(skill_id):
+        parent.setdefault(skill_id, skill_id)
+        while parent[skill_id] != skill_id:
+            parent[skill_id] = parent[parent[skill_id]]
+            skill_id = parent[skill_id]
+        return skill_id
+
+    for skill_id, other_id, _ in index.pairs(threshold):
+        parent[find(other_id)] = find(skill_id)
+
+    groups = defaultdict(list)
+    for skill_id in parent:
+        groups[find(skill_id)].append(skill_id)
+    return sorted((sorted(group) for group in groups.values()), key=lambda group: group[0])
+
+
+def pick_target(skill_ids):
+    """The skill to keep when merging: most progress entries, then oldest"""
+    usage = dict(
+        ProgressEntry.objects.filter(skill_id__in=skill_ids)
+        .values_list('skill_id').annotate(n=Count('id')).order_by()
+    )
+    return min(skill_ids, key=lambda skill_id: (-usage.get(skill_id, 0), skill_id))
+
+
+def _fold_collisions(model, skill_ids, key_fields, sum_fields):
+    """
+    Rows of `model` that would break unique_together once repointed to the
+    target are folded into one row per key: `sum_fields` are added up on
+    the lowest id and the rest are deleted. Collisions are rare, so the
+    folded rows are few. Returns the number deleted.
+    """
+    colliding = (
+        model.objects.filter(skill_id__in=skill_ids)
+        .values(*key_fields).annotate(n=Count('id')).filter(n__gt=1).order_by()
+    )
+    keys = {tuple(row[field] for field in key_fields) for row in colliding}
+    if not keys:
+        return 0
+
+    lookup = {f'{field}__in': {key[i] for key in keys} for i, field in enumerate(key_fields)}
+    groups = defaultdict(list)
+    for row in model.objects.filter(skill_id__in=skill_ids, **lookup).order_by('id'):
+        key = tuple(getattr(row, field) for field in key_fields)
+        if key in keys:
+            groups[key].append(row)
+
+    keep, drop = [], []
+    for rows in groups.values():
+        first = rows[0]
+        for field in sum_fields:
+            setattr(first, field, sum(getattr(row, field) for row in rows))
+        if model is ProgressEntry:
+            first.description = '\n'.join(row.description for row in rows if row.description)
+        keep.append(first)
+        drop.extend(row.pk for row in rows[1:])
+
+    model.objects.filter(pk__in=drop).delete()
+    update_fields = list(sum_fields)
+    if model is ProgressEntry:
+        update_fields += ['description', 'updated_at']
+    # saved one by one so sync clients and the activity log see the new totals
+    for row in keep:
+        row.save(update_fields=update_fields)
+    return len(drop)
+
+
+def _move(model, model_name, duplicate_ids, target, now):
+    """
+    Repoint the rows of `model` on `duplicate_ids` to `target` in one
+    update and log an 'update' for each, as saving them would have.
+    Returns the moved rows as they are now.
+    """
+    rows = list(model.objects.filter(skill_id__in=duplicate_ids).order_by('id'))
+    before = [events.snapshot(row) for row in rows]
+    # updated_at is set explicitly so sync clients pick the new skill up
+    model.objects.filter(pk__in=[row.pk for row in rows]).update(skill_id=target.pk, updated_at=now)
+    for row in rows:
+        row.skill, row.updated_at = target, now
+    ActivityEvent.objects.bulk_create([
+        ActivityEvent(
+            user_id=row.user_id, model_name=model_name, object_id=row.pk,
+            action='update', before=values, after=events.snapshot(row),
+        )
+        for row, values in zip(rows, before)
+    ], batch_size=1000)
+    return rows
+
+
+def _archived_learners(skill_ids):
+    """{user_id: (sessions, hours)} archived on `skill_ids`"""
+    rows = (
+        ProgressSummary.objects.filter(skill_id__in=skill_ids).values('user_id')
+        .annotate(sessions=Sum('sessions'), hours=Sum('hours_spent')).order_by()
+    )
+    return {row['user_id']: (row['sessions'], row['hours']) for row in rows}
+
+
+def _add_archived_learners(target, archived):
+    """Add the archived totals moved to `target` to its SkillLearner rows"""
+    existing = {
+        learner.user_id: learner
+        for learner in SkillLearner.objects.filter(skill=target, user_id__in=archived)
+    }
+    created = []
+    for user_id, (sessions, hours) in archived.items():
+        learner = existing.get(user_id)
+        if learner is None:
+            learner = SkillLearner(skill=target, user_id=user_id, sessions=0, hours_spent=0)
+            created.append(learner)
+        learner.sessions += sessions
+        learner.hours_spent += hours
+    SkillLearner.objects.bulk_create(created)
+    SkillLearner.objects.bulk_update(existing.values(), ['sessions', 'hours_spent'])
+
+
+def _owners(skill_ids):
+    """Users with progress, goals or resources on any of `skill_ids`"""
+    user_ids = set()
+    for model in (ProgressEntry, Goal, LearningResource, ProgressSummary, ProgressEntryArchive):
+        user_ids.update(model.objects.filter(skill_id__in=skill_ids).values_list('user_id', flat=True).distinct().order_by())
+    return user_ids
+
+
+def merge_skills(target, duplicates):
+    """
+    Repoint everything referencing `duplicates` to `target`, then delete
+    the duplicates. Progress entries and archived summaries that collide
+    on their unique key have their hours summed. Precomputed
+    similarities and recommendations for the duplicates are dropped, the
+    next refresh_recommendations run rebuilds them.
+
+    Returns a dict of row counts per table.
+    """
+    duplicate_ids = [skill.pk for skill in duplicates if skill.pk != target.pk]
+    if not duplicate_ids:
+        return {}
+    skill_ids = [target.pk] + duplicate_ids
+    now = timezone.now()
+    counts = {}
+
+    with transaction.atomic():
+        owners = _owners(duplicate_ids)
+        # before folding, which moves some of it onto the target's rows
+        archived = _archived_learners(duplicate_ids)
+        counts['progress_folded'] = _fold_collisions(
+            ProgressEntry, skill_ids, ('user_id', 'date'), ('hours_spent',)
+        )
+        counts['summaries_folded'] = _fold_collisions(
+            ProgressSummary, skill_ids, ('user_id', 'month'), ('hours_spent', 'sessions')
+        )
+        moved_progress = _move(ProgressEntry, 'progress', duplicate_ids, target, now)
+        counts['progress'] = len(moved_progress)
+        counts['goals'] = len(_move(Goal, 'goal', duplicate_ids, target, now))
+        counts['resources'] = len(_move(LearningResource, 'resource', duplicate_ids, target, now))
+        counts['notifications'] = Notification.objects.filter(related_skill_id__in=duplicate_ids).update(
+            related_skill_id=target.pk
+        )
+        counts['summaries'] = ProgressSummary.objects.filter(skill_id__in=duplicate_ids).update(
+            skill_id=target.pk
+        )
+        counts['archived'] = ProgressEntryArchive.objects.filter(skill_id__in=duplicate_ids).update(
+            skill_id=target.pk
+        )
+        SkillRecommendation.objects.filter(skill_id__in=duplicate_ids).delete()
+        SkillSimilarity.objects.filter(skill_id__in=duplicate_ids).delete()
+        SkillSimilarity.objects.filter(similar_skill_id__in=duplicate_ids).delete()
+        # takes the duplicates' SkillLearner and SkillCounters rows along
+        counts['skills'] = Skill.objects.filter(pk__in=duplicate_ids).delete()[1].get(Skill._meta.label, 0)
+
+        # the moved entries reach the target's learners through their
+        # events, like any other save; archived hours have no events
+        _add_archived_learners(target, archived)
+        popularity.refresh_counters([target.pk])
+        # progress entries are indexed under their skill's name
+        search.index(moved_progress)
+        for user_id in owners:
+            tiered_cache.bump_on_commit(f'user:{user_id}')
+            forecasts.refresh_on_commit(user_id)
+
+    invalidate_index()
+    return counts
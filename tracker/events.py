@@ -0,0 +1,128 @@
+"""
+Append-only activity log.
+
+Receivers in signals.py record an ActivityEvent for every create,
+update, delete and completion toggle of progress entries, goals and
+resources, with a full snapshot of the row before and after. Queryset
+.update() and bulk operations bypass model signals and are not logged,
+so code that changes rows in bulk saves them one by one instead, or
+logs the changes itself like duplicates.merge_skills().
+"""
+from django.db.models import Exists, OuterRef
+from django.utils.dateparse import parse_datetime
+
+from .models import ActivityEvent, ProgressEntry, ProgressEntryArchive, Goal, LearningResource
+
+LOGGED_MODELS = {
+    'progress': ProgressEntry,
+    'goal': Goal,
+    'resource': LearningResource,
+}
+
+TOGGLE_FIELDS = {'completed', 'is_completed'}
+# bookkeeping that changes along with a toggle or on every save
+INCIDENTAL_FIELDS = {'updated_at', 'completed_date'}
+
+
+def snapshot(instance):
+    return {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+
+def archived_snapshot(archived):
+    """The snapshot a ProgressEntry had before it was moved to the archive"""
+    values = {field.attname: getattr(archived, field.attname, None) for field in ProgressEntry._meta.concrete_fields}
+    # the archive doesn't keep updated_at
+    values['updated_at'] = archived.created_at
+    return values
+
+
+def stored_snapshot(instance):
+    """The row as it is in the database before `instance` is saved, or None"""
+    if instance._state.adding or instance.pk is None:
+        return None
+    attnames = [field.attname for field in instance._meta.concrete_fields]
+    return type(instance)._base_manager.filter(pk=instance.pk).values(*attnames).first()
+
+
+def changed_fields(before, after):
+    return {name for name, value in after.items() if before.get(name) != value}
+
+
+def update_action(before, after):
+    """'toggle' or 'update', None when nothing worth logging changed"""
+    changed = changed_fields(before, after) - {'updated_at'}
+    if not changed:
+        return None
+    if changed - INCIDENTAL_FIELDS <= TOGGLE_FIELDS and changed & TOGGLE_FIELDS:
+        return 'toggle'
+    return 'update'
+
+
+def record(model_name, instance, action, before, after):
+    return ActivityEvent.objects.create(
+        user_id=instance.user_id,
+        model_name=model_name,
+        object_id=instance.pk,
+        action=action,
+        before=before,
+        after=after,
+    )
+
+
+def _backfill(events):
+    ActivityEvent.objects.bulk_create(events)
+    return len(events)
+
+
+def seed_missing(batch_size=1000):
+    """
+    Log a 'create' for every object that predates the activity log, so
+    replaying from empty state adds up to what the tables hold. Objects
+    that were changed or deleted since the log started are seeded with
+    the state from before their first logged change, untouched ones
+    with their current row. Archived progress entries count as well:
+    archiving logs nothing, so they would otherwise go missing from
+    totals replayed after it. Returns the number of events written.
+    """
+    written = 0
+    for model_name, model in LOGGED_MODELS.items():
+        events = ActivityEvent.objects.filter(model_name=model_name)
+        creates = events.filter(action='create', object_id=OuterRef('object_id'))
+
+        batch, seen = [], set()
+        changed_first = (
+            events.exclude(action='create').filter(~Exists(creates))
+            .order_by('object_id', 'id').iterator(chunk_size=batch_size)
+        )
+        for event in changed_first:
+            if event.object_id in seen:
+                continue
+            seen.add(event.object_id)
+            batch.append(ActivityEvent(
+                user_id=event.user_id, model_name=model_name, object_id=event.object_id,
+                action='create', after=event.before,
+                created_at=parse_datetime(event.before['created_at']),
+            ))
+            if len(batch) == batch_size:
+                written += _backfill(batch)
+                batch = []
+
+        sources = [(model, snapshot)]
+        if model is ProgressEntry:
+            # archived rows keep their id, so their events are found the same way
+            sources.append((ProgressEntryArchive, archived_snapshot))
+        for source, make_snapshot in sources:
+            untouched = source.objects.filter(
+                ~Exists(events.filter(object_id=OuterRef('pk')))
+            ).order_by('pk').iterator(chunk_size=batch_size)
+            for instance in untouched:
+                batch.append(ActivityEvent(
+                    user_id=instance.user_id, model_name=model_name, object_id=instance.pk,
+                    action='create', after=make_snapshot(instance), created_at=instance.created_at,
+                ))
+                if len(batch) == batch_size:
+                    written += _backfill(batch)
+                    batch = []
+        if batch:
+            written += _backfill(batch)
+    return written
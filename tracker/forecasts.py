@@ -0,0 +1,200 @@
+"""
+Will a goal be met by its deadline at the owner's current pace?
+
+Goals have a deadline but no size, so the target comes from the owner's
+own plan: UserProfile.daily_goal_hours, shared between the skills they
+have pending goals on, for every day from the goal's creation to its
+deadline. Against that GoalForecast stores per pending goal:
+
+- hours logged on the skill since the goal was created (as in
+  tracker.goals.with_progress) and the pace of the last WINDOW_DAYS;
+- the hours that pace reaches by the deadline, the pace still needed and
+  the day the target would be reached;
+- on_track when the projection reaches the target, at_risk when it
+  falls short, overdue once the deadline has passed.
+
+Forecasts are computed for whole users at a time with NumPy (imported
+when first needed, not at worker boot): one query
+for the pending goals of up to USER_CHUNK users, one for their daily
+hours on those skills, then every goal of the chunk in a handful of
+array operations. They are refreshed
+
+- nightly for everyone by `manage.py refresh_forecasts`, which also
+  moves the window and the days left along;
+- after each transaction that writes a progress entry or goal of a user,
+  for that user only (refresh_on_commit, called by signals).
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import router, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ProgressEntry, Goal, GoalForecast
+
+WINDOW_DAYS = 28
+USER_CHUNK = 1000
+FORECAST_FIELDS = [
+    'status', 'target_hours', 'hours_so_far', 'hours_per_day', 'required_hours_per_day',
+    'projected_hours', 'projected_completion', 'refreshed_at',
+]
+MAX_HOURS = 9999999.99
+MAX_PACE = 99999.99
+# (user, skill) pair and day ordinal packed into one sortable key
+_DAYS = 10 ** 7
+
+
+def _decimal(value, limit=MAX_HOURS):
+    # goals decades away could outgrow the columns
+    return Decimal(f'{min(value, limit):.2f}')
+
+
+def _daily_hours(goals):
+    """(pair index, day ordinal, hours) arrays of the goals' users and skills"""
+    import numpy as np
+
+    pairs = {}
+    for _, user_id, skill_id, *_ in goals:
+        pairs.setdefault((user_id, skill_id), len(pairs))
+    first_day = min(timezone.localdate(created_at) for _, _, _, created_at, *_ in goals)
+    rows = (
+        ProgressEntry.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            skill_id__in={skill_id for _, skill_id in pairs},
+            date__gte=first_day,
+        )
+        .values('user_id', 'skill_id', 'date').annotate(hours=Sum('hours_spent'))
+        .values_list('user_id', 'skill_id', 'date', 'hours').order_by()
+    )
+    entries = [
+        (pairs[user_id, skill_id], day.toordinal(), float(hours))
+        for user_id, skill_id, day, hours in rows
+        # users and skills are filtered apart, so some rows belong to no goal
+        if (user_id, skill_id) in pairs
+    ]
+    goal_pairs = np.array([pairs[user_id, skill_id] for _, user_id, skill_id, *_ in goals], dtype=np.int64)
+    if not entries:
+        return goal_pairs, np.zeros(0, dtype=np.int64), np.zeros(0)
+    pair, day, hours = (np.array(column) for column in zip(*entries))
+    return goal_pairs, pair.astype(np.int64) * _DAYS + day, hours.astype(np.float64)
+
+
+def forecast(goals, today=None):
+    """
+    Unsaved GoalForecasts of `goals`, rows of (id, user_id, skill_id,
+    created_at, deadline, daily_goal_hours) all pending.
+    """
+    if not goals:
+        return []
+    # imported on first use: workers load this module at boot (signals)
+    # but only compute after a write commits
+    import numpy as np
+
+    today = today or timezone.now().date()
+    goal_ids, user_ids, _, created, deadlines, daily = zip(*goals)
+    goal_pairs, keys, hours = _daily_hours(goals)
+
+    # hours of a pair up to a day are a lookup in one running sum
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    running = np.concatenate(([0.0], np.cumsum(hours[order])))
+
+    def hours_through(day):
+        return running[np.searchsorted(keys, goal_pairs * _DAYS + day, side='right')]
+
+    def hours_before(day):
+        return running[np.searchsorted(keys, goal_pairs * _DAYS + day, side='left')]
+
+    today_day = today.toordinal()
+    start = np.array([timezone.localdate(value).toordinal() for value in created], dtype=np.int64)
+    deadline = np.array([value.toordinal() for value in deadlines], dtype=np.int64)
+
+    hours_so_far = hours_through(_DAYS - 1) - hours_before(start)
+    window_start = np.maximum(start, today_day - WINDOW_DAYS + 1)
+    window_days = np.maximum(today_day - window_start + 1, 1)
+    pace = (hours_through(today_day) - hours_before(window_start)) / window_days
+
+    # the owner's daily hours are split between the skills they have goals on
+    users, user_index = np.unique(np.array(user_ids, dtype=np.int64), return_inverse=True)
+    _, first_goal_of_pair = np.unique(goal_pairs, return_index=True)
+    skills_per_user = np.bincount(user_index[first_goal_of_pair], minlength=len(users))
+    share = np.array([float(value) for value in daily]) / skills_per_user[user_index]
+    target = share * np.maximum(deadline - start + 1, 1)
+
+    days_left = np.maximum(deadline - today_day, 0)
+    remaining = np.maximum(target - hours_so_far, 0)
+    projected = hours_so_far + pace * days_left
+    required = remaining / np.maximum(days_left, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_to_target = np.where(remaining == 0, 0, np.ceil(remaining / pace))
+    reachable = np.isfinite(days_to_target) & (days_to_target <= (date.max - today).days)
+    status = np.where(deadline < today_day, 'overdue', np.where(projected >= target - 0.005, 'on_track', 'at_risk'))
+
+    return [
+        GoalForecast(
+            goal_id=goal_ids[i], status=str(status[i]),
+            target_hours=_decimal(target[i]), hours_so_far=_decimal(hours_so_far[i]),
+            hours_per_day=_decimal(pace[i], MAX_PACE), required_hours_per_day=_decimal(required[i], MAX_PACE),
+            projected_hours=_decimal(projected[i]),
+            projected_completion=today + timedelta(days=int(days_to_target[i])) if reachable[i] else None,
+            refreshed_at=timezone.now(),
+        )
+        for i in range(len(goals))
+    ]
+
+
+def refresh_users(user_ids, today=None):
+    """Recompute the forecasts of every goal of `user_ids`"""
+    user_ids = list(user_ids)
+    goals = list(
+        Goal.objects.filter(user_id__in=user_ids, completed=False)
+        .values_list('id', 'user_id', 'skill_id', 'created_at', 'deadline', 'user__daily_goal_hours')
+        .order_by()
+    )
+    forecasts = forecast(goals, today)
+    with transaction.atomic(using=router.db_for_write(GoalForecast)):
+        GoalForecast.objects.filter(goal__user_id__in=user_ids, goal__completed=True).delete()
+        GoalForecast.objects.bulk_create(
+            forecasts, batch_size=1000, update_conflicts=True,
+            unique_fields=['goal'], update_fields=FORECAST_FIELDS,
+        )
+    return len(forecasts)
+
+
+def refresh_all(today=None):
+    """Recompute every forecast, USER_CHUNK users at a time"""
+    user_ids = list(
+        Goal.objects.filter(completed=False).values_list('user_id', flat=True).distinct().order_by('user_id')
+    )
+    refreshed = 0
+    for start in range(0, len(user_ids), USER_CHUNK):
+        refreshed += refresh_users(user_ids[start:start + USER_CHUNK], today)
+    # completed in bulk (admin action) or by users with no pending goal left
+    GoalForecast.objects.filter(goal__completed=True).delete()
+    return refreshed
+
+
+class _PendingRefresh:
+    """on_commit callback refreshing the users written in one transaction"""
+
+    def __init__(self, user_id):
+        self.user_ids = {user_id}
+
+    def __call__(self):
+        refresh_users(self.user_ids)
+
+
+def refresh_on_commit(user_id):
+    """
+    Refresh the user's forecasts once the current transaction commits,
+    once however many of their rows it writes.
+    """
+    using = router.db_for_write(GoalForecast)
+    connection = transaction.get_connection(using)
+    # callbacks of a rolled back transaction are dropped along with it
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, _PendingRefresh):
+            callback.user_ids.add(user_id)
+            return
+    transaction.on_commit(_PendingRefresh(user_id), using=using)
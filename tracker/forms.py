@@ -1,8 +1,12 @@
 from django import forms
 from django.forms import ModelForm
-from .models import Skill, ProgressEntry, Goal, LearningResource
+from django.db.models import F, OuterRef, Subquery
+from .models import Skill, ProgressEntry, Goal, LearningResource, SkillRecommendation
 
 class SkillForm(ModelForm):
+    # set once the user has seen the near-duplicate warning and submits anyway
+    confirm_duplicate = forms.BooleanField(required=False, widget=forms.HiddenInput)
+    
     class Meta:
         model = Skill
         fields = ['name', 'category', 'difficulty', 'description']
@@ -28,8 +32,11 @@ class ProgressEntryForm(ModelForm):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
         if user:
-            # show all available skills
-            self.fields['skill'].queryset = Skill.objects.all()
+            # show all available skills, the ones recommended for this user first
+            recommended = SkillRecommendation.objects.filter(user=user, skill=OuterRef('pk')).values('score')[:1]
+            self.fields['skill'].queryset = Skill.objects.annotate(
+                recommendation_score=Subquery(recommended)
+            ).order_by(F('recommendation_score').desc(nulls_last=True), 'name')
 
 class GoalForm(ModelForm):
     class Meta:
@@ -0,0 +1,34 @@
+"""
+Goal progress, computed in the query that lists the goals.
+
+with_progress() adds hours_so_far and sessions_so_far: the progress the
+goal's owner logged on its skill since the goal was created. Each is a
+correlated subquery served by the (user, skill, date) unique index, so
+a page of goals costs one query however many goals it holds. The
+stored forecast of the goal (tracker.forecasts) is joined in the same
+query.
+"""
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import ProgressEntry
+
+
+def _since_created():
+    return ProgressEntry.objects.filter(
+        user=OuterRef('user'),
+        skill=OuterRef('skill'),
+        date__gte=OuterRef('created_at__date'),
+    ).order_by().values('user')
+
+
+def with_progress(queryset):
+    hours = _since_created().annotate(total=Sum('hours_spent')).values('total')
+    sessions = _since_created().annotate(total=Count('id')).values('total')
+    return queryset.select_related('skill', 'forecast').annotate(
+        hours_so_far=Coalesce(
+            Subquery(hours, output_field=DecimalField(max_digits=9, decimal_places=2)),
+            Value(0, output_field=DecimalField(max_digits=9, decimal_places=2)),
+        ),
+        sessions_so_far=Coalesce(Subquery(sessions, output_field=IntegerField()), Value(0)),
+    )
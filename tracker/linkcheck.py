@@ -0,0 +1,158 @@
+"""
+Concurrent link checking for learning resources.
+
+Every distinct URL is fetched once with a pooled httpx client. A
+semaphore per host keeps us polite to sites many users link to, and the
+stored ETag/Last-Modified turn repeat checks into cheap 304s.
+
+URLs are user input, so only public addresses are fetched: the host is
+resolved and checked before every request, redirects included (they
+are followed here, not by httpx), and the address actually connected to
+is checked again before anything is read. Private, loopback,
+link-local, reserved and multicast addresses are refused.
+"""
+import asyncio
+import ipaddress
+import re
+import socket
+from html import unescape
+from urllib.parse import urlsplit
+
+import httpx
+
+USER_AGENT = 'SkillTracker-LinkChecker/1.0'
+
+# enough of the page to find <title>, we never download whole documents
+MAX_BODY_BYTES = 64 * 1024
+
+MAX_REDIRECTS = 10
+
+TITLE_RE = re.compile(rb'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+def _title_from(body, encoding):
+    match = TITLE_RE.search(body)
+    if not match:
+        return ''
+    title = match.group(1).decode(encoding or 'utf-8', errors='replace')
+    return ' '.join(unescape(title).split())[:300]
+
+
+async def _read_head(response):
+    body = b''
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) >= MAX_BODY_BYTES:
+            break
+    return body
+
+
+class BlockedAddress(ValueError):
+    """The URL is not http(s) or its host is not a public address"""
+
+
+def _is_public(address, allowed_networks=()):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])  # drop an IPv6 zone
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if any(ip in network for network in allowed_networks):
+        return True
+    return ip.is_global and not ip.is_multicast
+
+
+async def _check_host(url, allowed_networks):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise BlockedAddress(f'not an http(s) URL: {url}')
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    addresses = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    for *_, sockaddr in addresses:
+        if not _is_public(sockaddr[0], allowed_networks):
+            raise BlockedAddress(f'{parts.hostname} resolves to {sockaddr[0]}')
+
+
+def _check_peer(response, allowed_networks):
+    # the name may resolve differently by the time httpx connects
+    stream = response.extensions.get('network_stream')
+    server_addr = stream.get_extra_info('server_addr') if stream is not None else None
+    if server_addr and not _is_public(server_addr[0], allowed_networks):
+        raise BlockedAddress(f'{response.url.host} connected to {server_addr[0]}')
+
+
+async def _result(response, url, previous):
+    result = {
+        'url': url,
+        'status_code': response.status_code,
+        'is_ok': response.status_code < 400,
+        'final_url': str(response.url)[:2000],
+        'etag': response.headers.get('ETag', '')[:200],
+        'last_modified': response.headers.get('Last-Modified', '')[:100],
+        'error': '',
+    }
+    if response.status_code == 304 and previous:
+        result['title'] = previous.get('title', '')
+        result['etag'] = result['etag'] or previous.get('etag', '')
+        result['last_modified'] = result['last_modified'] or previous.get('last_modified', '')
+    elif 'html' in response.headers.get('Content-Type', ''):
+        result['title'] = _title_from(await _read_head(response), response.encoding)
+    else:
+        result['title'] = ''
+    return result
+
+
+async def check_url(client, url, previous=None, allowed_networks=()):
+    """
+    Fetch one url, returns a dict of LinkStatus fields. Hosts in
+    `allowed_networks` are fetched even though they aren't public.
+    """
+    original_url = url
+    headers = {}
+    if previous:
+        # conditional request, an unchanged page answers 304 with no body
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            await _check_host(url, allowed_networks)
+            async with client.stream('GET', url, headers=headers) as response:
+                _check_peer(response, allowed_networks)
+                if response.has_redirect_location:
+                    url = str(response.url.join(response.headers['Location']))
+                    continue
+                return await _result(response, original_url, previous)
+        raise httpx.TooManyRedirects(f'more than {MAX_REDIRECTS} redirects', request=response.request)
+    except (httpx.HTTPError, httpx.InvalidURL, ValueError, OSError) as exc:
+        return {
+            'url': original_url, 'status_code': None, 'is_ok': False, 'final_url': '',
+            'title': '', 'etag': '', 'last_modified': '',
+            'error': (type(exc).__name__ + ': ' + str(exc))[:200],
+        }
+
+
+async def check_urls(urls, previous=None, concurrency=50, per_host=4, timeout=10.0, allowed_networks=()):
+    """
+    Check `urls` concurrently, `previous` maps url -> last stored result.
+    `allowed_networks` (ip_network objects) are exempt from the public
+    address check.
+    """
+    previous = previous or {}
+    host_limits = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def limited(client, url):
+        host = urlsplit(url).hostname or ''
+        semaphore = host_limits.setdefault(host, asyncio.Semaphore(per_host))
+        async with semaphore:
+            return await check_url(client, url, previous.get(url), allowed_networks)
+
+    async with httpx.AsyncClient(
+        limits=limits,
+        timeout=httpx.Timeout(timeout),
+        headers={'User-Agent': USER_AGENT},
+        # a proxy would be the peer checked above, connect directly
+        trust_env=False,
+    ) as client:
+        return await asyncio.gather(*(limited(client, url) for url in urls))
@@ -0,0 +1,34 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from tracker.archive import archive_progress, partition_archive_by_year
+
+
+class Command(BaseCommand):
+    help = 'Compact old progress entries into monthly summaries and move them to the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365,
+                            help='Archive entries older than this many days (default 365)')
+        parser.add_argument('--before', type=date.fromisoformat,
+                            help='Archive entries dated before YYYY-MM-DD, overrides --days')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--partition', action='store_true',
+                            help='PostgreSQL only: range partition the archive table by year first')
+
+    def handle(self, *args, **options):
+        cutoff = options['before'] or date.today() - timedelta(days=options['days'])
+
+        if options['partition']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--partition needs PostgreSQL')
+            # a few years of headroom so new rows don't land in the default partition
+            partition_archive_by_year(2000, date.today().year + 5)
+            self.stdout.write('Archive table is partitioned by year')
+
+        moved = archive_progress(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {sum(moved.values())} entries before {cutoff} for {len(moved)} users'
+        ))
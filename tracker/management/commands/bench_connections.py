@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from skilltracker.dbpool import checkout
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-request database cost of a new connection each time with reused connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Simulated requests per mode (default 200)')
+        parser.add_argument('--queries', type=int, default=1, help='Queries per request (default 1)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        self.connection = connections[options['database']]
+        self.queries = options['queries']
+        settings_dict = self.connection.settings_dict
+        current = 'pool' if settings_dict.get('OPTIONS', {}).get('pool') else f"CONN_MAX_AGE={settings_dict['CONN_MAX_AGE']}"
+
+        modes = [
+            ('new connection (CONN_MAX_AGE=0)', self.new_connection),
+            ('reused, health-checked', self.reused),
+            (f'current settings ({current})', self.current_settings),
+        ]
+        header = f"{'mode':<36} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'saved ms':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        baseline = None
+        for name, request in modes:
+            request()  # warm up
+            timings = sorted(request() for _ in range(options['requests']))
+            mean = sum(timings) / len(timings) * 1000
+            baseline = mean if baseline is None else baseline
+            self.stdout.write(
+                f'{name:<36} {mean:>9.3f} {percentile(timings, 50) * 1000:>9.3f} '
+                f'{percentile(timings, 95) * 1000:>9.3f} {baseline - mean:>9.3f}'
+            )
+        self.connection.close()
+
+    def run_queries(self):
+        with self.connection.cursor() as cursor:
+            for _ in range(self.queries):
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+
+    def new_connection(self):
+        self.connection.close()
+        start = time.perf_counter()
+        checkout(self.connection.alias)
+        self.run_queries()
+        return time.perf_counter() - start
+
+    def reused(self):
+        # what request_started does with CONN_MAX_AGE > 0 and health checks on
+        self.connection.health_check_done = False
+        start = time.perf_counter()
+        checkout(self.connection.alias)
+        self.run_queries()
+        return time.perf_counter() - start
+
+    def current_settings(self):
+        # a request as Django runs it: close_old_connections on start and finish
+        start = time.perf_counter()
+        close_old_connections()
+        checkout(self.connection.alias)
+        self.run_queries()
+        close_old_connections()
+        return time.perf_counter() - start
@@ -0,0 +1,85 @@
+import gzip
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from tracker.models import Skill, ProgressEntry, Goal, LearningResource
+from tracker.renderers import MessagePackRenderer
+from tracker.serializers import ProgressEntrySerializer, GoalSerializer, LearningResourceSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = 'Compare JSON and MessagePack encode time and wire size for the API serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Objects per payload (default 1000)')
+        parser.add_argument('--repeat', type=int, default=20, help='Encodes per measurement (default 20)')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        payloads = {
+            'progress': ProgressEntrySerializer(self.sample_progress(rows), many=True).data,
+            'goals': GoalSerializer(self.sample_goals(rows), many=True).data,
+            'resources': LearningResourceSerializer(self.sample_resources(rows), many=True).data,
+        }
+        renderers = {'json': JSONRenderer(), 'msgpack': MessagePackRenderer()}
+
+        header = f"{'payload':<10} {'format':<8} {'encode ms':>10} {'raw B':>9} {'gzip B':>9} {'br B':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, data in payloads.items():
+            for fmt, renderer in renderers.items():
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    body = renderer.render(data)
+                elapsed = (time.perf_counter() - start) / repeat * 1000
+                gzipped = len(gzip.compress(body, compresslevel=6))
+                brotlied = len(brotli.compress(body, quality=4)) if brotli else '-'
+                self.stdout.write(f'{name:<10} {fmt:<8} {elapsed:>10.2f} {len(body):>9} {gzipped:>9} {brotlied:>9}')
+
+    # unsaved instances, so the benchmark needs no database rows
+
+    def sample_skill(self, i):
+        return Skill(id=i % 25 + 1, name=f'Skill {i % 25}', category='backend', difficulty='medium')
+
+    def sample_progress(self, rows):
+        now = timezone.now()
+        return [
+            ProgressEntry(
+                id=i + 1, skill=self.sample_skill(i), date=date.today() - timedelta(days=i),
+                description='Worked through the ORM docs and wrote notes on select_related.',
+                hours_spent=Decimal('1.50'), created_at=now, updated_at=now,
+            )
+            for i in range(rows)
+        ]
+
+    def sample_goals(self, rows):
+        now = timezone.now()
+        return [
+            Goal(
+                id=i + 1, skill=self.sample_skill(i), title=f'Finish chapter {i}',
+                description='Read it and do the exercises.', deadline=date.today() + timedelta(days=i),
+                completed=i % 3 == 0, created_at=now, updated_at=now,
+            )
+            for i in range(rows)
+        ]
+
+    def sample_resources(self, rows):
+        now = timezone.now()
+        return [
+            LearningResource(
+                id=i + 1, skill=self.sample_skill(i), title=f'Tutorial {i}',
+                url=f'https://example.com/tutorials/{i}', resource_type='article',
+                notes='Good intro, skip part two.', is_completed=False, created_at=now, updated_at=now,
+            )
+            for i in range(rows)
+        ]
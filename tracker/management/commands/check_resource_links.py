@@ -0,0 +1,58 @@
+import asyncio
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tracker.linkcheck import check_urls
+from tracker.models import LearningResource, LinkStatus
+
+STATUS_FIELDS = ['status_code', 'is_ok', 'final_url', 'title', 'etag', 'last_modified', 'error', 'checked_at']
+
+
+class Command(BaseCommand):
+    help = 'Check every distinct learning resource URL once and cache the result in LinkStatus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=24,
+                            help='Skip URLs checked less than this many hours ago (default 24)')
+        parser.add_argument('--concurrency', type=int, default=50, help='Open connections in total')
+        parser.add_argument('--per-host', type=int, default=4, help='Concurrent requests per host')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Seconds per request')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        urls = set(LearningResource.objects.values_list('url', flat=True).distinct())
+        fresh_after = timezone.now() - timedelta(hours=options['max_age'])
+        fresh = set(
+            LinkStatus.objects.filter(url__in=urls, checked_at__gte=fresh_after).values_list('url', flat=True)
+        )
+        urls = sorted(urls - fresh)
+        self.stdout.write(f'Checking {len(urls)} URLs ({len(fresh)} still fresh)')
+
+        broken = 0
+        batch_size = options['batch_size']
+        for start in range(0, len(urls), batch_size):
+            batch = urls[start:start + batch_size]
+            previous = {
+                row['url']: row
+                for row in LinkStatus.objects.filter(url__in=batch).values('url', 'etag', 'last_modified', 'title')
+            }
+            results = asyncio.run(check_urls(
+                batch, previous,
+                concurrency=options['concurrency'],
+                per_host=options['per_host'],
+                timeout=options['timeout'],
+            ))
+            now = timezone.now()
+            LinkStatus.objects.bulk_create(
+                [LinkStatus(checked_at=now, **result) for result in results],
+                update_conflicts=True,
+                unique_fields=['url'],
+                update_fields=STATUS_FIELDS,
+            )
+            broken += sum(1 for result in results if not result['is_ok'])
+
+        # statuses for URLs nobody links to anymore
+        LinkStatus.objects.exclude(url__in=LearningResource.objects.values('url')).delete()
+        self.stdout.write(self.style.SUCCESS(f'Checked {len(urls)} URLs, {broken} broken'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from tracker.duplicates import duplicate_groups, THRESHOLD
+from tracker.models import Skill
+
+
+class Command(BaseCommand):
+    help = 'Report groups of skills whose names look like near-duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                            help=f'Minimum name similarity between 0 and 1 (default {THRESHOLD})')
+
+    def handle(self, *args, **options):
+        groups = duplicate_groups(options['threshold'])
+        if not groups:
+            self.stdout.write(self.style.SUCCESS('No near-duplicate skills found'))
+            return
+
+        skill_ids = [skill_id for group in groups for skill_id in group]
+        skills = Skill.objects.in_bulk(skill_ids)
+        usage = dict(
+            Skill.objects.filter(pk__in=skill_ids)
+            .annotate(n=Count('progressentry')).values_list('id', 'n')
+        )
+        for group in groups:
+            # same choice as the admin merge action: most entries, then oldest
+            target_id = min(group, key=lambda skill_id: (-usage.get(skill_id, 0), skill_id))
+            self.stdout.write(f'{len(group)} skills:')
+            for skill_id in group:
+                marker = '*' if skill_id == target_id else ' '
+                self.stdout.write(f'  {marker} [{skill_id}] {skills[skill_id]} - {usage.get(skill_id, 0)} entries')
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {len(groups)} groups covering {len(skill_ids)} skills; * marks the skill a merge would keep'
+        ))
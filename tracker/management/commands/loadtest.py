@@ -0,0 +1,205 @@
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+import httpx
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from tracker.models import Skill, ProgressEntry
+
+USERNAME_PREFIX = 'loadtest_'
+PASSWORD = 'loadtest-password'
+
+# (endpoint name, weight) - roughly what a day of real traffic looks like
+TRAFFIC_MIX = [
+    ('dashboard', 3),
+    ('progress_post', 1),
+    ('api_progress_list', 3),
+    ('progress_chart', 2),
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Drive a realistic mix of logged-in traffic against a local server and report latency per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users (default 20)')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run (default 30)')
+        parser.add_argument('--seed', action='store_true',
+                            help='Create the load test users, skills and history first')
+        parser.add_argument('--entries-per-user', type=int, default=365)
+        parser.add_argument('--url', help='Target an already running server instead of starting one')
+        parser.add_argument('--port', type=int, default=8089, help='Port for the local server (default 8089)')
+        parser.add_argument('--allow-database', metavar='NAME',
+                            help='Run against this database although DEBUG is off and it is not SQLite')
+
+    def handle(self, *args, **options):
+        self.check_database(options['allow_database'])
+        if options['seed']:
+            self.seed(options['users'], options['entries_per_user'])
+        usernames = list(
+            get_user_model().objects.filter(username__startswith=USERNAME_PREFIX)
+            .order_by('username').values_list('username', flat=True)[:options['users']]
+        )
+        if not usernames:
+            raise CommandError('No load test users found, run again with --seed')
+        skill_ids = list(Skill.objects.values_list('id', flat=True)[:50])
+
+        server = None
+        base_url = options['url']
+        if not base_url:
+            server, base_url = self.start_server(options['port'])
+        try:
+            results = asyncio.run(self.run_load(base_url, usernames, skill_ids, options['duration']))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+        self.report(results, options['duration'])
+
+    def check_database(self, allowed):
+        """Refuse to write load test users and traffic to a real database by accident"""
+        database = connections['default'].settings_dict
+        if settings.DEBUG or database['ENGINE'] == 'django.db.backends.sqlite3':
+            return
+        if allowed is not None and allowed == str(database['NAME']):
+            return
+        raise CommandError(
+            f'Refusing to run against database {database["NAME"]!r} with DEBUG off. '
+            f'Use a SQLite DATABASE_URL, set DEBUG=True or pass --allow-database={database["NAME"]}'
+        )
+
+    def seed(self, users, entries_per_user):
+        """Create users with a year of history each, reusing existing ones"""
+        user_model = get_user_model()
+        skills = list(Skill.objects.all()[:20])
+        if len(skills) < 5:
+            skills += Skill.objects.bulk_create([
+                Skill(name=f'Load Skill {i}', category=Skill.CATEGORIES[i % len(Skill.CATEGORIES)][0], difficulty='medium')
+                for i in range(10)
+            ])
+        # hash once, hashing per user would dominate the seeding time
+        password = make_password(PASSWORD)
+        existing = set(user_model.objects.filter(username__startswith=USERNAME_PREFIX).values_list('username', flat=True))
+        new_users = [
+            user_model(username=f'{USERNAME_PREFIX}{i:04d}', password=password)
+            for i in range(users) if f'{USERNAME_PREFIX}{i:04d}' not in existing
+        ]
+        user_model.objects.bulk_create(new_users)
+
+        today = date.today()
+        entries = []
+        for user in user_model.objects.filter(username__in=[u.username for u in new_users]):
+            for day in range(entries_per_user):
+                entries.append(ProgressEntry(
+                    user=user, skill=skills[day % len(skills)], date=today - timedelta(days=day + 1),
+                    description='Seeded load test entry', hours_spent=Decimal(random.choice(['0.5', '1.0', '1.5', '2.0'])),
+                ))
+        ProgressEntry.objects.bulk_create(entries, batch_size=2000, ignore_conflicts=True)
+        self.stdout.write(f'Seeded {len(new_users)} users and {len(entries)} progress entries')
+
+    def start_server(self, port):
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                raise CommandError(f'Port {port} is already in use')
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'skilltracker.settings'))
+        server = subprocess.Popen(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runserver', f'127.0.0.1:{port}', '--noreload'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            with socket.socket() as sock:
+                if sock.connect_ex(('127.0.0.1', port)) == 0:
+                    return server, f'http://127.0.0.1:{port}'
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+        server.terminate()
+        raise CommandError('Local server did not start')
+
+    async def run_load(self, base_url, usernames, skill_ids, duration):
+        results = defaultdict(list)  # endpoint -> [(latency seconds, ok)]
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(
+            self.virtual_user(base_url, username, skill_ids, deadline, results)
+            for username in usernames
+        ))
+        return results
+
+    async def virtual_user(self, base_url, username, skill_ids, deadline, results):
+        async with httpx.AsyncClient(base_url=base_url, timeout=30, follow_redirects=False) as client:
+            await client.get('/accounts/login/')
+            response = await client.post('/accounts/login/', data={
+                'username': username, 'password': PASSWORD,
+                'csrfmiddlewaretoken': client.cookies.get('csrftoken', ''),
+            })
+            if response.status_code != 302:
+                results['login'].append((0.0, False))
+                return
+
+            names = [name for name, weight in TRAFFIC_MIX]
+            weights = [weight for name, weight in TRAFFIC_MIX]
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = await self.request(client, name, skill_ids)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                results[name].append((time.perf_counter() - start, ok))
+
+    async def request(self, client, name, skill_ids):
+        if name == 'dashboard':
+            return await client.get('/')
+        if name == 'api_progress_list':
+            return await client.get('/api/progress/', params={'page': random.randint(1, 5)})
+        if name == 'progress_chart':
+            return await client.get('/api/progress-chart/', params={'days': random.choice([7, 30, 90])})
+        if name == 'progress_post':
+            # random dates keep (user, skill, date) collisions rare
+            day = date.today() - timedelta(days=random.randint(0, 3 * 365))
+            return await client.post('/progress/add/', data={
+                'skill': random.choice(skill_ids), 'date': day.isoformat(),
+                'hours_spent': '1.0', 'description': 'Load test session',
+                'csrfmiddlewaretoken': client.cookies.get('csrftoken', ''),
+            })
+        raise ValueError(name)
+
+    def report(self, results, duration):
+        header = f"{'endpoint':<20} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        total = errors = 0
+        for name, samples in sorted(results.items()):
+            latencies = sorted(latency * 1000 for latency, ok in samples)
+            failed = sum(1 for latency, ok in samples if not ok)
+            total += len(samples)
+            errors += failed
+            self.stdout.write(
+                f'{name:<20} {len(samples):>9} {len(samples) / duration:>8.1f} '
+                f'{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} '
+                f'{percentile(latencies, 99):>8.1f} {failed / len(samples):>8.1%}'
+            )
+        self.stdout.write('-' * len(header))
+        error_rate = errors / total if total else 0
+        self.stdout.write(f'{"total":<20} {total:>9} {total / duration:>8.1f} {"":>8} {"":>8} {"":>8} {error_rate:>8.1%}')
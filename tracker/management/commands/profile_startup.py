@@ -0,0 +1,86 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# runs in a fresh interpreter so every import is really cold
+PROBE = """
+import json, time
+start = time.perf_counter()
+import skilltracker.wsgi
+wsgi_import = time.perf_counter() - start
+from skilltracker.startup import warm_up
+print(json.dumps(dict(wsgi_import=wsgi_import, **warm_up())))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Report cold start time, per-module import cost and URLconf/template warmup for skilltracker.wsgi'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--role', action='append', choices=['all', 'html', 'api'],
+                            help='WORKER_ROLE to measure, repeat to compare (default: all, html and api)')
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts per role, the median is reported')
+        parser.add_argument('--top', type=int, default=20, help='Modules to list by import time')
+
+    def handle(self, *args, **options):
+        roles = options['role'] or ['all', 'html', 'api']
+        summaries = {}
+        for role in roles:
+            runs = [self.cold_start(role) for _ in range(options['runs'])]
+            summaries[role] = {
+                key: statistics.median(run[0][key] for run in runs)
+                for key in ('wsgi_import', 'urlconf', 'templates')
+            }
+            # module detail from the median run is noisy, the last run is as good as any
+            imports = runs[-1][1]
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\nWORKER_ROLE={role}: slowest modules (self time)'))
+            for name, self_us, cumulative_us in sorted(imports, key=lambda row: -row[1])[:options['top']]:
+                self.stdout.write(f'  {self_us / 1000:8.1f} ms  {cumulative_us / 1000:8.1f} ms cumulative  {name}')
+
+            packages = defaultdict(int)
+            for name, self_us, cumulative_us in imports:
+                packages[name.split('.')[0]] += self_us
+            self.stdout.write(self.style.MIGRATE_HEADING(f'WORKER_ROLE={role}: import time by top-level package'))
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:10]:
+                self.stdout.write(f'  {self_us / 1000:8.1f} ms  {package}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nCold start (median ms)'))
+        self.stdout.write(f"  {'role':<6} {'wsgi import':>12} {'urlconf':>9} {'templates':>10} {'total':>9}")
+        for role, timings in summaries.items():
+            total = sum(timings.values())
+            self.stdout.write(
+                f"  {role:<6} {timings['wsgi_import'] * 1000:>12.1f} {timings['urlconf'] * 1000:>9.1f} "
+                f"{timings['templates'] * 1000:>10.1f} {total * 1000:>9.1f}"
+            )
+
+    def cold_start(self, role):
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'skilltracker.settings'),
+            WORKER_ROLE=role,
+            WARMUP_ON_START='False',
+        )
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Cold start failed for WORKER_ROLE={role}:\n{result.stderr[-2000:]}')
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        return timings, self.parse_importtime(result.stderr)
+
+    def parse_importtime(self, output):
+        """Parse `python -X importtime` lines into (module, self us, cumulative us)"""
+        imports = []
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            imports.append((name.strip(), int(self_us), int(cumulative_us)))
+        return imports
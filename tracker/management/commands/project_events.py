@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.projections import PROJECTIONS, BATCH_SIZE, get_projection, run
+
+
+class Command(BaseCommand):
+    help = 'Apply new activity events to projections, from their stored checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', metavar='projection',
+                            help=f'Projections to update (default all: {", ".join(sorted(PROJECTIONS))})')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            projections = [get_projection(name) for name in options['names'] or sorted(PROJECTIONS)]
+        except KeyError as exc:
+            raise CommandError(exc.args[0])
+        for projection in projections:
+            applied = run(projection, options['batch_size'])
+            self.stdout.write(f'{projection.name}: applied {applied} events')
+        self.stdout.write(self.style.SUCCESS('Projections are up to date'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from tracker.sync import TOMBSTONE_RETENTION, prune_tombstones
+
+
+class Command(BaseCommand):
+    help = 'Delete sync tombstones older than the sync token lifetime (run daily)'
+
+    def handle(self, *args, **options):
+        pruned = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(
+            f'Pruned {pruned} sync tombstones older than {TOMBSTONE_RETENTION.days} days'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from tracker.search import install_index, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Create the full-text index if missing and re-index every note, goal and resource'
+
+    def handle(self, *args, **options):
+        install_index(DEFAULT_DB_ALIAS)
+        indexed = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} documents'))
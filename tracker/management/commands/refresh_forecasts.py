@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tracker.forecasts import refresh_all
+
+
+class Command(BaseCommand):
+    help = 'Recompute the completion forecast of every pending goal (run nightly)'
+
+    def handle(self, *args, **options):
+        refreshed = refresh_all()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} goal forecasts'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tracker.recommendations import refresh_all, refresh_recent, TOP_N
+
+
+class Command(BaseCommand):
+    help = 'Rebuild skill similarities and per-user skill recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recent', type=int, metavar='DAYS',
+                            help='Only refresh users active in the last DAYS days, using stored similarities')
+        parser.add_argument('--top', type=int, default=TOP_N, help=f'Recommendations to keep (default {TOP_N})')
+
+    def handle(self, *args, **options):
+        if options['recent']:
+            saved = refresh_recent(options['recent'], options['top'])
+            self.stdout.write(self.style.SUCCESS(f'Refreshed {saved} recommendations for recently active users'))
+        else:
+            similar, recommended = refresh_all(options['top'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Stored {similar} skill similarities and {recommended} user recommendations'
+            ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.events import seed_missing
+from tracker.projections import PROJECTIONS, BATCH_SIZE, CHUNK_SIZE, WORKERS, get_projection, replay
+
+
+class Command(BaseCommand):
+    help = 'Rebuild projections from the whole activity log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', metavar='projection',
+                            help=f'Projections to rebuild (default all: {", ".join(sorted(PROJECTIONS))})')
+        parser.add_argument('--workers', type=int, default=WORKERS)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Users per chunk')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--seed-missing', action='store_true',
+                            help='First log a create event for rows that predate the activity log')
+
+    def handle(self, *args, **options):
+        try:
+            projections = [get_projection(name) for name in options['names'] or sorted(PROJECTIONS)]
+        except KeyError as exc:
+            raise CommandError(exc.args[0])
+        if options['seed_missing']:
+            self.stdout.write(f'Seeded {seed_missing(options["batch_size"])} create events')
+        for projection in projections:
+            applied = replay(projection, options['workers'], options['chunk_size'], options['batch_size'])
+            self.stdout.write(f'{projection.name}: replayed {applied} events')
+        self.stdout.write(self.style.SUCCESS('Projections rebuilt'))
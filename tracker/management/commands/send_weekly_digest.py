@@ -0,0 +1,29 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from tracker.digest import send_weekly_digests
+
+
+class Command(BaseCommand):
+    help = 'Email the weekly progress digest to every opted-in user, safe to rerun after a crash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--week', type=date.fromisoformat,
+                            help='Any day of the week to report on (default: last week)')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Render processes (default: one per CPU, 0 renders inline)')
+        parser.add_argument('--dry-run', action='store_true', help='Build and render, but send nothing')
+
+    def handle(self, *args, **options):
+        week = options['week'] or date.today() - timedelta(days=7)
+        sent = send_weekly_digests(
+            week,
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            stdout=self.stdout,
+        )
+        verb = 'Rendered' if options['dry_run'] else 'Sent'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {sent} weekly digests'))
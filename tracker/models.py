@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
 from django.urls import reverse
 from django.utils import timezone
@@ -42,10 +43,15 @@ class ProgressEntry(models.Model):
     description = models.TextField()
     hours_spent = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-date']  # show newest first
         unique_together = ['user', 'skill', 'date']  # one entry per user/skill/date
+        indexes = [
+            models.Index(fields=['-date']),  # admin lists the whole table by date
+            models.Index(fields=['user', 'updated_at']),  # delta sync
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.skill.name} ({self.date})"
@@ -59,14 +65,26 @@ class Goal(models.Model):
     completed = models.BooleanField(default=False)
     completed_date = models.DateField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['deadline', '-created_at']  # order by deadline first
+        indexes = [
+            models.Index(fields=['deadline', '-created_at']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
     
     def __str__(self):
         # show status with checkmark or circle
         status = "✓" if self.completed else "○"
         return f"{status} {self.title} ({self.skill.name})"
+    
+    @property
+    def days_remaining(self):
+        """Days until the deadline, negative once overdue, None when completed"""
+        if self.completed:
+            return None
+        return (self.deadline - timezone.now().date()).days
 
 class LearningResource(models.Model):
     # different types of learning resources
@@ -87,13 +105,95 @@ class LearningResource(models.Model):
     notes = models.TextField(blank=True)
     is_completed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.skill.name})"
 
+class DeletedRecord(models.Model):
+    """Tombstone left behind when a synced object is deleted"""
+    MODEL_NAMES = [
+        ('progress', 'Progress Entry'),
+        ('goal', 'Goal'),
+        ('resource', 'Learning Resource'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    model_name = models.CharField(max_length=20, choices=MODEL_NAMES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['deleted_at']
+        indexes = [models.Index(fields=['user', 'deleted_at'])]
+    
+    def __str__(self):
+        return f"{self.model_name} #{self.object_id} deleted ({self.user_id})"
+
+class LinkStatus(models.Model):
+    """Last check result for a resource URL, shared by everyone who saved it"""
+    url = models.URLField(unique=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    is_ok = models.BooleanField(default=False)
+    final_url = models.URLField(max_length=2000, blank=True)  # after redirects
+    title = models.CharField(max_length=300, blank=True)
+    etag = models.CharField(max_length=200, blank=True)
+    last_modified = models.CharField(max_length=100, blank=True)
+    error = models.CharField(max_length=200, blank=True)
+    checked_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name_plural = 'link statuses'
+    
+    def __str__(self):
+        return f"{self.url} ({self.status_code or self.error or 'unchecked'})"
+
+class DigestDelivery(models.Model):
+    """Marks a weekly digest as sent, so an interrupted run can resume"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    week_start = models.DateField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['user', 'week_start']
+    
+    def __str__(self):
+        return f"{self.user_id} - week of {self.week_start}"
+
+class SkillSimilarity(models.Model):
+    """Precomputed "people who practiced X also practiced Y" scores"""
+    skill = models.ForeignKey(Skill, on_delete=models.CASCADE, related_name='similarities')
+    similar_skill = models.ForeignKey(Skill, on_delete=models.CASCADE, related_name='similar_to')
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ['skill', '-score']
+        unique_together = ['skill', 'similar_skill']
+    
+    def __str__(self):
+        return f"{self.skill.name} -> {self.similar_skill.name} ({self.score:.2f})"
+
+class SkillRecommendation(models.Model):
+    """Precomputed skills a user hasn't practiced yet, best first"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    skill = models.ForeignKey(Skill, on_delete=models.CASCADE)
+    score = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['user', '-score']
+        unique_together = ['user', 'skill']
+    
+    def __str__(self):
+        return f"{self.user.username} -> {self.skill.name} ({self.score:.2f})"
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('goal_deadline', 'Goal Deadline Approaching'),
@@ -148,3 +248,196 @@ class Achievement(models.Model):
     @property
     def is_earned(self):
         return self.current_value >= self.required_value
+
+class ProgressSummary(models.Model):
+    """Monthly per user/skill totals of progress entries that were archived"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    skill = models.ForeignKey(Skill, on_delete=models.CASCADE)
+    month = models.DateField()  # first day of the month
+    hours_spent = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+    sessions = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-month']
+        unique_together = ['user', 'skill', 'month']
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.skill.name} ({self.month:%Y-%m})"
+
+class ProgressEntryArchive(models.Model):
+    """Raw progress entries moved out of ProgressEntry, keeps the original id"""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    skill = models.ForeignKey(Skill, on_delete=models.CASCADE, db_constraint=False)
+    date = models.DateField()
+    description = models.TextField()
+    hours_spent = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-date']
+        indexes = [models.Index(fields=['user', 'date'])]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.skill_id} ({self.date})"
+
+class ActivityEvent(models.Model):
+    """Append-only log of changes to progress entries, goals and resources"""
+    ACTIONS = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+        ('toggle', 'Toggle'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    model_name = models.CharField(max_length=20, choices=DeletedRecord.MODEL_NAMES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    before = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    after = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)  # backfilled events keep the row's date
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['user', 'id']),  # replay reads one chunk of users in order
+            models.Index(fields=['model_name', 'object_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.action} {self.model_name} #{self.object_id} ({self.user_id})"
+
+class ProjectionCheckpoint(models.Model):
+    """Last activity event a projection has applied"""
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_event_id}"
+
+class DailyActivity(models.Model):
+    """Hours and sessions per user per day, projected from the activity log"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    date = models.DateField()
+    hours_spent = models.DecimalField(max_digits=7, decimal_places=2, default=0)
+    sessions = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-date']
+        unique_together = ['user', 'date']
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.date}: {self.hours_spent}h"
+
+class ActivityTotals(models.Model):
+    """Running per-user counters, projected from the activity log"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True)
+    hours_spent = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+    sessions = models.IntegerField(default=0)
+    goals = models.IntegerField(default=0)
+    goals_completed = models.IntegerField(default=0)
+    resources = models.IntegerField(default=0)
+    resources_completed = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = 'activity totals'
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.hours_spent}h, {self.goals_completed}/{self.goals} goals"
+
+class SkillLearner(models.Model):
+    """Per skill/learner totals behind SkillCounters, including archived entries"""
+    skill = models.ForeignKey(Skill, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    sessions = models.IntegerField(default=0)
+    hours_spent = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+    last_date = models.DateField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ['skill', 'user']
+    
+    def __str__(self):
+        return f"{self.skill_id} - {self.user_id}: {self.sessions} sessions"
+
+class SkillCounters(models.Model):
+    """Catalog popularity of a skill, see tracker.popularity"""
+    skill = models.OneToOneField(Skill, on_delete=models.CASCADE, primary_key=True, related_name='counters')
+    learners = models.IntegerField(default=0)
+    total_hours = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    active_learners = models.IntegerField(default=0)  # practiced in the last 30 days
+    refreshed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'skill counters'
+        indexes = [models.Index(fields=['-learners', '-total_hours'])]  # ?sort=popular
+    
+    def __str__(self):
+        return f"{self.skill_id}: {self.learners} learners, {self.total_hours}h"
+
+class RequestProfile(models.Model):
+    """A profiled request, see skilltracker.profiling"""
+    TRIGGERS = [
+        ('header', 'X-Profile header'),
+        ('query', '?_profile flag'),
+        ('sample', 'Sampled'),
+    ]
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    trigger = models.CharField(max_length=10, choices=TRIGGERS)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    status_code = models.IntegerField()
+    duration_ms = models.FloatField()
+    sql_count = models.IntegerField()
+    sql_ms = models.FloatField()
+    top_queries = models.JSONField(default=list)  # slowest statements in total, with counts
+    samples = models.IntegerField()
+    stacks = models.TextField()  # folded stacks, one "a;b;c count" line each
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+class SearchDocument(models.Model):
+    """Searchable text of a progress entry, goal or resource, see tracker.search"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    model_name = models.CharField(max_length=20, choices=DeletedRecord.MODEL_NAMES)
+    object_id = models.BigIntegerField()
+    title = models.CharField(max_length=300)
+    body = models.TextField(blank=True)
+    updated_at = models.DateTimeField()
+    
+    class Meta:
+        unique_together = ['model_name', 'object_id']
+        indexes = [models.Index(fields=['user'])]
+    
+    def __str__(self):
+        return f"{self.model_name} #{self.object_id}: {self.title}"
+
+class GoalForecast(models.Model):
+    """Where a pending goal ends up at its owner's recent pace, see tracker.forecasts"""
+    STATUSES = [
+        ('on_track', 'On track'),
+        ('at_risk', 'At risk'),
+        ('overdue', 'Overdue'),
+    ]
+    
+    goal = models.OneToOneField(Goal, on_delete=models.CASCADE, primary_key=True, related_name='forecast')
+    status = models.CharField(max_length=10, choices=STATUSES)
+    target_hours = models.DecimalField(max_digits=9, decimal_places=2)
+    hours_so_far = models.DecimalField(max_digits=9, decimal_places=2)
+    hours_per_day = models.DecimalField(max_digits=7, decimal_places=2)  # over the last few weeks
+    required_hours_per_day = models.DecimalField(max_digits=7, decimal_places=2)
+    projected_hours = models.DecimalField(max_digits=9, decimal_places=2)  # by the deadline
+    projected_completion = models.DateField(null=True, blank=True)  # None without recent practice
+    refreshed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.goal_id}: {self.status}, {self.projected_hours}/{self.target_hours}h"
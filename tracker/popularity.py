@@ -0,0 +1,175 @@
+"""
+Per-skill popularity counters for the catalog.
+
+SkillCounters holds the number of learners, total hours (live and
+archived) and learners active in the last 30 days of every skill, so
+the catalog can show and sort by them without aggregating ProgressEntry
+per page. They are rolled up from SkillLearner, one row per skill and
+learner, and kept current:
+
+- incrementally by the skill_counters projection over the activity log
+  (`manage.py project_events`), which applies the deltas of each batch
+  of events to both tables;
+- from scratch by `manage.py replay_projection skill_counters`, run
+  nightly. That is also when learners age out of the 30 day window;
+  between two runs the active counts only go up.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from .models import Skill, ProgressEntry, ProgressSummary, SkillLearner, SkillCounters
+
+ACTIVE_DAYS = 30
+USER_CHUNK = 1000
+COUNTER_FIELDS = ['learners', 'total_hours', 'active_learners']
+# ?sort=popular on the catalog, skills never counted go last
+POPULAR_ORDERING = [
+    F('counters__learners').desc(nulls_last=True),
+    F('counters__total_hours').desc(nulls_last=True),
+    'name',
+]
+
+
+def active_cutoff():
+    return timezone.now().date() - timedelta(days=ACTIVE_DAYS)
+
+
+def _learner_rows(user_ids):
+    rows = {}
+    live = (
+        ProgressEntry.objects.filter(user_id__in=user_ids).values('skill_id', 'user_id')
+        .annotate(sessions=Count('id'), hours=Sum('hours_spent'), last_date=Max('date')).order_by()
+    )
+    for row in live:
+        rows[row['skill_id'], row['user_id']] = SkillLearner(
+            skill_id=row['skill_id'], user_id=row['user_id'], sessions=row['sessions'],
+            hours_spent=row['hours'], last_date=row['last_date'],
+        )
+    archived = (
+        ProgressSummary.objects.filter(user_id__in=user_ids).values('skill_id', 'user_id')
+        .annotate(sessions=Sum('sessions'), hours=Sum('hours_spent')).order_by()
+    )
+    for row in archived:
+        learner = rows.setdefault(
+            (row['skill_id'], row['user_id']),
+            SkillLearner(skill_id=row['skill_id'], user_id=row['user_id'], sessions=0, hours_spent=0),
+        )
+        learner.sessions += row['sessions']
+        learner.hours_spent += row['hours']
+    return rows.values()
+
+
+def refresh_counters(skill_ids=None):
+    """Recompute SkillCounters from SkillLearner, for `skill_ids` or every skill"""
+    learners = SkillLearner.objects.filter(sessions__gt=0)
+    skills = Skill.objects.all()
+    if skill_ids is not None:
+        learners = learners.filter(skill_id__in=skill_ids)
+        skills = skills.filter(pk__in=skill_ids)
+    totals = {
+        row['skill_id']: row for row in
+        learners.values('skill_id').annotate(
+            learners=Count('id'),
+            total_hours=Sum('hours_spent'),
+            active_learners=Count('id', filter=Q(last_date__gte=active_cutoff())),
+        ).order_by()
+    }
+    now = timezone.now()
+    counters = []
+    for skill_id in skills.values_list('id', flat=True).iterator():
+        row = totals.get(skill_id, {})
+        counters.append(SkillCounters(
+            skill_id=skill_id, refreshed_at=now,
+            **{field: row.get(field) or 0 for field in COUNTER_FIELDS},
+        ))
+    SkillCounters.objects.bulk_create(
+        counters, batch_size=1000, update_conflicts=True,
+        unique_fields=['skill'], update_fields=COUNTER_FIELDS + ['refreshed_at'],
+    )
+    return len(counters)
+
+
+def rebuild():
+    """Rebuild SkillLearner from the progress tables, then every counter"""
+    user_ids = sorted(
+        set(ProgressEntry.objects.values_list('user_id', flat=True).distinct().order_by())
+        | set(ProgressSummary.objects.values_list('user_id', flat=True).distinct().order_by())
+    )
+    with transaction.atomic():
+        SkillLearner.objects.all().delete()
+        for start in range(0, len(user_ids), USER_CHUNK):
+            SkillLearner.objects.bulk_create(_learner_rows(user_ids[start:start + USER_CHUNK]), batch_size=1000)
+        return refresh_counters()
+
+
+def apply_events(events):
+    """Fold a batch of progress entry events into SkillLearner and SkillCounters"""
+    deltas = defaultdict(lambda: {'sessions': 0, 'hours_spent': Decimal(0), 'last_date': None})
+    for event in events:
+        if event.model_name != 'progress':
+            continue
+        for values, sign in ((event.before, -1), (event.after, 1)):
+            if not values:
+                continue
+            delta = deltas[values['skill_id'], event.user_id]
+            delta['sessions'] += sign
+            delta['hours_spent'] += sign * Decimal(values['hours_spent'])
+            if sign > 0:
+                day = date.fromisoformat(values['date'])
+                delta['last_date'] = max(delta['last_date'] or day, day)
+    # skills deleted since are gone from the counters already
+    skill_ids = set(Skill.objects.filter(pk__in={skill_id for skill_id, _ in deltas}).values_list('id', flat=True))
+    deltas = {key: delta for key, delta in deltas.items() if key[0] in skill_ids}
+    if not deltas:
+        return
+
+    existing = {
+        (learner.skill_id, learner.user_id): learner
+        for learner in SkillLearner.objects.filter(
+            skill_id__in=skill_ids, user_id__in={user_id for _, user_id in deltas}
+        )
+        if (learner.skill_id, learner.user_id) in deltas
+    }
+    cutoff = active_cutoff()
+    counter_deltas = defaultdict(lambda: defaultdict(int))
+    created, updated = [], []
+    for (skill_id, user_id), delta in deltas.items():
+        learner = existing.get((skill_id, user_id))
+        if learner is None:
+            learner = SkillLearner(skill_id=skill_id, user_id=user_id, sessions=0, hours_spent=0)
+            created.append(learner)
+        else:
+            updated.append(learner)
+        was_learner = learner.sessions > 0
+        was_active = was_learner and learner.last_date is not None and learner.last_date >= cutoff
+
+        learner.sessions += delta['sessions']
+        learner.hours_spent += delta['hours_spent']
+        if delta['last_date'] and (learner.last_date is None or delta['last_date'] > learner.last_date):
+            learner.last_date = delta['last_date']
+        is_learner = learner.sessions > 0
+        is_active = is_learner and learner.last_date is not None and learner.last_date >= cutoff
+
+        counters = counter_deltas[skill_id]
+        counters['learners'] += is_learner - was_learner
+        counters['active_learners'] += is_active - was_active
+        counters['total_hours'] += delta['hours_spent']
+
+    SkillLearner.objects.bulk_create(created)
+    SkillLearner.objects.bulk_update(updated, ['sessions', 'hours_spent', 'last_date'])
+
+    for skill_id, values in counter_deltas.items():
+        values = {field: delta for field, delta in values.items() if delta}
+        if not values:
+            continue
+        updated_rows = SkillCounters.objects.filter(skill_id=skill_id).update(
+            **{field: F(field) + delta for field, delta in values.items()}
+        )
+        if not updated_rows:
+            # first activity since the last rebuild, count it from scratch
+            refresh_counters([skill_id])
@@ -0,0 +1,248 @@
+"""
+Projections over the activity log.
+
+A projection is derived state built only from ActivityEvent rows. run()
+applies the events after its stored checkpoint, replay() throws the
+state away and rebuilds it from the whole log, with users split into
+chunks that are processed in parallel. New aggregates are added by
+registering another Projection and replaying it; the write path does
+not change.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import connection, close_old_connections, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import ActivityEvent, ProjectionCheckpoint, DailyActivity, ActivityTotals
+from . import popularity
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 500  # users per replay chunk
+WORKERS = 4
+# ids are handed out before commit, so a fresh event can still become
+# visible after a higher one; leave recent events for the next run
+LAG = timedelta(seconds=30)
+
+PROJECTIONS = {}
+
+
+def register(cls):
+    PROJECTIONS[cls.name] = cls()
+    return cls
+
+
+class Projection:
+    name = None
+    # False when the state isn't per user and reset() rebuilds it from the
+    # source tables instead, replay() then skips the events
+    replayable = True
+
+    def reset(self, user_ids=None):
+        """Delete the derived state, for `user_ids` only if given"""
+        raise NotImplementedError
+
+    def apply(self, events):
+        """Fold a batch of events, in id order, into the derived state"""
+        raise NotImplementedError
+
+
+def _add(model, key, deltas):
+    """Add `deltas` to the row matching `key`, creating it if needed"""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = model.objects.filter(**key).update(**{field: F(field) + delta for field, delta in deltas.items()})
+    if not updated:
+        model.objects.create(**key, **deltas)
+
+
+@register
+class DailyActivityProjection(Projection):
+    """Hours and sessions per user per day, the input for streaks and charts"""
+    name = 'daily_activity'
+
+    def reset(self, user_ids=None):
+        rows = DailyActivity.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows.delete()
+
+    def apply(self, events):
+        deltas = defaultdict(lambda: {'hours_spent': Decimal(0), 'sessions': 0})
+        for event in events:
+            if event.model_name != 'progress':
+                continue
+            for values, sign in ((event.before, -1), (event.after, 1)):
+                if values:
+                    key = (event.user_id, date.fromisoformat(values['date']))
+                    deltas[key]['hours_spent'] += sign * Decimal(values['hours_spent'])
+                    deltas[key]['sessions'] += sign
+
+        for (user_id, day), values in deltas.items():
+            _add(DailyActivity, {'user_id': user_id, 'date': day}, values)
+        user_ids = {user_id for user_id, _ in deltas}
+        DailyActivity.objects.filter(user_id__in=user_ids, sessions=0).delete()
+
+
+@register
+class ActivityTotalsProjection(Projection):
+    """Lifetime hours, sessions, goals and resources per user"""
+    name = 'activity_totals'
+
+    def reset(self, user_ids=None):
+        rows = ActivityTotals.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows.delete()
+
+    def apply(self, events):
+        deltas = defaultdict(lambda: defaultdict(int))
+        for event in events:
+            user_deltas = deltas[event.user_id]
+            for values, sign in ((event.before, -1), (event.after, 1)):
+                if not values:
+                    continue
+                if event.model_name == 'progress':
+                    user_deltas['hours_spent'] += sign * Decimal(values['hours_spent'])
+                    user_deltas['sessions'] += sign
+                elif event.model_name == 'goal':
+                    user_deltas['goals'] += sign
+                    user_deltas['goals_completed'] += sign * values['completed']
+                elif event.model_name == 'resource':
+                    user_deltas['resources'] += sign
+                    user_deltas['resources_completed'] += sign * values['is_completed']
+
+        for user_id, values in deltas.items():
+            _add(ActivityTotals, {'user_id': user_id}, values)
+
+
+@register
+class SkillCountersProjection(Projection):
+    """Learners, hours and active learners per skill, see tracker.popularity"""
+    name = 'skill_counters'
+    replayable = False
+
+    def reset(self, user_ids=None):
+        popularity.rebuild()
+
+    def apply(self, events):
+        popularity.apply_events(events)
+
+
+def get_projection(name):
+    try:
+        return PROJECTIONS[name]
+    except KeyError:
+        raise KeyError(f'Unknown projection "{name}", choose from {", ".join(sorted(PROJECTIONS))}')
+
+
+def _high_water():
+    cutoff = timezone.now() - LAG
+    return ActivityEvent.objects.filter(created_at__lt=cutoff).aggregate(last=Max('id'))['last'] or 0
+
+
+def _lock_checkpoint(name):
+    ProjectionCheckpoint.objects.get_or_create(name=name)
+    return ProjectionCheckpoint.objects.select_for_update().get(name=name)
+
+
+def _in_batches(events, batch_size):
+    batch = []
+    for event in events.iterator(chunk_size=batch_size):
+        batch.append(event)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(projection, batch_size=BATCH_SIZE):
+    """
+    Apply the events after the projection's checkpoint. Each batch and
+    its checkpoint move commit together, so an interrupted run resumes
+    where it stopped. Returns the number of events applied.
+    """
+    high_water = _high_water()
+    applied = 0
+    while True:
+        with transaction.atomic():
+            checkpoint = _lock_checkpoint(projection.name)
+            events = list(
+                ActivityEvent.objects.filter(id__gt=checkpoint.last_event_id, id__lte=high_water)
+                .order_by('id')[:batch_size]
+            )
+            if not events:
+                return applied
+            projection.apply(events)
+            checkpoint.last_event_id = events[-1].id
+            checkpoint.save(update_fields=['last_event_id', 'updated_at'])
+        applied += len(events)
+
+
+def _replay_chunk(projection, user_ids, high_water, batch_size):
+    events = ActivityEvent.objects.filter(user_id__in=user_ids, id__lte=high_water).order_by('id')
+    applied = 0
+    with transaction.atomic():
+        projection.reset(user_ids)
+        for batch in _in_batches(events, batch_size):
+            projection.apply(batch)
+            applied += len(batch)
+    return applied
+
+
+def _in_thread(func, *args):
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        # the pool's threads each opened their own connection
+        connection.close()
+
+
+def replay(projection, workers=WORKERS, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE):
+    """
+    Rebuild a projection from the whole log. Users are split into chunks
+    of `chunk_size`, each chunk resets and replays its own users in one
+    transaction on a worker thread. The checkpoint row stays locked
+    meanwhile, so run() waits instead of applying events twice. SQLite
+    allows a single writer, so there the chunks run one after another.
+    Projections that are not replayable are rebuilt by reset() alone.
+    Returns the number of events applied.
+    """
+    high_water = _high_water()
+    if connection.vendor == 'sqlite':
+        workers = 1
+
+    with transaction.atomic():
+        checkpoint = _lock_checkpoint(projection.name)
+        user_ids = list(
+            ActivityEvent.objects.filter(id__lte=high_water)
+            .values_list('user_id', flat=True).distinct().order_by('user_id')
+        )
+        chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+
+        if not projection.replayable:
+            # reset() reads the tables as they are now, lag or not
+            high_water = ActivityEvent.objects.aggregate(last=Max('id'))['last'] or 0
+            projection.reset()
+            applied = 0
+        elif workers <= 1:
+            projection.reset()
+            applied = sum(_replay_chunk(projection, chunk, high_water, batch_size) for chunk in chunks)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='replay') as executor:
+                # state of users without events goes too, before any chunk writes
+                executor.submit(_in_thread, projection.reset).result()
+                applied = sum(executor.map(
+                    lambda chunk: _in_thread(_replay_chunk, projection, chunk, high_water, batch_size),
+                    chunks,
+                ))
+
+        checkpoint.last_event_id = high_water
+        checkpoint.save(update_fields=['last_event_id', 'updated_at'])
+    return applied
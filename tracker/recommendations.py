@@ -0,0 +1,152 @@
+"""
+Offline skill recommendations.
+
+Builds a sparse user x skill matrix of log-scaled practice hours (live
+and archived), computes item-item cosine similarity and stores the top
+N similar skills per skill and the top N unpracticed skills per user.
+Views only ever read the stored tables; NumPy/SciPy are needed by the
+batch job alone.
+"""
+from datetime import timedelta
+
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ProgressEntry, ProgressSummary, SkillSimilarity, SkillRecommendation
+
+TOP_N = 10
+
+
+def _hours_rows(user_ids=None):
+    live = ProgressEntry.objects.values('user_id', 'skill_id').annotate(hours=Sum('hours_spent'))
+    archived = ProgressSummary.objects.values('user_id', 'skill_id').annotate(hours=Sum('hours_spent'))
+    if user_ids is not None:
+        live = live.filter(user_id__in=user_ids)
+        archived = archived.filter(user_id__in=user_ids)
+    for queryset in (live, archived):
+        for row in queryset.values_list('user_id', 'skill_id', 'hours').order_by():
+            yield row
+
+
+def build_matrix(user_ids=None, skill_index=None):
+    """
+    Return (matrix, user ids, skill ids). Rows are users, columns skills,
+    values log1p(hours). Pass `skill_index` to reuse an existing column order.
+    """
+    users, skills, values = [], [], []
+    for user_id, skill_id, hours in _hours_rows(user_ids):
+        users.append(user_id)
+        skills.append(skill_id)
+        values.append(float(hours))
+
+    user_ids_sorted = sorted(set(users))
+    user_index = {user_id: i for i, user_id in enumerate(user_ids_sorted)}
+    if skill_index is None:
+        skill_index = {skill_id: i for i, skill_id in enumerate(sorted(set(skills)))}
+    keep = [i for i, skill_id in enumerate(skills) if skill_id in skill_index]
+
+    matrix = sparse.coo_matrix(
+        (
+            np.array([values[i] for i in keep], dtype=np.float64),
+            ([user_index[users[i]] for i in keep], [skill_index[skills[i]] for i in keep]),
+        ),
+        shape=(len(user_ids_sorted), len(skill_index)),
+    ).tocsr()  # duplicates (live + archived) are summed here
+    # on the summed hours: log1p(a) + log1p(b) is not log1p(a + b)
+    matrix.data = np.log1p(matrix.data)
+    skill_ids = sorted(skill_index, key=skill_index.get)
+    return matrix, user_ids_sorted, skill_ids
+
+
+def item_similarity(matrix):
+    """Cosine similarity between skill columns, zero diagonal, sparse"""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+    norms[norms == 0] = 1.0
+    normalized = matrix @ sparse.diags(1.0 / norms)
+    similarity = (normalized.T @ normalized).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+    return similarity
+
+
+def _top_n(scores, n, exclude=None):
+    if exclude is not None and len(exclude):
+        scores = scores.copy()
+        scores[exclude] = 0
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-scores[candidates], n)[:n]]
+    return sorted(candidates, key=lambda i: -scores[i])
+
+
+def save_similarities(similarity, skill_ids, top_n=TOP_N):
+    rows = []
+    for i, skill_id in enumerate(skill_ids):
+        scores = similarity.getrow(i).toarray().ravel()
+        for j in _top_n(scores, top_n):
+            rows.append(SkillSimilarity(skill_id=skill_id, similar_skill_id=skill_ids[j], score=float(scores[j])))
+    with transaction.atomic():
+        SkillSimilarity.objects.all().delete()
+        SkillSimilarity.objects.bulk_create(rows, batch_size=2000)
+    return len(rows)
+
+
+def load_similarities():
+    """Rebuild the sparse similarity matrix from the stored top-N table"""
+    rows = list(SkillSimilarity.objects.values_list('skill_id', 'similar_skill_id', 'score'))
+    skill_ids = sorted({row[0] for row in rows} | {row[1] for row in rows})
+    skill_index = {skill_id: i for i, skill_id in enumerate(skill_ids)}
+    similarity = sparse.coo_matrix(
+        (
+            [row[2] for row in rows],
+            ([skill_index[row[0]] for row in rows], [skill_index[row[1]] for row in rows]),
+        ),
+        shape=(len(skill_ids), len(skill_ids)),
+    ).tocsr()
+    return similarity, skill_index
+
+
+def save_user_recommendations(matrix, user_ids, skill_ids, similarity, top_n=TOP_N, chunk_size=1000):
+    """Score = the user's hours vector times the similarity matrix"""
+    saved = 0
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = matrix[start:start + chunk_size]
+        scores = (chunk @ similarity).toarray()
+        rows = []
+        for offset in range(chunk.shape[0]):
+            practiced = chunk.getrow(offset).indices
+            user_id = user_ids[start + offset]
+            for j in _top_n(scores[offset], top_n, exclude=practiced):
+                rows.append(SkillRecommendation(user_id=user_id, skill_id=skill_ids[j], score=float(scores[offset, j])))
+        with transaction.atomic():
+            SkillRecommendation.objects.filter(user_id__in=user_ids[start:start + chunk_size]).delete()
+            SkillRecommendation.objects.bulk_create(rows, batch_size=2000)
+        saved += len(rows)
+    return saved
+
+
+def refresh_all(top_n=TOP_N):
+    """Full rebuild: similarities from every user, then every user's list"""
+    matrix, user_ids, skill_ids = build_matrix()
+    if not skill_ids:
+        return 0, 0
+    similarity = item_similarity(matrix)
+    similar = save_similarities(similarity, skill_ids, top_n)
+    recommended = save_user_recommendations(matrix, user_ids, skill_ids, similarity, top_n)
+    return similar, recommended
+
+
+def refresh_recent(days=1, top_n=TOP_N):
+    """Recompute only recently active users against the stored similarities"""
+    since = timezone.now() - timedelta(days=days)
+    user_ids = list(
+        ProgressEntry.objects.filter(updated_at__gte=since).values_list('user_id', flat=True).distinct()
+    )
+    similarity, skill_index = load_similarities()
+    if not user_ids or not skill_index:
+        return 0
+    matrix, user_ids, skill_ids = build_matrix(user_ids, skill_index)
+    return save_user_recommendations(matrix, user_ids, skill_ids, similarity, top_n)
@@ -0,0 +1,21 @@
+import msgpack
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+# kept free of DRF imports so html-only workers don't load it
+_encoder = DjangoJSONEncoder()
+
+
+def negotiated_response(request, data, status=200):
+    """JsonResponse for plain django views, MessagePack if the client asks for it"""
+    if MSGPACK_CONTENT_TYPE in request.headers.get('Accept', ''):
+        body = msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+        response = HttpResponse(body, content_type=MSGPACK_CONTENT_TYPE, status=status)
+    else:
+        response = JsonResponse(data, status=status)
+    # the same url answers in either format, caches must keep them apart
+    patch_vary_headers(response, ('Accept',))
+    return response
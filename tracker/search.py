@@ -0,0 +1,270 @@
+"""
+Full-text search over a user's own progress notes, goals and resources.
+
+The searchable text of every row is copied into SearchDocument (title
+plus body), kept current by signals on save and delete, and for progress
+entries, whose title is the skill's name, on skill renames. The index on
+top of it depends on the database and is created after migrate by
+install_index():
+
+- PostgreSQL: a generated tsvector column, title weighted above body,
+  with a GIN index. Queries use websearch_to_tsquery and ts_rank_cd.
+- SQLite: an FTS5 table kept in step by triggers, with the owner as an
+  indexed column so a user's matches are found without touching anyone
+  else's. Queries are ranked with bm25.
+
+Results come best first with a snippet of the matching text, <mark>ed,
+and are paged by keyset: the cursor holds the score and id of the last
+result, so a page costs the same however deep it is.
+"""
+import re
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.db import NotSupportedError, connections, router
+from django.utils.dateparse import parse_datetime
+from django.utils.html import escape
+
+from .models import ProgressEntry, Goal, LearningResource, SearchDocument
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+CURSOR_SALT = 'tracker.search'
+BATCH_SIZE = 1000
+FTS_TABLE = 'tracker_searchdocument_fts'
+# snippet delimiters, replaced by <mark> once the text is escaped
+START, STOP = '\x02', '\x03'
+_TERMS = re.compile(r'\w+')
+
+INDEXED_MODELS = {
+    ProgressEntry: 'progress',
+    Goal: 'goal',
+    LearningResource: 'resource',
+}
+TEXT_FIELDS = {
+    ProgressEntry: {'description', 'skill', 'skill_id'},
+    Goal: {'title', 'description'},
+    LearningResource: {'title', 'notes'},
+}
+
+
+class InvalidSearchCursor(Exception):
+    pass
+
+
+def document_for(instance):
+    """The unsaved SearchDocument of a progress entry, goal or resource"""
+    if isinstance(instance, ProgressEntry):
+        # notes have no title, the skill stands in for it
+        title, body = instance.skill.name, instance.description
+    elif isinstance(instance, Goal):
+        title, body = instance.title, instance.description
+    else:
+        title, body = instance.title, instance.notes
+    return SearchDocument(
+        user_id=instance.user_id, model_name=INDEXED_MODELS[type(instance)], object_id=instance.pk,
+        title=title[:300], body=body, updated_at=instance.updated_at,
+    )
+
+
+def index(instances):
+    """Add or refresh the documents of `instances`, one upsert per batch"""
+    SearchDocument.objects.bulk_create(
+        [document_for(instance) for instance in instances], batch_size=BATCH_SIZE,
+        update_conflicts=True, unique_fields=['model_name', 'object_id'],
+        update_fields=['title', 'body', 'updated_at'],
+    )
+
+
+def retitle_skill(skill):
+    """Progress entries are indexed under their skill's name, follow a rename"""
+    return SearchDocument.objects.filter(
+        model_name=INDEXED_MODELS[ProgressEntry],
+        object_id__in=ProgressEntry.objects.filter(skill=skill).values('pk'),
+    ).update(title=skill.name[:300])
+
+
+def unindex(model, object_ids):
+    SearchDocument.objects.filter(model_name=INDEXED_MODELS[model], object_id__in=object_ids).delete()
+
+
+def rebuild():
+    """Index every row again and drop documents whose row is gone"""
+    indexed = 0
+    for model, model_name in INDEXED_MODELS.items():
+        rows = model.objects.order_by('pk')
+        if model is ProgressEntry:
+            rows = rows.select_related('skill')
+        batch = []
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                index(batch)
+                indexed += len(batch)
+                batch = []
+        index(batch)
+        indexed += len(batch)
+        SearchDocument.objects.filter(model_name=model_name).exclude(
+            object_id__in=model.objects.values('pk')
+        ).delete()
+    return indexed
+
+
+# index DDL, run after migrate
+
+POSTGRES_DDL = [
+    """
+    ALTER TABLE tracker_searchdocument ADD COLUMN IF NOT EXISTS vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX IF NOT EXISTS tracker_searchdocument_vector ON tracker_searchdocument USING gin (vector)',
+]
+
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(owner, title, body, tokenize = 'porter unicode61')",
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON tracker_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, owner, title, body) VALUES (new.id, 'u' || new.user_id, new.title, new.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE ON tracker_searchdocument BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE} (rowid, owner, title, body) VALUES (new.id, 'u' || new.user_id, new.title, new.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON tracker_searchdocument BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    # documents written before the index existed
+    f"""
+    INSERT INTO {FTS_TABLE} (rowid, owner, title, body)
+    SELECT id, 'u' || user_id, title, body FROM tracker_searchdocument
+    """,
+]
+
+
+def install_index(using='default'):
+    """Create the full-text index on `using` if it is missing"""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for statement in POSTGRES_DDL:
+                cursor.execute(statement)
+        elif connection.vendor == 'sqlite':
+            if FTS_TABLE not in connection.introspection.table_names(cursor):
+                for statement in SQLITE_DDL:
+                    cursor.execute(statement)
+
+
+# queries
+
+def make_cursor(score, doc_id):
+    return signing.dumps([score, doc_id], salt=CURSOR_SALT)
+
+
+def read_cursor(cursor):
+    try:
+        score, doc_id = signing.loads(cursor, salt=CURSOR_SALT)
+        return float(score), int(doc_id)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidSearchCursor('Invalid search cursor')
+
+
+def _postgres_sql(user_id, query, after, limit):
+    # rank and page first, so only the returned rows get a headline
+    rank = 'ts_rank_cd(d.vector, q.query)'
+    keyset = f'AND ({rank} < %s::real OR ({rank} = %s::real AND d.id < %s))'
+    sql = f"""
+        SELECT id, model_name, object_id, title, updated_at, score,
+               ts_headline('english', CASE WHEN body = '' THEN title ELSE body END, query, %s)
+        FROM (
+            SELECT d.id, d.model_name, d.object_id, d.title, d.body, d.updated_at, q.query, {rank} AS score
+            FROM tracker_searchdocument d, websearch_to_tsquery('english', %s) AS q(query)
+            WHERE d.user_id = %s AND d.vector @@ q.query {keyset if after else ''}
+            ORDER BY score DESC, d.id DESC
+            LIMIT %s
+        ) AS page
+        ORDER BY score DESC, id DESC
+    """
+    options = f'StartSel={START}, StopSel={STOP}, MaxFragments=2, MinWords=5, MaxWords=20'
+    params = [options, query, user_id]
+    if after:
+        params += [after[0], after[0], after[1]]
+    return sql, params + [limit]
+
+
+def _sqlite_sql(user_id, query, after, limit):
+    terms = _TERMS.findall(query)
+    if not terms:
+        return None, None
+    # quoted terms, so nothing the user types is read as FTS5 syntax
+    match = f'owner : "u{user_id}" AND {{title body}} : (' + ' AND '.join(f'"{term}"' for term in terms) + ')'
+    # bm25 is lower for better matches, negated it sorts like ts_rank_cd
+    rank = f'-bm25({FTS_TABLE}, 0, 10, 1)'
+    keyset = f'AND ({rank} < %s OR ({rank} = %s AND d.id < %s))'
+    # from the body, or the title when there is none; left to pick (-1)
+    # snippet() would take the owner column, which always matches
+    sql = f"""
+        SELECT d.id, d.model_name, d.object_id, d.title, d.updated_at, {rank} AS score,
+               CASE WHEN d.body = '' THEN snippet({FTS_TABLE}, 1, %s, %s, '…', 16)
+                    ELSE snippet({FTS_TABLE}, 2, %s, %s, '…', 16) END
+        FROM {FTS_TABLE} JOIN tracker_searchdocument d ON d.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s {keyset if after else ''}
+        ORDER BY score DESC, d.id DESC
+        LIMIT %s
+    """
+    params = [START, STOP, START, STOP, match]
+    if after:
+        params += [after[0], after[0], after[1]]
+    return sql, params + [limit]
+
+
+def _datetime(value):
+    # raw queries on SQLite return the stored text
+    if isinstance(value, str):
+        value = parse_datetime(value)
+        if settings.USE_TZ and value.tzinfo is None:
+            value = value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def _highlight(snippet):
+    return escape(snippet or '').replace(START, '<mark>').replace(STOP, '</mark>')
+
+
+def search(user, query, cursor=None, limit=PAGE_SIZE):
+    """
+    The user's documents matching `query`, best first, as
+    {'results': [...], 'next': cursor or None}.
+    """
+    after = read_cursor(cursor) if cursor else None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    connection = connections[router.db_for_read(SearchDocument)]
+    if connection.vendor == 'postgresql':
+        sql, params = _postgres_sql(user.pk, query, after, limit + 1)
+    elif connection.vendor == 'sqlite':
+        sql, params = _sqlite_sql(user.pk, query, after, limit + 1)
+    else:
+        raise NotSupportedError('Full-text search needs PostgreSQL or SQLite')
+    if sql is None or not query.strip():
+        return {'results': [], 'next': None}
+
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+    more, rows = len(rows) > limit, rows[:limit]
+    results = [
+        {
+            'type': model_name, 'id': object_id, 'title': title, 'snippet': _highlight(snippet),
+            'score': score, 'updated_at': _datetime(updated_at),
+        }
+        for _, model_name, object_id, title, updated_at, score, snippet in rows
+    ]
+    next_cursor = make_cursor(rows[-1][5], rows[-1][0]) if more else None
+    return {'results': results, 'next': next_cursor}
@@ -1,32 +1,161 @@
 from rest_framework import serializers
+from django.core.exceptions import FieldDoesNotExist
 from .models import Skill, ProgressEntry, Goal, LearningResource
 
-class SkillSerializer(serializers.ModelSerializer):
+
+def _is_reverse_one_to_one(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return field.one_to_one and not field.concrete
+
+
+def _is_column(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return field.concrete and not field.many_to_many
+
+
+class SparseFieldsMixin:
+    """
+    Serializer that can be trimmed to a subset of its fields and can swap
+    related ids for nested objects. The viewsets pass these in from the
+    ?fields= and ?expand= query parameters; unknown field names are a
+    ValidationError.
+    """
+    # field name -> serializer class used when the client asks to expand it
+    expandable_fields = {}
+    # properties of the model -> the columns they read
+    computed_fields = {}
+    
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None) or ()
+        super().__init__(*args, **kwargs)
+        
+        if fields:
+            unknown = [name for name in fields if name not in self.fields]
+            if unknown:
+                raise serializers.ValidationError({'fields': [f'Unknown field: {name}' for name in unknown]})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in expand:
+            if name in self.expandable_fields and name in self.fields:
+                self.fields[name] = self.expandable_fields[name](read_only=True)
+    
+    def narrow_queryset(self, queryset):
+        """
+        `queryset` selecting only the columns behind these fields and
+        joining only the related rows they read. Annotations are left to
+        the query; a field reading anything else off the instance that
+        computed_fields doesn't map to columns keeps the whole row.
+        """
+        model = queryset.model
+        columns = {model._meta.pk.name}
+        related = set()
+        expanded = set()
+        
+        for field in self.fields.values():
+            if field.source == '*':
+                return queryset
+            parts = field.source.split('.')
+            if len(parts) == 1 and parts[0] in queryset.query.annotations:
+                continue
+            if len(parts) == 1 and parts[0] in self.computed_fields:
+                columns.update(self.computed_fields[parts[0]])
+                continue
+            if len(parts) == 2 and _is_reverse_one_to_one(model, parts[0]):
+                # e.g. counters.learners, a row joined from the other side
+                related.add(parts[0])
+                columns.add('__'.join(parts))
+                continue
+            if len(parts) > 2 or not _is_column(model, parts[0]):
+                # something we can't map to columns, load the whole row
+                return queryset
+            columns.add(parts[0])
+            if len(parts) == 2:
+                related.add(parts[0])
+                columns.add('__'.join(parts))
+            elif isinstance(field, serializers.BaseSerializer):
+                # expanded relation, the nested serializer needs the whole row
+                expanded.add(parts[0])
+                related_model = model._meta.get_field(parts[0]).related_model
+                for nested in field.fields.values():
+                    nested_parts = nested.source.split('.')
+                    if len(nested_parts) == 2 and _is_reverse_one_to_one(related_model, nested_parts[0]):
+                        related.add(f'{parts[0]}__{nested_parts[0]}')
+        
+        related |= expanded
+        columns = {
+            column for column in columns
+            if column.split('__')[0] not in expanded or '__' not in column
+        }
+        # only join what the fields need, whatever the queryset asked for
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns)
+
+class SkillSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # precomputed popularity, null until the counters first include the skill
+    learners = serializers.IntegerField(source='counters.learners', read_only=True)
+    total_hours = serializers.DecimalField(source='counters.total_hours', max_digits=12, decimal_places=2, read_only=True)
+    active_learners = serializers.IntegerField(source='counters.active_learners', read_only=True)
+    
     class Meta:
         model = Skill
-        fields = ['id', 'name', 'category', 'difficulty', 'description', 'created_at']
+        fields = ['id', 'name', 'category', 'difficulty', 'description', 'created_at',
+                  'learners', 'total_hours', 'active_learners']
         read_only_fields = ['id', 'created_at']
 
-class ProgressEntrySerializer(serializers.ModelSerializer):
+class ScoredSkillSerializer(SkillSerializer):
+    score = serializers.FloatField(read_only=True)
+    
+    class Meta(SkillSerializer.Meta):
+        fields = SkillSerializer.Meta.fields + ['score']
+
+class ProgressEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     skill_name = serializers.CharField(source='skill.name', read_only=True)
+    expandable_fields = {'skill': SkillSerializer}
     
     class Meta:
         model = ProgressEntry
-        fields = ['id', 'skill', 'skill_name', 'date', 'description', 'hours_spent', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'skill', 'skill_name', 'date', 'description', 'hours_spent', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
 
-class GoalSerializer(serializers.ModelSerializer):
+class GoalSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     skill_name = serializers.CharField(source='skill.name', read_only=True)
+    # annotated by tracker.goals.with_progress, left out when the instance lacks them
+    hours_so_far = serializers.DecimalField(max_digits=9, decimal_places=2, read_only=True)
+    sessions_so_far = serializers.IntegerField(read_only=True)
+    days_remaining = serializers.IntegerField(read_only=True)
+    # stored by tracker.forecasts, null for completed goals and until the first refresh
+    forecast_status = serializers.CharField(source='forecast.status', read_only=True)
+    target_hours = serializers.DecimalField(source='forecast.target_hours', max_digits=9, decimal_places=2, read_only=True)
+    projected_hours = serializers.DecimalField(source='forecast.projected_hours', max_digits=9, decimal_places=2, read_only=True)
+    hours_per_day = serializers.DecimalField(source='forecast.hours_per_day', max_digits=7, decimal_places=2, read_only=True)
+    required_hours_per_day = serializers.DecimalField(
+        source='forecast.required_hours_per_day', max_digits=7, decimal_places=2, read_only=True,
+    )
+    projected_completion = serializers.DateField(source='forecast.projected_completion', read_only=True)
+    expandable_fields = {'skill': SkillSerializer}
+    computed_fields = {'days_remaining': ['completed', 'deadline']}
     
     class Meta:
         model = Goal
-        fields = ['id', 'skill', 'skill_name', 'title', 'description', 'deadline', 'completed', 'completed_date', 'created_at']
-        read_only_fields = ['id', 'created_at', 'completed_date']
+        fields = ['id', 'skill', 'skill_name', 'title', 'description', 'deadline', 'completed', 'completed_date', 'created_at', 'updated_at',
+                  'hours_so_far', 'sessions_so_far', 'days_remaining', 'forecast_status', 'target_hours', 'projected_hours',
+                  'hours_per_day', 'required_hours_per_day', 'projected_completion']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'completed_date']
 
-class LearningResourceSerializer(serializers.ModelSerializer):
+class LearningResourceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     skill_name = serializers.CharField(source='skill.name', read_only=True)
+    expandable_fields = {'skill': SkillSerializer}
     
     class Meta:
         model = LearningResource
-        fields = ['id', 'skill', 'skill_name', 'title', 'url', 'resource_type', 'notes', 'is_completed', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'skill', 'skill_name', 'title', 'url', 'resource_type', 'notes', 'is_completed', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
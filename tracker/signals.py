@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.apps import apps
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.db import router
+from django.dispatch import receiver
+
+from .models import Skill, ProgressEntry, Goal, LearningResource, DeletedRecord, SearchDocument
+from .duplicates import invalidate_index
+from . import events, forecasts, search
+from skilltracker.cache import tiered_cache
+
+SYNC_MODEL_NAMES = {
+    ProgressEntry: 'progress',
+    Goal: 'goal',
+    LearningResource: 'resource',
+}
+
+_tombstones_enabled = ContextVar('tombstones_enabled', default=True)
+_deleting_account = ContextVar('deleting_account', default=False)
+
+
+@contextmanager
+def without_tombstones():
+    """
+    Delete rows without telling sync clients or the activity log, e.g.
+    when archiving them: the work still happened, it only moved tables.
+    """
+    token = _tombstones_enabled.set(False)
+    try:
+        yield
+    finally:
+        _tombstones_enabled.reset(token)
+
+
+@contextmanager
+def deleting_account():
+    """
+    Delete rows of an account that is going away (accounts.deletion):
+    no tombstones or events, and the owner's search documents and
+    forecasts aren't touched row by row, their tables get batches of
+    their own.
+    """
+    token = _deleting_account.set(True)
+    try:
+        yield
+    finally:
+        _deleting_account.reset(token)
+
+
+def _deleting_user(origin):
+    # the whole account is going away, nobody is left to sync the tombstone
+    if _deleting_account.get():
+        return True
+    user_model = apps.get_model(settings.AUTH_USER_MODEL)
+    return isinstance(origin, user_model) or getattr(origin, 'model', None) is user_model
+
+
+@receiver(post_delete, sender=ProgressEntry)
+@receiver(post_delete, sender=Goal)
+@receiver(post_delete, sender=LearningResource)
+def record_deletion(sender, instance, origin=None, **kwargs):
+    """Leave a tombstone so sync clients learn about the delete"""
+    if not _tombstones_enabled.get() or _deleting_user(origin):
+        return
+    DeletedRecord.objects.create(
+        user_id=instance.user_id,
+        model_name=SYNC_MODEL_NAMES[sender],
+        object_id=instance.pk,
+    )
+
+
+@receiver(pre_save, sender=ProgressEntry)
+@receiver(pre_save, sender=Goal)
+@receiver(pre_save, sender=LearningResource)
+def remember_stored_row(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._activity_before = events.stored_snapshot(instance)
+
+
+@receiver(post_save, sender=ProgressEntry)
+@receiver(post_save, sender=Goal)
+@receiver(post_save, sender=LearningResource)
+def log_save(sender, instance, created, raw=False, **kwargs):
+    """Append a create, update or toggle event to the activity log"""
+    if raw:
+        return
+    before = getattr(instance, '_activity_before', None)
+    after = events.snapshot(instance)
+    if created or before is None:
+        action = 'create'
+    else:
+        action = events.update_action(before, after)
+        if action is None:
+            return
+    instance._activity_before = after
+    events.record(SYNC_MODEL_NAMES[sender], instance, action, before, after)
+
+
+@receiver(post_delete, sender=ProgressEntry)
+@receiver(post_delete, sender=Goal)
+@receiver(post_delete, sender=LearningResource)
+def log_delete(sender, instance, origin=None, **kwargs):
+    if not _tombstones_enabled.get() or _deleting_user(origin):
+        return
+    events.record(SYNC_MODEL_NAMES[sender], instance, 'delete', events.snapshot(instance), None)
+
+
+@receiver(post_save, sender=Skill)
+@receiver(post_delete, sender=Skill)
+def refresh_skill_names(sender, **kwargs):
+    """New or renamed skills must be visible to the duplicate detector"""
+    invalidate_index()
+
+
+@receiver(post_save, sender=ProgressEntry)
+@receiver(post_delete, sender=ProgressEntry)
+@receiver(post_save, sender=Goal)
+@receiver(post_delete, sender=Goal)
+@receiver(post_save, sender=LearningResource)
+@receiver(post_delete, sender=LearningResource)
+def expire_user_aggregates(sender, instance, using=None, **kwargs):
+    """Cached dashboard and profile numbers of the owner are out of date"""
+    tiered_cache.bump_on_commit(f'user:{instance.user_id}', using=using)
+
+
+@receiver(post_save, sender=ProgressEntry)
+@receiver(post_delete, sender=ProgressEntry)
+@receiver(post_save, sender=Goal)
+@receiver(post_delete, sender=Goal)
+def refresh_goal_forecasts(sender, instance, raw=False, origin=None, **kwargs):
+    """Progress and goals change the owner's forecasts, all of them: they share the daily hours"""
+    if raw or _deleting_user(origin):
+        return
+    forecasts.refresh_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def refresh_forecasts_for_daily_goal(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # logins only save last_login, new users have no goals
+    if raw or created or (update_fields is not None and 'daily_goal_hours' not in update_fields):
+        return
+    forecasts.refresh_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=ProgressEntry)
+@receiver(post_save, sender=Goal)
+@receiver(post_save, sender=LearningResource)
+def index_for_search(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the owner's search results in step with the text"""
+    if raw:
+        return
+    if update_fields is not None and not search.TEXT_FIELDS[sender] & set(update_fields):
+        return
+    search.index([instance])
+
+
+@receiver(pre_save, sender=Skill)
+def remember_skill_name(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding or instance.pk is None:
+        instance._stored_name = None
+    else:
+        instance._stored_name = Skill._base_manager.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Skill)
+def retitle_search_documents(sender, instance, created, raw=False, **kwargs):
+    """Progress entries are found under their skill's name, it changed"""
+    stored = getattr(instance, '_stored_name', None)
+    if not raw and not created and stored is not None and stored != instance.name:
+        search.retitle_skill(instance)
+
+
+@receiver(post_delete, sender=ProgressEntry)
+@receiver(post_delete, sender=Goal)
+@receiver(post_delete, sender=LearningResource)
+def unindex_for_search(sender, instance, origin=None, **kwargs):
+    # the user's documents cascade with the user
+    if not _deleting_user(origin):
+        search.unindex(sender, [instance.pk])
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using='default', **kwargs):
+    """The full-text index is database specific, so it isn't part of the models"""
+    if sender.label == 'tracker' and router.allow_migrate_model(using, SearchDocument):
+        search.install_index(using)
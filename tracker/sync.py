@@ -0,0 +1,88 @@
+"""
+Delta sync for API clients.
+
+A sync token is a signed timestamp. Changes are everything whose
+updated_at is at or after the token (minus a small overlap for writes
+that were still committing when the token was issued) plus the
+tombstones left by deletes in the same window.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core import signing
+from django.utils import timezone
+
+from .models import ProgressEntry, Goal, LearningResource, DeletedRecord
+from .goals import with_progress
+from .serializers import ProgressEntrySerializer, GoalSerializer, LearningResourceSerializer
+
+TOKEN_SALT = 'tracker.sync'
+
+# re-send anything written this close to the token, clients upsert by id
+OVERLAP = timedelta(seconds=5)
+
+# tombstones older than this are pruned (manage.py prune_tombstones), older
+# tokens get a full sync
+TOMBSTONE_RETENTION = timedelta(days=90)
+
+# response key -> (model, serializer, tombstone model_name)
+SYNCED_MODELS = {
+    'progress': (ProgressEntry, ProgressEntrySerializer, 'progress'),
+    'goals': (Goal, GoalSerializer, 'goal'),
+    'resources': (LearningResource, LearningResourceSerializer, 'resource'),
+}
+
+
+class InvalidSyncToken(Exception):
+    pass
+
+
+def make_token(when):
+    return signing.dumps(int(when.timestamp() * 1_000_000), salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token):
+    try:
+        micros = signing.loads(token, salt=TOKEN_SALT)
+        return datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+    except (signing.BadSignature, TypeError, ValueError, OverflowError):
+        raise InvalidSyncToken('Invalid sync token')
+
+
+def changes_since(user, token=None):
+    """Return everything that changed for `user` since `token` plus a new token"""
+    # take the new token before reading so nothing falls between two syncs
+    now = timezone.now()
+    since = read_token(token) - OVERLAP if token else None
+    if since is not None and since < now - TOMBSTONE_RETENTION:
+        since = None
+
+    data = {'token': make_token(now), 'full': since is None}
+    deleted = {}
+    for key, (model, serializer_class, model_name) in SYNCED_MODELS.items():
+        queryset = model.objects.filter(user=user).order_by('pk')
+        if model is Goal:
+            queryset = with_progress(queryset)
+        # skill_name is left out, clients already have the skill catalog
+        fields = [name for name in serializer_class.Meta.fields if name != 'skill_name']
+        if since is not None:
+            queryset = queryset.filter(updated_at__gte=since)
+        # only the columns behind the fields, annotations and joins as the serializer needs them
+        queryset = serializer_class(fields=fields).narrow_queryset(queryset)
+        data[key] = serializer_class(queryset, many=True, fields=fields).data
+
+        if since is not None:
+            deleted[key] = list(
+                DeletedRecord.objects.filter(user=user, model_name=model_name, deleted_at__gte=since)
+                .values_list('object_id', flat=True)
+            )
+        else:
+            deleted[key] = []
+    data['deleted'] = deleted
+    return data
+
+
+def prune_tombstones():
+    """Delete tombstones no client can still ask for"""
+    cutoff = timezone.now() - TOMBSTONE_RETENTION
+    deleted, _ = DeletedRecord.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
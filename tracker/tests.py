@@ -1 +1,618 @@
-from django.test import TestCase
+import asyncio
+import ipaddress
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import msgpack
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+
+from .archive import archive_user_progress, partition_archive_by_year
+from . import downsampling
+from .digest import send_weekly_digests
+from .duplicates import merge_skills
+from .events import seed_missing
+from .linkcheck import check_urls
+from .recommendations import build_matrix
+from .renderers import MessagePackParser, MessagePackRenderer
+from .sync import TOMBSTONE_RETENTION, make_token
+from .models import (
+    Skill, ProgressEntry, ProgressSummary, Goal, LearningResource, ActivityEvent, ActivityTotals,
+    DigestDelivery, DeletedRecord,
+    GoalForecast, SearchDocument, SkillCounters,
+)
+from .paginators import EstimatedCountPaginator
+from .projections import get_projection, replay, run
+from . import forecasts, popularity
+
+
+class TrackerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('learner', password='pw')
+        cls.skill = Skill.objects.create(name='Python', category='backend', difficulty='easy')
+        cls.today = timezone.now().date()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def add_goal(self, **kwargs):
+        kwargs.setdefault('deadline', self.today + timedelta(days=30))
+        kwargs.setdefault('title', 'Finish the tutorial')
+        return Goal.objects.create(user=self.user, skill=self.skill, **kwargs)
+
+
+class SparseFieldsTests(TrackerTestCase):
+    def goal_list_sql(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, next(query['sql'] for query in queries if query['sql'].startswith('SELECT "tracker_goal"."id"'))
+
+    def test_default_fields_select_only_their_columns(self):
+        self.add_goal()
+        response, sql = self.goal_list_sql('/api/goals/')
+        # annotations, the property and the forecast don't stop the narrowing
+        self.assertTrue(sql.startswith('SELECT "tracker_goal"."id", "tracker_goal"."skill_id", "tracker_goal"."title"'))
+        self.assertIn('"tracker_goalforecast"."status"', sql)
+        goal = response.json()['results'][0]
+        self.assertEqual(goal['days_remaining'], 30)
+        self.assertEqual(goal['hours_so_far'], '0.00')
+
+    def test_requested_fields(self):
+        self.add_goal()
+        response, sql = self.goal_list_sql('/api/goals/?fields=id,days_remaining')
+        self.assertNotIn('"tracker_goal"."title"', sql)
+        self.assertNotIn('tracker_skill', sql)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'days_remaining'})
+
+    def test_progress_fields(self):
+        ProgressEntry.objects.create(user=self.user, skill=self.skill, date=self.today, hours_spent=Decimal('1.5'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/progress/?fields=date,hours_spent')
+        self.assertEqual(response.json()['results'], [{'date': str(self.today), 'hours_spent': '1.50'}])
+        sql = next(query['sql'] for query in queries if 'FROM "tracker_progressentry"' in query['sql'] and 'COUNT' not in query['sql'])
+        self.assertNotIn('"tracker_progressentry"."description"', sql)
+        self.assertNotIn('tracker_skill', sql)
+
+        response = self.client.get('/api/progress/?fields=skill_name&expand=skill')
+        self.assertEqual(response.json()['results'], [{'skill_name': 'Python'}])
+
+    def test_unknown_fields_are_rejected(self):
+        ProgressEntry.objects.create(user=self.user, skill=self.skill, date=self.today, hours_spent=Decimal('1.5'))
+        entry = ProgressEntry.objects.get()
+        for url in ('/api/progress/?fields=colour', '/api/progress/?fields=date,colour,size', f'/api/progress/{entry.pk}/?fields=colour'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('Unknown field: colour', response.json()['fields'])
+        # writes ignore ?fields=
+        response = self.client.patch(
+            f'/api/progress/{entry.pk}/?fields=colour', {'hours_spent': '2'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class SyncTests(TrackerTestCase):
+    def test_full_sync_includes_goals(self):
+        goal = self.add_goal()
+        ProgressEntry.objects.create(user=self.user, skill=self.skill, date=self.today, hours_spent=Decimal('1.5'))
+        response = self.client.get('/api/sync/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['full'])
+        self.assertEqual([synced['id'] for synced in data['goals']], [goal.pk])
+        self.assertEqual(data['goals'][0]['hours_so_far'], '1.50')
+        self.assertEqual(data['goals'][0]['days_remaining'], 30)
+        self.assertEqual(len(data['progress']), 1)
+        self.assertNotIn('skill_name', data['goals'][0])
+
+    def test_delta_sync(self):
+        kept = self.add_goal()
+        deleted = self.add_goal()
+        deleted_id = deleted.pk
+        token = self.client.get('/api/sync/').json()['token']
+        Goal.objects.filter(pk=kept.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+        deleted.delete()
+        added = self.add_goal()
+        data = self.client.get('/api/sync/', {'since': token}).json()
+        self.assertFalse(data['full'])
+        self.assertEqual([synced['id'] for synced in data['goals']], [added.pk])
+        self.assertEqual(data['deleted']['goals'], [deleted_id])
+
+    def test_expired_token_gets_full_sync(self):
+        goal = self.add_goal()
+        token = make_token(timezone.now() - TOMBSTONE_RETENTION - timedelta(days=1))
+        data = self.client.get('/api/sync/', {'since': token}).json()
+        self.assertTrue(data['full'])
+        self.assertEqual([synced['id'] for synced in data['goals']], [goal.pk])
+
+    def test_prune_tombstones(self):
+        expired, recent = self.add_goal(), self.add_goal()
+        expired_id, recent_id = expired.pk, recent.pk
+        expired.delete()
+        recent.delete()
+        DeletedRecord.objects.filter(object_id=expired_id).update(
+            deleted_at=timezone.now() - TOMBSTONE_RETENTION - timedelta(days=1)
+        )
+        call_command('prune_tombstones', stdout=StringIO())
+        self.assertEqual(list(DeletedRecord.objects.values_list('object_id', flat=True)), [recent_id])
+
+    def test_invalid_token(self):
+        response = self.client.get('/api/sync/', {'since': 'forged'})
+        self.assertEqual(response.status_code, 400)
+
+
+class GoalForecastTests(TrackerTestCase):
+    def test_forecast_fields_are_joined(self):
+        # one query for the goals whatever their number, with or without forecasts
+        self.client.get('/api/goals/')
+        for url in ('/api/goals/', '/api/goals/?fields=id,forecast_status', '/api/sync/', '/goals/'):
+            self.add_goal()
+            with CaptureQueriesContext(connection) as few:
+                self.client.get(url)
+            for _ in range(3):
+                self.add_goal()
+            forecasts.refresh_users([self.user.pk])
+            Goal.objects.filter(pk=Goal.objects.latest('pk').pk).update(completed=True)
+            with CaptureQueriesContext(connection) as many:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(few), len(many), url)
+
+    def test_forecast_after_progress(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            goal = self.add_goal()
+            ProgressEntry.objects.create(user=self.user, skill=self.skill, date=self.today, hours_spent=Decimal('2'))
+        goal = self.client.get(f'/api/goals/{goal.pk}/').json()
+        # one hour a day for 31 days, two hours today
+        self.assertEqual(goal['target_hours'], '31.00')
+        self.assertEqual(goal['hours_per_day'], '2.00')
+        self.assertEqual(goal['forecast_status'], 'on_track')
+
+
+class MessagePackTests(TrackerTestCase):
+    def test_round_trip(self):
+        data = {'id': 1, 'hours': Decimal('1.50'), 'date': date(2024, 2, 29), 'tags': ['a', 'b'], 'note': None}
+        body = MessagePackRenderer().render(data)
+        parsed = MessagePackParser().parse(BytesIO(body))
+        # the same values JSONRenderer would have produced
+        self.assertEqual(parsed, {'id': 1, 'hours': 1.5, 'date': '2024-02-29', 'tags': ['a', 'b'], 'note': None})
+        self.assertEqual(MessagePackRenderer().render(None), b'')
+
+    def test_bad_body(self):
+        with self.assertRaises(ParseError):
+            MessagePackParser().parse(BytesIO(b'\xc1'))
+
+    def test_api_in_msgpack(self):
+        body = msgpack.packb({'skill': self.skill.pk, 'date': str(self.today), 'hours_spent': '2.5', 'description': 'sets'})
+        response = self.client.post(
+            '/api/progress/', body, content_type='application/msgpack', HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        created = msgpack.unpackb(response.content)
+        self.assertEqual((created['skill'], created['hours_spent']), (self.skill.pk, '2.50'))
+        self.assertIn('Accept', response['Vary'])
+
+    def test_chart_varies_on_accept(self):
+        ProgressEntry.objects.create(user=self.user, skill=self.skill, date=self.today, hours_spent=Decimal('1'))
+        as_json = self.client.get('/api/progress-chart/')
+        as_msgpack = self.client.get('/api/progress-chart/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(as_msgpack.content), as_json.json())
+        for response in (as_json, as_msgpack):
+            self.assertIn('Accept', response['Vary'])
+
+
+class DownsamplingTests(SimpleTestCase):
+    # a year of uneven days with one spike
+    values = [float((day * 37) % 11) for day in range(365)]
+    values[200] = 50.0
+    dates = [str(date(2024, 1, 1) + timedelta(days=day)) for day in range(365)]
+
+    def test_ranges_are_contiguous(self):
+        for start, stop, count in ((0, 365, 7), (1, 364, 98), (0, 5, 5), (0, 3, 10)):
+            ranges = downsampling._ranges(start, stop, count)
+            self.assertLessEqual(len(ranges), count)
+            self.assertEqual(ranges[0][0], start)
+            self.assertEqual(ranges[-1][1], stop)
+            self.assertTrue(all(a[1] == b[0] for a, b in zip(ranges, ranges[1:])))
+
+    def test_lttb(self):
+        for max_points in (3, 10, 100, 364):
+            kept, ranges = downsampling.lttb(self.values, max_points)
+            self.assertLessEqual(len(kept), max_points)
+            self.assertEqual((kept[0], kept[-1]), (0, 364))
+            self.assertEqual(kept, sorted(set(kept)))
+            # one point per bucket, from that bucket
+            self.assertEqual(len(kept), len(ranges))
+            self.assertTrue(all(start <= index < stop for index, (start, stop) in zip(kept, ranges)))
+        self.assertIn(200, downsampling.lttb(self.values, 50)[0])
+
+    def test_minmax(self):
+        for max_points in (2, 11, 100):
+            kept, ranges = downsampling.minmax(self.values, max_points)
+            self.assertLessEqual(len(kept), max_points)
+            for start, stop in ranges:
+                chunk = self.values[start:stop]
+                in_bucket = [self.values[index] for index in kept if start <= index < stop]
+                self.assertIn(min(chunk), in_bucket)
+                self.assertIn(max(chunk), in_bucket)
+
+    def test_short_series_are_kept_whole(self):
+        self.assertEqual(downsampling.lttb([1.0, 2.0], 10)[0], [0, 1])
+        self.assertEqual(downsampling.minmax([1.0, 2.0], 10)[0], [0, 1])
+
+    def test_bucket_columns(self):
+        for method in downsampling.METHODS:
+            kept_dates, kept_values, buckets = downsampling.downsample(self.dates, self.values, 40, method)
+            self.assertEqual(sum(buckets['days']), 365)
+            self.assertAlmostEqual(sum(buckets['total_hours']), sum(self.values))
+            self.assertEqual(buckets['start'][0], self.dates[0])
+            self.assertEqual(max(buckets['max_hours']), 50.0)
+            self.assertEqual(len(kept_dates), len(kept_values))
+            self.assertEqual(set(buckets), {'start', 'days', 'active_days', 'total_hours', 'min_hours', 'max_hours'})
+
+
+class ChartDownsamplingTests(TrackerTestCase):
+    def test_downsampled_chart(self):
+        for days_ago in range(0, 90, 3):
+            ProgressEntry.objects.create(
+                user=self.user, skill=self.skill, date=self.today - timedelta(days=days_ago), hours_spent=Decimal('1'),
+            )
+        data = self.client.get('/api/progress-chart/', {'days': 90, 'max_points': 20, 'method': 'minmax'}).json()
+        self.assertLessEqual(len(data['daily_progress']), 20)
+        self.assertEqual(sum(data['buckets']['days']), 91)
+        self.assertEqual(sum(data['buckets']['active_days']), 30)
+        self.assertEqual(data['downsampling'], {'method': 'minmax', 'source_points': 91, 'max_points': 20})
+
+    def test_bad_parameters(self):
+        for params in ({'max_points': 'many'}, {'max_points': 2}, {'max_points': 20, 'method': 'average'}):
+            response = self.client.get('/api/progress-chart/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('max_points', response.json()['error'])
+
+
+class SearchTests(TrackerTestCase):
+    def search(self, q, **params):
+        response = self.client.get('/api/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_snippet_shows_the_match(self):
+        self.add_goal(description='Write decorators that cache their results')
+        LearningResource.objects.create(
+            user=self.user, skill=self.skill, title='Decorators in depth', url='https://example.com/', resource_type='article',
+        )
+        results = self.search('decorators')['results']
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIn('<mark>decorators</mark>', result['snippet'].lower())
+            self.assertNotIn(f'u{self.user.pk}', result['snippet'])
+
+    def test_only_own_documents(self):
+        other = get_user_model().objects.create_user('other', password='pw')
+        Goal.objects.create(user=other, skill=self.skill, title='Decorators', deadline=self.today)
+        self.assertEqual(self.search('decorators')['results'], [])
+
+    def test_title_matches_rank_first(self):
+        in_body = self.add_goal(title='Advanced topics', description='closures and generators')
+        in_title = self.add_goal(title='Generators', description='yield from')
+        self.assertEqual([result['id'] for result in self.search('generators')['results']], [in_title.pk, in_body.pk])
+
+    def test_cursor_paging(self):
+        goals = {self.add_goal(title=f'Refactoring step {i}').pk for i in range(5)}
+        seen, page = [], self.search('refactoring', limit=2)
+        while True:
+            seen += [result['id'] for result in page['results']]
+            if not page['next']:
+                break
+            page = self.client.get(page['next']).json()
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), goals)
+        response = self.client.get('/api/search/', {'q': 'refactoring', 'cursor': 'forged'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_updates_and_deletes(self):
+        goal = self.add_goal(title='Unit testing')
+        goal.title = 'Property testing'
+        goal.save()
+        self.assertEqual([result['title'] for result in self.search('testing')['results']], ['Property testing'])
+        goal.delete()
+        self.assertEqual(self.search('testing')['results'], [])
+
+    def test_skill_rename_retitles_progress(self):
+        ProgressEntry.objects.create(
+            user=self.user, skill=self.skill, date=self.today, hours_spent=Decimal('1'), description='type hints',
+        )
+        self.skill.name = 'Python 3'
+        self.skill.save()
+        [result] = self.search('hints')['results']
+        self.assertEqual(result['title'], 'Python 3')
+
+
+class ScaleModeAdminTests(TrackerTestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def add_rows(self, count):
+        offset = Skill.objects.count()
+        for number in range(offset, offset + count):
+            user = get_user_model().objects.create_user(f'learner{number}')
+            skill = Skill.objects.create(name=f'Skill {number}', category='backend', difficulty='easy')
+            ProgressEntry.objects.bulk_create([ProgressEntry(
+                user=user, skill=skill, date=self.today, hours_spent=Decimal('1'), description='Reading',
+            )])
+            Goal.objects.bulk_create([Goal(
+                user=user, skill=skill, title='Finish', deadline=self.today + timedelta(days=30),
+            )])
+            LearningResource.objects.bulk_create([LearningResource(
+                user=user, skill=skill, title='Docs', url='https://example.com/', resource_type='article',
+            )])
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = ('/admin/tracker/progressentry/', '/admin/tracker/goal/', '/admin/tracker/learningresource/')
+        self.add_rows(2)
+        for url in urls:
+            # the first request fills the skill filter cache
+            self.changelist_queries(url)
+        before = [self.changelist_queries(url) for url in urls]
+        self.add_rows(8)
+        self.assertEqual([self.changelist_queries(url) for url in urls], before)
+
+
+class EstimatedCountPaginatorTests(TrackerTestCase):
+    def test_exact_count_on_sqlite(self):
+        self.add_goal()
+        paginator = EstimatedCountPaginator(Goal.objects.order_by('pk'), 10)
+        self.assertIsNone(paginator.estimated_count())
+        self.assertEqual(paginator.count, 1)
+        self.assertIsNone(EstimatedCountPaginator([1, 2, 3], 10).estimated_count())
+
+    def test_estimate_only_above_the_threshold(self):
+        self.add_goal()
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=9000):
+            self.assertEqual(EstimatedCountPaginator(Goal.objects.order_by('pk'), 10).count, 1)
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=25000):
+            paginator = EstimatedCountPaginator(Goal.objects.order_by('pk'), 10)
+            with self.assertNumQueries(0):
+                self.assertEqual(paginator.count, 25000)
+            self.assertEqual(paginator.num_pages, 2500)
+
+
+@mock.patch('tracker.projections.LAG', timedelta(0))
+class ActivityLogTests(TrackerTestCase):
+    def test_admin_toggles_are_logged(self):
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(admin)
+        goals = [self.add_goal(), self.add_goal()]
+        response = self.client.post('/admin/tracker/goal/', {
+            'action': 'mark_completed', '_selected_action': [goal.pk for goal in goals],
+        })
+        self.assertEqual(response.status_code, 302)
+        toggles = ActivityEvent.objects.filter(model_name='goal', action='toggle')
+        self.assertEqual(sorted(toggles.values_list('object_id', flat=True)), sorted(goal.pk for goal in goals))
+        self.assertTrue(all(event.after['completed'] for event in toggles))
+
+        projection = get_projection('activity_totals')
+        replay(projection, workers=1)
+        self.assertEqual(ActivityTotals.objects.get(user=self.user).goals_completed, 2)
+
+    def test_seeded_totals_include_archived_progress(self):
+        for days_ago in (400, 390, 1):
+            ProgressEntry.objects.create(
+                user=self.user, skill=self.skill, date=self.today - timedelta(days=days_ago), hours_spent=Decimal('2'),
+            )
+        # as if the entries predated the activity log
+        ActivityEvent.objects.all().delete()
+        archive_user_progress(self.user.pk, self.today - timedelta(days=365))
+        self.assertEqual(ProgressEntry.objects.filter(user=self.user).count(), 1)
+
+        seed_missing()
+        replay(get_projection('activity_totals'), workers=1)
+        totals = ActivityTotals.objects.get(user=self.user)
+        self.assertEqual((totals.hours_spent, totals.sessions), (Decimal('6'), 3))
+        self.assertEqual(seed_missing(), 0)
+
+
+@mock.patch('tracker.projections.LAG', timedelta(0))
+class MergeSkillsTests(TrackerTestCase):
+    def test_moved_rows_are_logged_counted_and_indexed(self):
+        duplicate = Skill.objects.create(name='python', category='backend', difficulty='easy')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProgressEntry.objects.create(user=self.user, skill=duplicate, date=self.today, hours_spent=Decimal('2'))
+            goal = Goal.objects.create(
+                user=self.user, skill=duplicate, title='Decorators', deadline=self.today + timedelta(days=10),
+            )
+        ProgressSummary.objects.create(
+            user=self.user, skill=duplicate, month=self.today.replace(day=1) - timedelta(days=400),
+            hours_spent=Decimal('5'), sessions=4,
+        )
+        popularity.rebuild()
+        run(get_projection('skill_counters'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            merge_skills(self.skill, [duplicate])
+        moves = ActivityEvent.objects.filter(action='update')
+        self.assertEqual(sorted(moves.values_list('model_name', flat=True)), ['goal', 'progress'])
+        self.assertTrue(all(event.after['skill_id'] == self.skill.pk for event in moves))
+
+        run(get_projection('skill_counters'))
+        counters = SkillCounters.objects.get(skill=self.skill)
+        self.assertEqual((counters.learners, counters.total_hours), (1, Decimal('7')))
+        self.assertEqual(SearchDocument.objects.get(model_name='progress').title, 'Python')
+        self.assertEqual(GoalForecast.objects.get(goal=goal).hours_so_far, Decimal('2'))
+
+
+class _LinkHandler(BaseHTTPRequestHandler):
+    redirects = {
+        '/moved': '/page',
+        '/metadata': 'http://169.254.169.254/latest/meta-data/',
+        '/loop': '/loop',
+    }
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.path in self.redirects:
+            self.send_response(302)
+            self.send_header('Location', self.redirects[self.path])
+            self.end_headers()
+            return
+        body = b'<html><head><title>A  page</title></head></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LinkCheckTests(SimpleTestCase):
+    # the stand-in site is on loopback, which only these tests allow
+    LOCAL = [ipaddress.ip_network('127.0.0.1/32')]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _LinkHandler)
+        cls.server.paths = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+        cls.base = f'http://127.0.0.1:{cls.server.server_port}'
+
+    def setUp(self):
+        self.server.paths.clear()
+
+    def check(self, *paths, allowed_networks=LOCAL):
+        urls = [path if '://' in path else self.base + path for path in paths]
+        return asyncio.run(check_urls(urls, allowed_networks=allowed_networks, timeout=5))
+
+    def test_redirects_are_followed(self):
+        [result] = self.check('/moved')
+        self.assertTrue(result['is_ok'])
+        self.assertEqual(result['url'], self.base + '/moved')
+        self.assertEqual(result['final_url'], self.base + '/page')
+        self.assertEqual(result['title'], 'A page')
+
+    def test_private_addresses_are_refused(self):
+        results = self.check('/page', f'http://localhost:{self.server.server_port}/', allowed_networks=())
+        self.assertTrue(all(result['error'].startswith('BlockedAddress') for result in results))
+        self.assertEqual(self.server.paths, [])
+
+    def test_every_redirect_hop_is_checked(self):
+        [result] = self.check('/metadata')
+        self.assertFalse(result['is_ok'])
+        self.assertIn('169.254.169.254', result['error'])
+        self.assertEqual(self.server.paths, ['/metadata'])
+
+    def test_connected_address_is_checked(self):
+        # as if the name had resolved to a public address a moment before
+        with mock.patch('tracker.linkcheck._check_host', mock.AsyncMock()):
+            [result] = self.check('/page', allowed_networks=())
+        self.assertIn('connected to 127.0.0.1', result['error'])
+        self.assertEqual(result['title'], '')
+
+    def test_redirect_loop(self):
+        [result] = self.check('/loop')
+        self.assertTrue(result['error'].startswith('TooManyRedirects'))
+
+    def test_other_schemes(self):
+        [result] = self.check('file:///etc/passwd')
+        self.assertTrue(result['error'].startswith('BlockedAddress'))
+
+
+class PartitionArchiveTests(TestCase):
+    def test_needs_postgresql(self):
+        with self.assertRaisesMessage(ValueError, 'needs PostgreSQL'):
+            partition_archive_by_year(2020, 2030)
+        with self.assertRaisesMessage(CommandError, '--partition needs PostgreSQL'):
+            call_command('archive_progress', partition=True, stdout=StringIO())
+
+
+class LoadTestGuardTests(TestCase):
+    def test_refuses_other_databases(self):
+        postgres = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'railway'}
+        with mock.patch.dict(connection.settings_dict, postgres):
+            with self.assertRaisesMessage(CommandError, '--allow-database=railway'):
+                call_command('loadtest')
+            # the guard passes, the missing users stop it next
+            with self.assertRaisesMessage(CommandError, 'No load test users'):
+                call_command('loadtest', allow_database='railway')
+
+    def test_sqlite(self):
+        with self.assertRaisesMessage(CommandError, 'No load test users'):
+            call_command('loadtest')
+
+
+class RecommendationMatrixTests(TrackerTestCase):
+    def test_live_and_archived_hours_are_summed_before_scaling(self):
+        ProgressEntry.objects.create(user=self.user, skill=self.skill, date=self.today, hours_spent=Decimal('2'))
+        ProgressSummary.objects.create(
+            user=self.user, skill=self.skill, month=self.today.replace(day=1) - timedelta(days=400),
+            hours_spent=Decimal('3'), sessions=2,
+        )
+        matrix, user_ids, skill_ids = build_matrix()
+        self.assertEqual((user_ids, skill_ids), ([self.user.pk], [self.skill.pk]))
+        self.assertAlmostEqual(matrix[0, 0], np.log1p(5))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class WeeklyDigestTests(TrackerTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user.email = 'learner@example.com'
+        cls.user.save()
+        for i in range(4):
+            get_user_model().objects.create_user(f'reader{i}', f'reader{i}@example.com', 'pw')
+
+    def send(self):
+        return send_weekly_digests(self.today, chunk_size=10, workers=0)
+
+    def test_reruns_skip_delivered(self):
+        self.assertEqual(self.send(), 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(self.send(), 0)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_crash_resends_nothing_already_sent(self):
+        send_messages = EmailBackend.send_messages
+        calls = []
+
+        def fail_third(backend, messages):
+            calls.append(messages)
+            if len(calls) == 3:
+                raise ConnectionError('SMTP server went away')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', fail_third), self.assertRaises(ConnectionError):
+            self.send()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(DigestDelivery.objects.count(), 2)
+
+        self.assertEqual(self.send(), 3)
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(len(recipients), len(set(recipients)))
+        self.assertEqual(len(recipients), 5)
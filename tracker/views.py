@@ -7,26 +7,26 @@ from django.utils import timezone
 from django.http import JsonResponse
 from django.core.paginator import Paginator
 from datetime import timedelta, date
-from .models import Skill, ProgressEntry, Goal, LearningResource
+from .models import Skill, ProgressEntry, Goal, LearningResource, LinkStatus
 from .forms import SkillForm, ProgressEntryForm, GoalForm, LearningResourceForm
+from .archive import lifetime_totals, archived_hours_by_skill
+from .duplicates import find_similar_skills
+from .popularity import POPULAR_ORDERING
+from .goals import with_progress
+from skilltracker.cache import cached, per_user
+from .responses import negotiated_response
+from . import downsampling
 import json
 
 class DashboardView(LoginRequiredMixin, View):
+    read_replica = True
+    
     def get(self, request):
         user = request.user
         today = timezone.now().date()
         
-        # get basic stats for dashboard
-        total_skills = Skill.objects.count()
         user_progress_entries = ProgressEntry.objects.filter(user=user)
-        total_hours = user_progress_entries.aggregate(Sum('hours_spent'))['hours_spent__sum']
-        if total_hours is None:
-            total_hours = 0
-        
-        # calculate goal statistics
         goals = Goal.objects.filter(user=user)
-        completed_goals = goals.filter(completed=True).count()
-        pending_goals = goals.filter(completed=False).count()
         
         # get recent activity for dashboard
         week_ago = today - timedelta(days=7)
@@ -34,6 +34,42 @@ class DashboardView(LoginRequiredMixin, View):
         
         upcoming_deadlines = goals.filter(completed=False, deadline__gte=today).order_by('deadline')[:5]
         
+        stats = self.get_stats(user)
+        charts = self.get_chart_data(user, today)
+        
+        context = {
+            'total_skills': self.get_total_skills(),
+            'total_hours': stats['total_hours'],
+            'completed_goals': stats['completed_goals'],
+            'pending_goals': stats['pending_goals'],
+            'recent_progress': recent_progress,
+            'upcoming_deadlines': upcoming_deadlines,
+            'today': today,
+            'category_data': json.dumps(charts['category_data']),
+            'daily_data': json.dumps(charts['daily_data']),
+            'skills_progress': charts['skills_progress'],
+        }
+        return render(request, 'tracker/dashboard.html', context)
+    
+    @cached(timeout=300)
+    def get_total_skills(self):
+        return Skill.objects.count()
+    
+    @cached(timeout=300, namespace=per_user)
+    def get_stats(self, user):
+        # lifetime totals include entries that were moved to the archive
+        total_hours, total_sessions = lifetime_totals(user)
+        goals = Goal.objects.filter(user=user)
+        return {
+            'total_hours': total_hours,
+            'completed_goals': goals.filter(completed=True).count(),
+            'pending_goals': goals.filter(completed=False).count(),
+        }
+    
+    @cached(timeout=300, namespace=per_user)
+    def get_chart_data(self, user, today):
+        user_progress_entries = ProgressEntry.objects.filter(user=user)
+        
         # prepare data for charts
         month_ago = today - timedelta(days=30)
         monthly_progress = user_progress_entries.filter(date__gte=month_ago)
@@ -59,30 +95,25 @@ class DashboardView(LoginRequiredMixin, View):
         daily_data.reverse()
         
         skills_progress = []
+        archived_hours = archived_hours_by_skill(user)
         for skill in Skill.objects.all()[:5]:
             skill_hours = user_progress_entries.filter(skill=skill).aggregate(Sum('hours_spent'))['hours_spent__sum'] or 0
+            skill_hours += archived_hours.get(skill.id, 0)
             skills_progress.append({
                 'name': skill.name,
                 'hours': float(skill_hours),
                 'category': skill.get_category_display()
             })
         
-        context = {
-            'total_skills': total_skills,
-            'total_hours': total_hours,
-            'completed_goals': completed_goals,
-            'pending_goals': pending_goals,
-            'recent_progress': recent_progress,
-            'upcoming_deadlines': upcoming_deadlines,
-            'today': today,
-            'category_data': json.dumps(category_data),
-            'daily_data': json.dumps(daily_data),
+        return {
+            'category_data': category_data,
+            'daily_data': daily_data,
             'skills_progress': skills_progress,
         }
-        return render(request, 'tracker/dashboard.html', context)
 
 
 class SkillListView(LoginRequiredMixin, ListView):
+    read_replica = True
     model = Skill
     template_name = 'tracker/skill_list.html'
     context_object_name = 'skills'
@@ -108,7 +139,11 @@ class SkillListView(LoginRequiredMixin, ListView):
         difficulty_filter = self.request.GET.get('difficulty')
         if difficulty_filter:
             queryset = queryset.filter(difficulty=difficulty_filter)
-            
+        
+        # learner and hour counts come precomputed from SkillCounters
+        queryset = queryset.select_related('counters')
+        if self.request.GET.get('sort') == 'popular':
+            return queryset.order_by(*POPULAR_ORDERING)
         return queryset.order_by('name')
     
     def get_context_data(self, **kwargs):
@@ -118,6 +153,7 @@ class SkillListView(LoginRequiredMixin, ListView):
         context['search_query'] = self.request.GET.get('search', '')
         context['selected_category'] = self.request.GET.get('category', '')
         context['selected_difficulty'] = self.request.GET.get('difficulty', '')
+        context['selected_sort'] = self.request.GET.get('sort', '')
         return context
 
 class SkillCreateView(LoginRequiredMixin, CreateView):
@@ -125,8 +161,20 @@ class SkillCreateView(LoginRequiredMixin, CreateView):
     form_class = SkillForm
     template_name = 'tracker/skill_form.html'
     success_url = reverse_lazy('tracker:skill_list')
+    
+    def form_valid(self, form):
+        # warn once about near-duplicates, a second submit creates the skill anyway
+        if not form.cleaned_data.get('confirm_duplicate'):
+            similar_skills = find_similar_skills(form.cleaned_data['name'])
+            if similar_skills:
+                return self.render_to_response(self.get_context_data(
+                    form=form,
+                    similar_skills=[skill for skill, score in similar_skills],
+                ))
+        return super().form_valid(form)
 
 class ProgressListView(LoginRequiredMixin, ListView):
+    read_replica = True
     model = ProgressEntry
     template_name = 'tracker/progress_list.html'
     context_object_name = 'progress_entries'
@@ -161,9 +209,7 @@ class ProgressListView(LoginRequiredMixin, ListView):
         context['selected_date_filter'] = self.request.GET.get('date_filter', '')
         context['selected_skill'] = self.request.GET.get('skill', '')
         
-        user_progress = ProgressEntry.objects.filter(user=self.request.user)
-        context['total_entries'] = user_progress.count()
-        context['total_hours'] = user_progress.aggregate(Sum('hours_spent'))['hours_spent__sum'] or 0
+        context['total_hours'], context['total_entries'] = lifetime_totals(self.request.user)
         context['avg_hours'] = context['total_hours'] / context['total_entries'] if context['total_entries'] > 0 else 0
         
         return context
@@ -197,13 +243,14 @@ class ProgressCreateView(LoginRequiredMixin, CreateView):
         return initial
 
 class GoalListView(LoginRequiredMixin, ListView):
+    read_replica = True
     model = Goal
     template_name = 'tracker/goal_list.html'
     context_object_name = 'goals'
     paginate_by = 20
     
     def get_queryset(self):
-        return Goal.objects.filter(user=self.request.user)
+        return with_progress(Goal.objects.filter(user=self.request.user))
 
 class GoalCreateView(LoginRequiredMixin, CreateView):
     model = Goal
@@ -232,13 +279,23 @@ class GoalToggleView(LoginRequiredMixin, View):
         return redirect('tracker:goal_list')
 
 class ResourceListView(LoginRequiredMixin, ListView):
+    read_replica = True
     model = LearningResource
     template_name = 'tracker/resource_list.html'
     context_object_name = 'resources'
     paginate_by = 20
     
     def get_queryset(self):
-        return LearningResource.objects.filter(user=self.request.user)
+        return LearningResource.objects.filter(user=self.request.user).select_related('skill')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # attach the cached link check results for this page in one query
+        resources = context['resources']
+        statuses = LinkStatus.objects.in_bulk([resource.url for resource in resources], field_name='url')
+        for resource in resources:
+            resource.link_status = statuses.get(resource.url)
+        return context
 
 class ResourceCreateView(LoginRequiredMixin, CreateView):
     model = LearningResource
@@ -263,6 +320,8 @@ class ResourceToggleView(LoginRequiredMixin, View):
         return redirect('tracker:resource_list')
 
 class ProgressChartDataView(LoginRequiredMixin, View):
+    read_replica = True
+    
     def get(self, request):
         """Return JSON data for progress charts"""
         user = request.user
@@ -270,48 +329,81 @@ class ProgressChartDataView(LoginRequiredMixin, View):
         
         end_date = date.today()
         start_date = end_date - timedelta(days=days)
+        data = self.get_chart_data(user, start_date, end_date)
         
+        # ?max_points=200 thins long ranges out to at most that many points
+        max_points = request.GET.get('max_points')
+        if max_points:
+            method = request.GET.get('method', 'lttb')
+            try:
+                max_points = int(max_points)
+            except ValueError:
+                max_points = 0
+            if max_points < 3 or method not in downsampling.METHODS:
+                return negotiated_response(request, {
+                    'error': f'max_points must be at least 3 and method one of {", ".join(downsampling.METHODS)}'
+                }, status=400)
+            data = self.downsample(data, start_date, end_date, max_points, method)
+        return negotiated_response(request, data)
+    
+    def downsample(self, data, start_date, end_date, max_points, method):
+        # every day of the range, idle ones as 0, so the shape is true to time
+        daily = data['daily_progress']
+        dates = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end_date - start_date).days + 1)]
+        values = [daily.get(day, 0.0) for day in dates]
+        if len(dates) <= max_points:
+            return dict(data, downsampling={'method': None, 'source_points': len(dates), 'max_points': max_points})
+        
+        kept_dates, kept_values, buckets = downsampling.downsample(dates, values, max_points, method)
+        return dict(
+            data,
+            daily_progress=dict(zip(kept_dates, kept_values)),
+            buckets=buckets,
+            downsampling={'method': method, 'source_points': len(dates), 'max_points': max_points},
+        )
+    
+    @cached(timeout=300, namespace=per_user)
+    def get_chart_data(self, user, start_date, end_date):
         progress_data = ProgressEntry.objects.filter(
             user=user,
             date__gte=start_date,
             date__lte=end_date
         )
         
-        daily_progress = {}
-        for entry in progress_data:
-            date_str = entry.date.strftime('%Y-%m-%d')
-            if date_str in daily_progress:
-                daily_progress[date_str] += float(entry.hours_spent)
-            else:
-                daily_progress[date_str] = float(entry.hours_spent)
+        # summed in the database, long ranges cover thousands of entries
+        daily_progress = {
+            day.strftime('%Y-%m-%d'): float(hours)
+            for day, hours in progress_data.values_list('date').annotate(hours=Sum('hours_spent')).order_by('date')
+        }
         
-        category_breakdown = {}
-        for entry in progress_data:
-            category = entry.skill.get_category_display()
-            if category in category_breakdown:
-                category_breakdown[category] += float(entry.hours_spent)
-            else:
-                category_breakdown[category] = float(entry.hours_spent)
+        categories = dict(Skill.CATEGORIES)
+        category_breakdown = {
+            categories.get(category, category): float(hours)
+            for category, hours in progress_data.values_list('skill__category').annotate(hours=Sum('hours_spent')).order_by()
+        }
         
-        return JsonResponse({
+        return {
             'daily_progress': daily_progress,
             'category_breakdown': category_breakdown,
             'total_hours': sum(daily_progress.values()),
             'total_days': len(daily_progress)
-        })
+        }
 
 class SkillStatsView(LoginRequiredMixin, View):
+    read_replica = True
+    
     def get(self, request, skill_id):
         """Return detailed stats for a specific skill"""
         skill = get_object_or_404(Skill, id=skill_id)
-        user = request.user
-        
+        return negotiated_response(request, self.get_skill_stats(request.user, skill))
+    
+    @cached(timeout=300, namespace=per_user)
+    def get_skill_stats(self, user, skill):
         progress_entries = ProgressEntry.objects.filter(user=user, skill=skill)
         goals = Goal.objects.filter(user=user, skill=skill)
         resources = LearningResource.objects.filter(user=user, skill=skill)
         
-        total_hours = progress_entries.aggregate(Sum('hours_spent'))['hours_spent__sum'] or 0
-        total_sessions = progress_entries.count()
+        total_hours, total_sessions = lifetime_totals(user, skill)
         completed_goals = goals.filter(completed=True).count()
         total_goals = goals.count()
         completed_resources = resources.filter(is_completed=True).count()
@@ -321,7 +413,7 @@ class SkillStatsView(LoginRequiredMixin, View):
             'date', 'hours_spent', 'description'
         ))
         
-        return JsonResponse({
+        return {
             'skill_name': skill.name,
             'total_hours': float(total_hours),
             'total_sessions': total_sessions,
@@ -331,4 +423,4 @@ class SkillStatsView(LoginRequiredMixin, View):
             'completed_resources': completed_resources,
             'total_resources': total_resources,
             'recent_progress': recent_progress
-        })
+        }